@@ -0,0 +1,138 @@
+##### DDS内存编码 #####
+"""
+不经过PNG临时文件和TexConv，直接在内存中把PIL图像编码成DDS（含mipmap链）：
+    - 未压缩：R8G8B8A8 / B8G8R8A8 / B8G8R8X8 / R8（含 _SRGB）
+    - 块压缩：BC1 / BC2 / BC3 / BC5（PIL自带的BCn编码器，每层编码后去掉PIL写的文件头）
+统一写DX10扩展头，DXGI格式（包括 _SRGB）与原贴图一致；mipmap逐层用box滤波缩小一半。
+其它格式（BC7、BC4、BC6H、浮点格式等）encode 返回None，由调用方交给TexConv。
+PIL 11.2 起才能保存BCn格式的DDS，更早的版本忽略 pixel_format 写成未压缩：
+首次用到某个块压缩格式时先编码一张4x4的图检查PIL写出的头，不支持时 supported 返回False，同样交给TexConv；
+每层编码后也按头中的格式和数据长度核对，不符时抛出 ValueError，不会写出错误的块数据。
+"""
+import io
+import struct
+from PIL import Image
+import dds_header
+import pixel_pipeline
+
+# 未压缩格式 -> (PIL模式, rawmode, 每像素字节数)
+RAW_FORMATS = {
+    "R8G8B8A8_UNORM": ("RGBA", "RGBA", 4), "R8G8B8A8_UNORM_SRGB": ("RGBA", "RGBA", 4),
+    "B8G8R8A8_UNORM": ("RGBA", "BGRA", 4), "B8G8R8A8_UNORM_SRGB": ("RGBA", "BGRA", 4),
+    "B8G8R8X8_UNORM": ("RGB", "BGRX", 4), "B8G8R8X8_UNORM_SRGB": ("RGB", "BGRX", 4),
+    "R8_UNORM": ("L", "L", 1),
+}
+# 块压缩格式 -> (PIL模式, PIL的pixel_format, 每个4x4块的字节数)
+BLOCK_FORMATS = {
+    "BC1_UNORM": ("RGBA", "DXT1", 8), "BC1_UNORM_SRGB": ("RGBA", "DXT1", 8),
+    "BC2_UNORM": ("RGBA", "DXT3", 16), "BC2_UNORM_SRGB": ("RGBA", "DXT3", 16),
+    "BC3_UNORM": ("RGBA", "DXT5", 16), "BC3_UNORM_SRGB": ("RGBA", "DXT5", 16),
+    "BC5_UNORM": ("RGB", "BC5", 16),
+}
+# PIL的pixel_format -> (PIL写出的旧式头FourCC, 写DX10头时的dxgiFormat)
+PIL_BLOCK_HEADERS = {
+    "DXT1": ({b"DXT1"}, {70, 71, 72}), "DXT3": ({b"DXT3"}, {73, 74, 75}),
+    "DXT5": ({b"DXT5"}, {76, 77, 78}), "BC5": ({b"ATI2", b"BC5U"}, {82, 83}),
+}
+DXGI_CODES = {name: code for code, name in dds_header.DXGI_FORMATS.items()}
+
+DDSD_CAPS, DDSD_HEIGHT, DDSD_WIDTH, DDSD_PITCH = 0x1, 0x2, 0x4, 0x8
+DDSD_PIXELFORMAT, DDSD_LINEARSIZE = 0x1000, 0x80000
+DDSCAPS_COMPLEX, DDSCAPS_TEXTURE, DDSCAPS_MIPMAP = 0x8, 0x1000, 0x400000
+DX10_TEXTURE2D = 3
+
+
+_pil_support = {}      # pixel_format -> 当前PIL能否正确编码
+
+
+def supported(fmt):
+    if fmt in RAW_FORMATS:
+        return True
+    return fmt in BLOCK_FORMATS and _pil_encodes(BLOCK_FORMATS[fmt])
+
+
+def _pil_encodes(block_format):
+    """编码一张4x4的图，检查PIL是否真的写出了该块压缩格式（结果缓存）"""
+    mode, pixel_format, block_bytes = block_format
+    if pixel_format not in _pil_support:
+        try:
+            buffer = io.BytesIO()
+            Image.new(mode, (4, 4)).save(buffer, "DDS", pixel_format=pixel_format)
+            _pil_support[pixel_format] = _block_payload(buffer.getvalue(), pixel_format, block_bytes) is not None
+        except Exception:
+            _pil_support[pixel_format] = False
+    return _pil_support[pixel_format]
+
+
+def _block_payload(data, pixel_format, expected):
+    """从PIL写出的DDS中取出块数据；头中的格式或数据长度不符时返回None"""
+    if len(data) < 128 or data[:4] != b"DDS ":
+        return None
+    fourccs, dxgi_formats = PIL_BLOCK_HEADERS[pixel_format]
+    fourcc = data[84:88]
+    if fourcc == b"DX10":
+        if len(data) < 148 or struct.unpack_from("<I", data, 128)[0] not in dxgi_formats:
+            return None
+        header = 148
+    elif fourcc in fourccs:
+        header = 128
+    else:
+        return None
+    if len(data) != header + expected:
+        return None
+    return data[header:]
+
+
+def full_mip_count(size):
+    """一直缩小到1x1的mipmap层数"""
+    return max(size).bit_length()
+
+
+def _header(size, fmt, mip_count):
+    width, height = size
+    flags = DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | dds_header.DDSD_MIPMAPCOUNT
+    if fmt in BLOCK_FORMATS:
+        flags |= DDSD_LINEARSIZE
+        pitch = max(1, (width + 3) // 4) * max(1, (height + 3) // 4) * BLOCK_FORMATS[fmt][2]
+    else:
+        flags |= DDSD_PITCH
+        pitch = width * RAW_FORMATS[fmt][2]
+    caps = DDSCAPS_TEXTURE | (DDSCAPS_COMPLEX | DDSCAPS_MIPMAP if mip_count > 1 else 0)
+    return (b"DDS " + struct.pack("<7I", 124, flags, height, width, pitch, 0, mip_count)
+            + bytes(44)
+            + struct.pack("<2I4s5I", 32, dds_header.DDPF_FOURCC, b"DX10", 0, 0, 0, 0, 0)
+            + struct.pack("<5I", caps, 0, 0, 0, 0)
+            + struct.pack("<5I", DXGI_CODES[fmt], DX10_TEXTURE2D, 0, 1, 0))
+
+
+def _encode_level(img, fmt):
+    if fmt in RAW_FORMATS:
+        return img.tobytes("raw", RAW_FORMATS[fmt][1])
+    _, pixel_format, block_bytes = BLOCK_FORMATS[fmt]
+    buffer = io.BytesIO()
+    img.save(buffer, "DDS", pixel_format=pixel_format)
+    expected = max(1, (img.width + 3) // 4) * max(1, (img.height + 3) // 4) * block_bytes
+    payload = _block_payload(buffer.getvalue(), pixel_format, expected)     # 去掉PIL写的文件头
+    if payload is None:
+        raise ValueError(f"PIL没有按 {pixel_format} 编码（{img.width}x{img.height}），请升级Pillow或改用TexConv")
+    return payload
+
+
+def encode(img, fmt, mip_count=1):
+    """把 img 编码为 fmt 格式、mip_count 层的DDS，返回字节；不支持的格式返回None"""
+    if not supported(fmt):
+        return None
+    mode = (RAW_FORMATS.get(fmt) or BLOCK_FORMATS[fmt])[0]
+    mip_count = max(1, min(mip_count, full_mip_count(img.size)))
+    level = pixel_pipeline.convert(img, mode)
+    parts = [_header(img.size, fmt, mip_count)]
+    for index in range(mip_count):
+        if index:
+            smaller = level.resize((max(1, level.width // 2), max(1, level.height // 2)), Image.BOX)
+            if level is not img:
+                level.close()
+            level = smaller
+        parts.append(_encode_level(level, fmt))
+    if level is not img:
+        level.close()
+    return b"".join(parts)
@@ -0,0 +1,100 @@
+##### DDS文件头读取 #####
+"""
+只读取DDS文件开头的148字节（4字节魔数 + 124字节DDS_HEADER + 可选20字节DX10扩展头），
+得到宽、高、mipmap层数和DXGI格式，不解码任何像素数据。
+同时支持旧式头（FourCC / 位掩码）和DX10扩展头，旧式格式统一换算成DXGI格式名。
+"""
+import os
+import struct
+
+# DXGI_FORMAT 编号 -> 名称（只列出贴图中常见的格式）
+DXGI_FORMATS = {
+    2: "R32G32B32A32_FLOAT", 10: "R16G16B16A16_FLOAT", 11: "R16G16B16A16_UNORM",
+    24: "R10G10B10A2_UNORM", 28: "R8G8B8A8_UNORM", 29: "R8G8B8A8_UNORM_SRGB",
+    34: "R16G16_FLOAT", 41: "R32_FLOAT", 49: "R8G8_UNORM", 54: "R16_FLOAT",
+    56: "R16_UNORM", 61: "R8_UNORM", 65: "A8_UNORM",
+    71: "BC1_UNORM", 72: "BC1_UNORM_SRGB", 74: "BC2_UNORM", 75: "BC2_UNORM_SRGB",
+    77: "BC3_UNORM", 78: "BC3_UNORM_SRGB", 80: "BC4_UNORM", 81: "BC4_SNORM",
+    83: "BC5_UNORM", 84: "BC5_SNORM", 85: "B5G6R5_UNORM", 86: "B5G5R5A1_UNORM",
+    87: "B8G8R8A8_UNORM", 88: "B8G8R8X8_UNORM", 91: "B8G8R8A8_UNORM_SRGB",
+    93: "B8G8R8X8_UNORM_SRGB", 95: "BC6H_UF16", 96: "BC6H_SF16",
+    98: "BC7_UNORM", 99: "BC7_UNORM_SRGB", 115: "B4G4R4A4_UNORM",
+}
+
+# 旧式头的 FourCC -> DXGI格式
+FOURCC_FORMATS = {
+    b"DXT1": "BC1_UNORM", b"DXT2": "BC2_UNORM", b"DXT3": "BC2_UNORM",
+    b"DXT4": "BC3_UNORM", b"DXT5": "BC3_UNORM",
+    b"ATI1": "BC4_UNORM", b"BC4U": "BC4_UNORM", b"BC4S": "BC4_SNORM",
+    b"ATI2": "BC5_UNORM", b"BC5U": "BC5_UNORM", b"BC5S": "BC5_SNORM",
+}
+
+# 旧式头的 (位数, R掩码, G掩码, B掩码, A掩码) -> DXGI格式
+MASK_FORMATS = {
+    (32, 0x000000ff, 0x0000ff00, 0x00ff0000, 0xff000000): "R8G8B8A8_UNORM",
+    (32, 0x00ff0000, 0x0000ff00, 0x000000ff, 0xff000000): "B8G8R8A8_UNORM",
+    (32, 0x00ff0000, 0x0000ff00, 0x000000ff, 0x00000000): "B8G8R8X8_UNORM",
+    (32, 0x3ff00000, 0x000ffc00, 0x000003ff, 0xc0000000): "R10G10B10A2_UNORM",
+    (16, 0xf800, 0x07e0, 0x001f, 0x0000): "B5G6R5_UNORM",
+    (16, 0x7c00, 0x03e0, 0x001f, 0x8000): "B5G5R5A1_UNORM",
+    (16, 0x0f00, 0x00f0, 0x000f, 0xf000): "B4G4R4A4_UNORM",
+    (16, 0x00ff, 0x0000, 0x0000, 0xff00): "R8G8_UNORM",
+    (8, 0xff, 0x00, 0x00, 0x00): "R8_UNORM",
+    (8, 0x00, 0x00, 0x00, 0xff): "A8_UNORM",
+}
+
+DDPF_ALPHAPIXELS = 0x1
+DDPF_FOURCC = 0x4
+DDPF_LUMINANCE = 0x20000
+DDSD_MIPMAPCOUNT = 0x20000
+HEADER_BYTES = 4 + 124 + 20
+
+
+def parse_header(data):
+    """解析DDS文件开头的字节，返回 {width, height, mip_count, format, dx10}
+    不是DDS或文件头不完整时抛出 ValueError
+    """
+    if len(data) < 128 or data[:4] != b"DDS " or struct.unpack_from("<I", data, 4)[0] != 124:
+        raise ValueError("不是有效的DDS文件")
+    flags, height, width = struct.unpack_from("<3I", data, 8)
+    mip_count = struct.unpack_from("<I", data, 28)[0]
+    if not flags & DDSD_MIPMAPCOUNT or mip_count == 0:
+        mip_count = 1
+    pf_flags, fourcc, bit_count, r_mask, g_mask, b_mask, a_mask = struct.unpack_from("<I4s5I", data, 80)
+
+    dx10 = bool(pf_flags & DDPF_FOURCC) and fourcc == b"DX10"
+    if dx10:
+        if len(data) < HEADER_BYTES:
+            raise ValueError("DX10扩展头不完整")
+        code = struct.unpack_from("<I", data, 128)[0]
+        fmt = DXGI_FORMATS.get(code, f"DXGI_{code}")
+    elif pf_flags & DDPF_FOURCC:
+        fmt = FOURCC_FORMATS.get(fourcc, fourcc.decode("latin-1").strip("\0"))
+    elif pf_flags & DDPF_LUMINANCE:
+        fmt = "R8G8_UNORM" if pf_flags & DDPF_ALPHAPIXELS else ("R16_UNORM" if bit_count == 16 else "R8_UNORM")
+    else:
+        if not pf_flags & DDPF_ALPHAPIXELS:
+            a_mask = 0
+        fmt = MASK_FORMATS.get((bit_count, r_mask, g_mask, b_mask, a_mask),
+                               f"{bit_count}bpp")
+    return {"width": width, "height": height, "mip_count": mip_count, "format": fmt, "dx10": dx10}
+
+
+def read_header(path):
+    """读取单个DDS文件的头信息"""
+    with open(path, "rb") as f:
+        return parse_header(f.read(HEADER_BYTES))
+
+
+def index_folder(folder):
+    """一次扫描目录中的所有DDS，返回 {文件名: 头信息}；无法解析的文件跳过"""
+    index = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            if not entry.is_file() or not entry.name.lower().endswith(".dds"):
+                continue
+            try:
+                index[entry.name] = read_header(entry.path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 无法读取DDS头 [{entry.name}]: {str(e)}")
+    return index
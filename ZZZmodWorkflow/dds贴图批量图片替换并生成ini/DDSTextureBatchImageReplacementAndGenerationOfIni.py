@@ -3,22 +3,35 @@ import re
 import shutil
 from PIL import Image
 import subprocess
+import sys
 import tkinter as tk
 from tkinter import simpledialog, messagebox
 
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_index
+import job_journal
+import dds_header
+import dds_encode
+import pixel_pipeline
+import mod_package
+import ini_writer
+
 # ------------------------- 配置部分 -------------------------
 dds_input_dir = "ddsInput"
 image_input_dir = "ddsImages"
 output_dir = "ddsOutput"
 texconv_path = "texconv.exe"
 ini_filename = "TextureMod.ini"
+package_path = "TextureMod.zip"         # 发布用压缩包（边转换边压缩），None则不打包
+
+# 输出格式：默认与ddsInput中每张原贴图的DXGI格式一致（DX10头 > 文件名 > 旧式头）
+default_format = "R8G8B8A8_UNORM_SRGB"   # 两者都无法识别时使用的格式
+preserve_mipmaps = True                  # 按原贴图的mipmap层数输出（False则只生成1层）
 
-# TexConv参数
+# TexConv通用参数（格式、sRGB、mip层数按原贴图自动添加）
 texconv_args = [
-    "-srgb",
-    "-f", "R8G8B8A8_UNORM_SRGB",
-    "-y",
-    "-m", "1"
+    "-y"
 ]
 # ----------------------------------------------------------
 
@@ -47,105 +60,210 @@ def get_hash_from_user():
 
 # ------------------------- 提取哈希对 -------------------------
 def parse_input_hashes():
-    """从ddsInput文件夹提取哈希对（hash1, hash2），忽略后缀名"""
+    """从ddsInput文件夹提取哈希对，忽略后缀名
+    返回 [(hash1, hash2, 贴图信息)]，贴图信息含 format/mip_count，
+    能读取DDS头时还有原贴图的 width/height（否则为None）
+    """
     hash_pairs = []
-    pattern = re.compile(r"(\w+)_(\w+)-R8G8B8A8_UNORM_SRGB\.\w+")
+    pattern = re.compile(r"(\w+)_(\w+)-(\w+)\.\w+$")
+    headers = dds_header.index_folder(dds_input_dir)
     for filename in os.listdir(dds_input_dir):
         match = pattern.match(filename)
         if match:
-            hash1, hash2 = match.groups()
-            hash_pairs.append((hash1, hash2))
+            hash1, hash2, name_format = match.groups()
+            header = headers.get(filename)
+            info = {"width": None, "height": None, "mip_count": 1, "format": name_format}
+            if header:
+                info.update(header)
+                # 旧式头无法表示sRGB等信息，此时以文件名中的格式为准
+                if not header["dx10"] and name_format in ENCODABLE_FORMATS:
+                    info["format"] = name_format
+            if info["format"] not in ENCODABLE_FORMATS:
+                print(f"⚠️ 无法识别的格式 {info['format']}（{filename}），改用 {default_format}")
+                info["format"] = default_format
+            if not preserve_mipmaps:
+                info["mip_count"] = 1
+            hash_pairs.append((hash1, hash2, info))
     return hash_pairs
 
+def output_basename(hash1, hash2, info):
+    """输出文件名（不含扩展名），格式部分与原贴图一致"""
+    return f"{hash1}_{hash2}-{info['format']}"
+
 # ------------------------- 重命名并垂直翻转图片 -------------------------
+def flip_image(src_path, temp_path, target_size=None, mode="RGB"):
+    """垂直翻转单张图片并保存为PNG（监视模式下单张重建也调用此函数）
+    给定 target_size 时先居中裁剪到目标比例并缩放到目标尺寸（一次重采样完成），
+    不必再事先用cut.py裁剪；mode 由输出格式决定（见 mode_of），透明通道会保留
+    """
+    with Image.open(src_path) as img:
+        if img.format == "JPEG":
+            # JPEG直接解码成目标通道；目标远小于原图时按比例缩小解码
+            draft_size = img.size
+            if target_size:
+                scale = max(target_size[0] / img.size[0], target_size[1] / img.size[1])
+                draft_size = (round(img.size[0] * scale) + 1, round(img.size[1] * scale) + 1)
+            img.draft("L" if mode == "L" else "RGB", draft_size)
+        img = pixel_pipeline.prepare(img, mode, target_size)
+        flipped_img = pixel_pipeline.transpose(img, Image.FLIP_TOP_BOTTOM)
+        flipped_img.save(temp_path, format="PNG")
+    pixel_pipeline.frame_done()
+
+def target_size_of(info):
+    """贴图信息 -> 目标尺寸，原贴图尺寸未知时返回None"""
+    return (info["width"], info["height"]) if info and info.get("width") else None
+
+def mode_of(info):
+    """贴图信息 -> 处理用模式（带透明通道的格式保留透明）"""
+    return pixel_pipeline.mode_for_format(info["format"])
+
 def rename_and_flip_images(hash_pairs):
-    """重命名并垂直翻转图片，返回临时文件列表（统一保存为PNG）"""
+    """重命名并垂直翻转图片，返回 [(临时PNG路径, 贴图信息)]（失败项为None）"""
     temp_files = []
-    image_files = sorted(
-        [f for f in os.listdir(image_input_dir) if os.path.isfile(os.path.join(image_input_dir, f))],
-        key=lambda x: x.lower()
-    )
+    # 按帧序索引依次对应哈希对
+    image_files = frame_index.ordered_files(image_input_dir)
     
     if len(image_files) != len(hash_pairs):
         raise ValueError(f"图片数量不匹配：ddsImages有{len(image_files)}个，ddsInput有{len(hash_pairs)}个")
 
     temp_dir = os.path.join(output_dir, "_temp")
     os.makedirs(temp_dir, exist_ok=True)
+    # 进度日志放在临时目录中，全部完成后随临时目录一起清理；
+    # 中途中断（或DDS转换失败）后重新运行，已翻转且源图未变的文件直接复用
+    journal = job_journal.JobJournal(temp_dir, "flip")
 
-    for idx, (old_name, (hash1, hash2)) in enumerate(zip(image_files, hash_pairs)):
-        src_path = os.path.join(image_input_dir, old_name)
-        new_name = f"{hash1}_{hash2}-R8G8B8A8_UNORM_SRGB.png"
-        temp_path = os.path.join(temp_dir, new_name)
-        
-        try:
-            with Image.open(src_path) as img:
-                if img.mode in ("P", "RGBA", "LA"):
-                    img = img.convert("RGB")
-                flipped_img = img.transpose(Image.FLIP_TOP_BOTTOM)
-                flipped_img.save(temp_path, format="PNG")
-            temp_files.append(temp_path)
-            print(f"[{idx+1}/{len(image_files)}] 处理完成：{old_name} -> {new_name}")
-        except Exception as e:
-            print(f"处理失败：{old_name} -> {new_name}（错误：{str(e)}）")
-            temp_files.append(None)
+    try:
+        for idx, (old_name, (hash1, hash2, info)) in enumerate(zip(image_files, hash_pairs)):
+            src_path = os.path.join(image_input_dir, old_name)
+            new_name = output_basename(hash1, hash2, info) + ".png"
+            temp_path = os.path.join(temp_dir, new_name)
+
+            if journal.done(new_name, temp_path, src_path):
+                temp_files.append((temp_path, info))
+                print(f"[{idx+1}/{len(image_files)}] 上次已完成，跳过：{old_name} -> {new_name}")
+                continue
+            
+            if target_size_of(info) is None:
+                print(f"⚠️ 无法读取原贴图尺寸，按原图尺寸输出：{hash1}_{hash2}")
+            try:
+                flip_image(src_path, temp_path, target_size_of(info), mode_of(info))
+                journal.record(new_name, temp_path, src_path)
+                temp_files.append((temp_path, info))
+                size_note = f"（{info['width']}x{info['height']} {info['format']}）" if info["width"] else ""
+                print(f"[{idx+1}/{len(image_files)}] 处理完成：{old_name} -> {new_name}{size_note}")
+            except Exception as e:
+                print(f"处理失败：{old_name} -> {new_name}（错误：{str(e)}）")
+                temp_files.append(None)
+    finally:
+        journal.close()
+    pixel_pipeline.report()
     
     return temp_files
 
-# ------------------------- 转换DDS -------------------------
-def convert_to_dds(temp_files):
-    """调用TexConv批量转换DDS，直接输出到output_dir"""
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 过滤掉None（处理失败的文件）
-    valid_files = [f for f in temp_files if f is not None and os.path.exists(f)]
-    
+# ------------------------- DDS编码器 -------------------------
+def texconv_encoder(files, fmt, mip_count):
+    """调用TexConv把同一格式的一组PNG一次编码，直接输出到output_dir"""
     cmd = [
         texconv_path,
         "-o", output_dir,
+        *(["-srgb"] if fmt.endswith("_SRGB") else []),
+        "-f", fmt,
+        "-m", str(mip_count),
         *texconv_args,
-        *valid_files
+        *files
     ]
+    subprocess.run(cmd, check=True)
+
+def memory_encoder(files, fmt, mip_count):
+    """用 dds_encode 在本进程内编码（不启动TexConv），每张写临时文件后替换到output_dir"""
+    for path in files:
+        with Image.open(path) as img:
+            data = dds_encode.encode(img, fmt, mip_count)
+        dds_path = os.path.join(output_dir, os.path.splitext(os.path.basename(path))[0] + ".dds")
+        with open(dds_path + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(dds_path + ".tmp", dds_path)
+
+# 格式 -> 编码函数 (文件列表, 格式, mip层数)；未登记的格式使用 texconv_encoder
+ENCODERS = {fmt: memory_encoder for fmt in dds_header.DXGI_FORMATS.values() if dds_encode.supported(fmt)}
+# texconv 可输出的格式
+ENCODABLE_FORMATS = set(dds_header.DXGI_FORMATS.values())
+
+# ------------------------- 转换DDS -------------------------
+def convert_to_dds(temp_files, on_output=None):
+    """按 (格式, mip层数) 分组，每组调用一次对应编码器，直接输出到output_dir
+    on_output - 每组完成后以该组输出的DDS路径列表调用（用于边转换边打包）
+    """
+    os.makedirs(output_dir, exist_ok=True)
     
-    try:
-        subprocess.run(cmd, check=True)
-        print("DDS转换完成！")
-        return output_dir
-    except subprocess.CalledProcessError as e:
-        print(f"TexConv转换失败：{e}")
-        return None
+    # 过滤掉None（处理失败的文件）后分组
+    groups = {}
+    for item in temp_files:
+        if item is None or not os.path.exists(item[0]):
+            continue
+        path, info = item
+        groups.setdefault((info["format"], info["mip_count"]), []).append(path)
+    
+    success = True
+    for (fmt, mip_count), files in groups.items():
+        encoder = ENCODERS.get(fmt, texconv_encoder)
+        try:
+            encoder(files, fmt, mip_count)
+            print(f"DDS转换完成：{fmt}（{len(files)}个）")
+            if on_output:
+                on_output([os.path.join(output_dir, os.path.splitext(os.path.basename(f))[0] + ".dds")
+                           for f in files])
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            print(f"DDS转换失败（{fmt}）：{e}")
+            success = False
+    return output_dir if success else None
 
 # ------------------------- 生成INI文件 -------------------------
 def generate_ini(dds_output_dir, slotcheck_hash):
     """生成INI文件（使用用户输入的哈希值）"""
     ini_path = os.path.join(output_dir, ini_filename)
-    pattern = re.compile(r"(\w+)_(\w+)-R8G8B8A8_UNORM_SRGB\.dds")
-    entries = []
+    pattern = re.compile(r"(\w+)_(\w+)-(\w+)\.dds$")
     
-    # 遍历DDS文件生成配置
+    # 同一hash1可能残留旧格式的输出，只保留最新生成的一个
+    latest = {}
     for filename in os.listdir(dds_output_dir):
-        if not filename.endswith(".dds"):
-            continue
         match = pattern.match(filename)
         if not match:
             continue
-        hash1, hash2 = match.groups()
-        entries.append(
-            f"[TextureOverride_Texture_{hash1}]\n"
-            f"hash = {hash1}\n"
-            f"this = ResourceTexture_{hash1}\n\n"
-            f"[ResourceTexture_{hash1}]\n"
-            f"filename = {filename}\n"
-        )
+        mtime = os.path.getmtime(os.path.join(dds_output_dir, filename))
+        hash1 = match.group(1)
+        if hash1 not in latest or mtime > latest[hash1][0]:
+            latest[hash1] = (mtime, filename)
+    
+    ini = ini_writer.IniWriter()
+    slot_check_section(ini, slotcheck_hash)
+    # 遍历DDS文件生成配置
+    for hash1, (_, filename) in sorted(latest.items()):
+        (ini.section(f"TextureOverride_Texture_{hash1}")
+            .set("hash", hash1)
+            .set("this", f"ResourceTexture_{hash1}"))
+        ini.section(f"ResourceTexture_{hash1}").set("filename", filename)
     
     # 写入INI文件
-    with open(ini_path, "w") as f:
-        f.write(f"[TextureOverride_IB_SlotCheck]\n")
-        f.write(f"hash = {slotcheck_hash}\n")
-        f.write("match_priority = 0\n")
-        f.write("run = CommandListSkinTexture\n\n")
-        f.write("\n".join(entries))
+    ini.write(ini_path)
     print(f"INI文件已生成：{ini_path}")
 
+def slot_check_section(ini, slotcheck_hash):
+    """IB_SlotCheck 节（静态和动态贴图INI共用）"""
+    return (ini.section("TextureOverride_IB_SlotCheck")
+            .set("hash", slotcheck_hash)
+            .set("match_priority", 0)
+            .set("run", "CommandListSkinTexture"))
+
+def read_slotcheck_hash():
+    """从已生成的INI中读取 IB_SlotCheck 哈希值，没有时返回None"""
+    ini_path = os.path.join(output_dir, ini_filename)
+    if not os.path.exists(ini_path):
+        return None
+    with open(ini_path, "r") as f:
+        match = re.search(r"\[TextureOverride_IB_SlotCheck\]\s*hash = (\w+)", f.read())
+    return match.group(1) if match else None
+
 # ------------------------- 主函数 -------------------------
 def main():
     # 步骤0：用户输入哈希值
@@ -171,9 +289,13 @@ def main():
         print(str(e))
         return
     
-    # 步骤3：转换DDS
-    dds_output_dir = convert_to_dds(temp_files)
+    # 步骤3：转换DDS（每组格式转换完成后立即交给打包线程压缩）
+    package = mod_package.PackageWriter(package_path) if package_path else None
+    on_output = (lambda paths: [package.add(path) for path in paths]) if package else None
+    dds_output_dir = convert_to_dds(temp_files, on_output)
     if not dds_output_dir:
+        if package:
+            package.abort()
         print("DDS转换失败，脚本终止。")
         return
     
@@ -183,6 +305,17 @@ def main():
     except Exception as e:
         print(f"生成INI文件失败：{str(e)}")
     
+    # 步骤4.5：打包（INI放在最后，写入清单）
+    if package:
+        try:
+            ini_path = os.path.join(output_dir, ini_filename)
+            if os.path.exists(ini_path):
+                package.add(ini_path)
+            manifest = package.close()
+            print(f"MOD已打包：{package_path}（{len(manifest['files'])}个文件）")
+        except Exception as e:
+            print(f"打包失败：{str(e)}")
+    
     # 步骤5：清理临时文件
     temp_dir = os.path.join(output_dir, "_temp")
     if os.path.exists(temp_dir):
@@ -0,0 +1,248 @@
+#####动态贴图MOD生成#####
+"""
+把 动态贴图生成/stitching.py 拼好的序列帧拼接图直接做成替换 ddsInput 中某张贴图的动态贴图MOD：
+    - atlas 模式：拼接图各页垂直翻转后在内存中编码成DDS图集（一页一张，代替几十张逐帧贴图）；
+      INI 在 [Present] 中用3DMigoto的 time 变量按帧率算出当前帧，换算成该帧在图集中的UV偏移，
+      经 IniParams 的 x/y/z/w{uv_params} 传给着色器（采样前 uv = uv * float2(z, w) + float2(x, y)）
+    - frames 模式：每帧从拼接图中裁出，缩放到原贴图尺寸后各编码成一张DDS，
+      INI 按当前帧切换 this 引用的资源，不需要改着色器
+帧数、格子位置和页数读取拼接图的页/帧索引（*.index.json）；DXGI格式、mipmap层数与
+DDSTextureBatchImageReplacementAndGenerationOfIni.py 一样取自原贴图。
+PIL能编码的格式（未压缩、BC1/BC2/BC3/BC5）在内存中完成，其它格式（如BC7）写临时PNG交给TexConv。
+"""
+import os
+import sys
+import shutil
+from PIL import Image
+
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import sheet_builder
+import dds_encode
+import ini_writer
+import pixel_pipeline
+import mod_package
+import DDSTextureBatchImageReplacementAndGenerationOfIni as dds_tool
+
+# ========== 全局配置 ==========
+sheet_path = "../动态贴图生成/stitchingOutput.jpg"    # stitching.py 的输出（同目录下需有 <文件名>.index.json）
+mode = "atlas"                  # atlas：图集+UV偏移（需着色器读取IniParams）；frames：逐帧贴图切换
+fps = 12                        # 播放帧率
+target_hash = None              # 要替换的原贴图 hash1；None 时 ddsInput 中只能有一张贴图
+uv_params = 87                  # atlas模式：UV偏移/缩放写入 IniParams 的 x/y/z/w 序号
+ini_filename = "AnimatedTexture.ini"
+package_path = None             # 发布用压缩包，None则不打包
+# =============================
+
+MODES = ("atlas", "frames")
+
+
+# ------------------------- 输入 -------------------------
+def pick_target(hash_pairs):
+    """从ddsInput的哈希对中选出要替换的贴图"""
+    if target_hash:
+        for pair in hash_pairs:
+            if pair[0].lower() == target_hash.lower():
+                return pair
+        raise ValueError(f"ddsInput中没有 hash1 为 {target_hash} 的贴图")
+    if len(hash_pairs) != 1:
+        raise ValueError(f"ddsInput中有{len(hash_pairs)}张贴图，请设置 target_hash 指定要替换的一张")
+    return hash_pairs[0]
+
+
+def page_file(index, page):
+    return os.path.join(os.path.dirname(os.path.abspath(sheet_path)), index["pages"][page]["file"])
+
+
+# ------------------------- 编码DDS -------------------------
+class DdsWriter:
+    """内存编码DDS直接写到输出目录；PIL不能编码的格式先存临时PNG，flush() 时按格式一次交给TexConv"""
+    def __init__(self, info, on_output=None):
+        self.info = info
+        self.on_output = on_output
+        self.temp_dir = os.path.join(dds_tool.output_dir, "_temp")
+        self.pending = []
+        os.makedirs(dds_tool.output_dir, exist_ok=True)
+
+    def write(self, img, name):
+        """编码 img 为 <name>.dds，返回文件名"""
+        data = dds_encode.encode(img, self.info["format"], self.info["mip_count"])
+        if data is None:
+            os.makedirs(self.temp_dir, exist_ok=True)
+            temp_path = os.path.join(self.temp_dir, name + ".png")
+            img.save(temp_path, format="PNG")
+            self.pending.append((temp_path, self.info))
+        else:
+            path = os.path.join(dds_tool.output_dir, name + ".dds")
+            with open(path + ".tmp", "wb") as f:
+                f.write(data)
+            os.replace(path + ".tmp", path)
+            if self.on_output:
+                self.on_output([path])
+        return name + ".dds"
+
+    def flush(self):
+        """转换剩余的临时PNG，失败时返回False"""
+        if not self.pending:
+            return True
+        ok = dds_tool.convert_to_dds(self.pending, self.on_output) is not None
+        self.pending = []
+        if os.path.exists(self.temp_dir):
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+        return ok
+
+
+def encode_atlas(index, layout, hash1, writer):
+    """各页垂直翻转后编码成图集，返回各页的DDS文件名"""
+    mode = pixel_pipeline.mode_for_format(writer.info["format"])
+    names = []
+    for page in range(layout.pages):
+        with Image.open(page_file(index, page)) as img:
+            flipped = pixel_pipeline.transpose(pixel_pipeline.convert(img, mode), Image.FLIP_TOP_BOTTOM)
+        with flipped:
+            names.append(writer.write(flipped, f"Animated_{hash1}_atlas{page}"))
+        print(f"[{page + 1}/{layout.pages}] 图集页编码完成：{names[-1]}（{layout.page_size[0]}x{layout.page_size[1]}）")
+    return names
+
+
+def encode_frames(index, layout, hash1, writer):
+    """逐帧裁出、缩放到原贴图尺寸并垂直翻转后编码，返回各帧的DDS文件名"""
+    mode = pixel_pipeline.mode_for_format(writer.info["format"])
+    target_size = dds_tool.target_size_of(writer.info)
+    tile_w, tile_h = layout.tile_size
+    names = []
+    current_page, page_img = None, None
+    try:
+        for frame in index["frames"]:
+            if frame["page"] != current_page:       # 帧按页顺序排列，同时只打开一页
+                if page_img is not None:
+                    page_img.close()
+                current_page = frame["page"]
+                page_img = Image.open(page_file(index, current_page))
+                page_img.load()
+            box = (frame["x"], frame["y"], frame["x"] + tile_w, frame["y"] + tile_h)
+            img = pixel_pipeline.prepare(page_img, mode, target_size, box=box)
+            with pixel_pipeline.transpose(img, Image.FLIP_TOP_BOTTOM) as flipped:
+                names.append(writer.write(flipped, f"Animated_{hash1}_frame{frame['frame']:03d}"))
+            img.close()
+            pixel_pipeline.frame_done()
+    finally:
+        if page_img is not None:
+            page_img.close()
+    print(f"逐帧编码完成：{len(names)}张")
+    pixel_pipeline.report()
+    return names
+
+
+# ------------------------- 生成INI -------------------------
+def frame_counter(ini, count):
+    """[Constants] 和 [Present]：按 time 计算当前帧，返回这两节"""
+    constants = ini.section("Constants").set("global $fps", fps).set("global $frame", 0)
+    present = ini.section("Present").line(f"$frame = (time * $fps // 1) % {count}")
+    return constants, present
+
+
+def atlas_uv(layout):
+    """每格在页上占的UV宽高"""
+    return layout.tile_size[0] / layout.page_size[0], layout.tile_size[1] / layout.page_size[1]
+
+
+def atlas_counter(ini, layout, count):
+    """图集：当前帧 -> 所在页和UV偏移（页已垂直翻转，v 从页底部算起）"""
+    tile_u, tile_v = atlas_uv(layout)
+    per_page, columns = layout.per_page, layout.columns
+    constants, present = frame_counter(ini, count)
+    constants.set("global $page", 0).set("global $u", 0).set("global $v", 0)
+    if layout.pages > 1:
+        present.line(f"$page = $frame // {per_page}")
+    present.line(f"$u = (($frame % {per_page}) % {columns}) * {ini_writer.format_value(tile_u)}")
+    present.line(f"$v = 1 - (($frame % {per_page}) // {columns} + 1) * {ini_writer.format_value(tile_v)}")
+
+
+def generate_ini(layout, hash1, names, slotcheck_hash, count):
+    ini = ini_writer.IniWriter()
+    ini.comment(f"动态贴图：{count}帧，{fps}帧/秒（{mode}模式），由 animatedTexture.py 生成")
+    override_name = f"TextureOverride_Texture_{hash1}"
+    if mode == "atlas":
+        atlas_counter(ini, layout, count)
+        dds_tool.slot_check_section(ini, slotcheck_hash)
+        override = ini.section(override_name).set("hash", hash1)
+        resources = [f"ResourceAtlas_{hash1}_{page}" for page in range(len(names))]
+        if len(resources) == 1:
+            override.set("this", resources[0])
+        else:
+            override.branch([(f"$page == {page}", [("this", resource)])
+                             for page, resource in enumerate(resources)])
+        tile_u, tile_v = atlas_uv(layout)
+        (override
+            .comment(f"着色器采样前：uv = uv * float2(z{uv_params}, w{uv_params}) + float2(x{uv_params}, y{uv_params})")
+            .set(f"x{uv_params}", "$u")
+            .set(f"y{uv_params}", "$v")
+            .set(f"z{uv_params}", tile_u)
+            .set(f"w{uv_params}", tile_v))
+    else:
+        frame_counter(ini, count)
+        dds_tool.slot_check_section(ini, slotcheck_hash)
+        resources = [f"ResourceFrame_{hash1}_{frame}" for frame in range(len(names))]
+        (ini.section(override_name)
+            .set("hash", hash1)
+            .branch([(f"$frame == {frame}", [("this", resource)]) for frame, resource in enumerate(resources)]))
+    for resource, name in zip(resources, names):
+        ini.section(resource).set("filename", name)
+
+    ini_path = os.path.join(dds_tool.output_dir, ini_filename)
+    ini.write(ini_path)
+    print(f"INI文件已生成：{ini_path}")
+    return ini_path
+
+
+# ------------------------- 主函数 -------------------------
+def main():
+    if mode not in MODES:
+        print(f"❌ 未知的模式：{mode}（可选 {'/'.join(MODES)}）")
+        return
+    index = sheet_builder.read_index(sheet_path)
+    if index is None:
+        print(f"❌ 找不到拼接图索引：{sheet_builder.index_path(sheet_path)}，请先运行 stitching.py")
+        return
+    layout = sheet_builder.SheetLayout.from_index(index)
+    count = len(index["frames"])
+    if count == 0:
+        print("❌ 拼接图中没有帧")
+        return
+
+    try:
+        hash1, hash2, info = pick_target(dds_tool.parse_input_hashes())
+    except (OSError, ValueError) as e:
+        print(f"❌ {e}")
+        return
+    slotcheck_hash = dds_tool.read_slotcheck_hash() or dds_tool.get_hash_from_user()
+    if slotcheck_hash is None:
+        print("用户取消输入，脚本终止。")
+        return
+    print(f"替换贴图 {hash1}（{info['format']}，{info['mip_count']}层mipmap），{count}帧，{layout.describe()}")
+
+    package = mod_package.PackageWriter(package_path) if package_path else None
+    on_output = (lambda paths: [package.add(path) for path in paths]) if package else None
+    writer = DdsWriter(info, on_output)
+    try:
+        encode = encode_atlas if mode == "atlas" else encode_frames
+        names = encode(index, layout, hash1, writer)
+        if not writer.flush():
+            raise OSError("TexConv转换失败")
+        ini_path = generate_ini(layout, hash1, names, slotcheck_hash, count)
+    except Exception as e:
+        if package:
+            package.abort()
+        print(f"❌ 生成失败：{e}")
+        return
+
+    if package:
+        package.add(ini_path)
+        manifest = package.close()
+        print(f"MOD已打包：{package_path}（{len(manifest['files'])}个文件）")
+    print(f"✅ 动态贴图MOD已生成：{dds_tool.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,31 @@
 from PIL import Image
 import os
 import tempfile
-import re
+import sys
 import tkinter as tk
 from tkinter import simpledialog, messagebox, filedialog
 import traceback
 
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jpeg_lossless
+import frame_index
+import pixel_pipeline
+import tiled_io
+import frame_stack
+try:
+    import saliency_crop  # 自动定位需要numpy
+except ImportError:
+    saliency_crop = None
+
 # ========== 全局配置 ==========
-file_exts = ('.jpg', '.png', '.jpeg', '.webp')  # 支持的文件格式
+file_exts = ('.jpg', '.png', '.jpeg', '.webp', '.tif', '.tiff')  # 支持的文件格式
 # =============================
 
 def safe_open_image(path):
-    """安全打开图片文件，处理特殊字符"""
+    """安全打开图片文件，处理特殊字符（只读文件头，超大图交给分块路径，不受解压炸弹限制）"""
     try:
-        return Image.open(path)
+        return tiled_io.open_image(path)
     except Exception as e:
         print(f"无法打开文件 [{path}]: {str(e)}")
         return None
@@ -29,11 +41,6 @@ def select_input_folder():
     root.destroy()
     return folder if folder else None
 
-def natural_sort_key(s):
-    """自然排序键函数，用于实现人类直觉排序"""
-    return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', s)]
-
 def get_crop_settings():
     """弹窗获取裁剪设置"""
     root = tk.Tk()
@@ -95,10 +102,11 @@ def get_crop_settings():
         "3. 右边 (垂直居中)\n"
         "4. 自定义坐标\n"
         "5. 左上角\n"
-        "6. 右下角\n\n"
-        "请输入数字 (1-6):",
+        "6. 右下角\n"
+        "7. 自动（按画面主体，先生成裁剪计划）\n\n"
+        "请输入数字 (1-7):",
         minvalue=1,
-        maxvalue=6
+        maxvalue=7
     )
     
     return crop_ratio, target_size, position
@@ -122,21 +130,26 @@ def get_crop_position(img_width, img_height, crop_w, crop_h, position_mode):
     elif position_mode == 6: # 右下角
         return (img_width - crop_w, img_height - crop_h)
 
+def calculate_crop_size(img_width, img_height, crop_ratio, target_size):
+    """计算裁剪尺寸"""
+    if crop_ratio:
+        ratio = crop_ratio[0] / crop_ratio[1]
+        if img_width / img_height > ratio:
+            crop_h = img_height
+            crop_w = int(crop_h * ratio)
+        else:
+            crop_w = img_width
+            crop_h = int(crop_w / ratio)
+    else:
+        crop_w = min(target_size[0], img_width)
+        crop_h = min(target_size[1], img_height)
+    return crop_w, crop_h
+
 def calculate_crop_box(img_width, img_height, crop_ratio, target_size, position_mode):
     """计算裁剪区域"""
     try:
         # 计算裁剪尺寸
-        if crop_ratio:
-            ratio = crop_ratio[0] / crop_ratio[1]
-            if img_width / img_height > ratio:
-                crop_h = img_height
-                crop_w = int(crop_h * ratio)
-            else:
-                crop_w = img_width
-                crop_h = int(crop_w / ratio)
-        else:
-            crop_w = min(target_size[0], img_width)
-            crop_h = min(target_size[1], img_height)
+        crop_w, crop_h = calculate_crop_size(img_width, img_height, crop_ratio, target_size)
 
         # 获取定位坐标
         position = get_crop_position(img_width, img_height, crop_w, crop_h, position_mode)
@@ -149,6 +162,88 @@ def calculate_crop_box(img_width, img_height, crop_ratio, target_size, position_
         messagebox.showerror("计算错误", f"区域计算失败: {str(e)}")
         return None
 
+def prepare_auto_plan(input_folder, files, crop_ratio, target_size):
+    """自动定位：生成（或复用已有的）裁剪计划，用户确认后返回 {文件名: 裁剪框}"""
+    if saliency_crop is None:
+        messagebox.showerror("错误", "自动定位需要先安装numpy：pip install numpy")
+        return None
+    
+    plan_path = os.path.join(input_folder, saliency_crop.PLAN_FILENAME)
+    if os.path.exists(plan_path) and messagebox.askyesno(
+            "裁剪计划",
+            f"发现已有裁剪计划：\n{plan_path}\n\n是否直接按该计划裁剪？\n（选“否”将重新计算）"):
+        return saliency_crop.load_crop_plan(input_folder)
+    
+    print("正在分析画面主体…")
+    plan_path, plan = saliency_crop.build_crop_plan(
+        input_folder, files,
+        lambda w, h: calculate_crop_size(w, h, crop_ratio, target_size)
+    )
+    print(f"裁剪计划已生成：{plan_path}")
+    if not messagebox.askyesno(
+            "裁剪计划",
+            f"已为 {len(plan)} 张图片生成裁剪计划：\n{plan_path}\n\n"
+            "可先打开检查或修改坐标。\n现在就按计划裁剪吗？\n"
+            "（选“否”则稍后重新运行并选择模式7应用计划）"):
+        return None
+    return saliency_crop.load_crop_plan(input_folder)
+
+def crop_uniform_frames(input_folder, files, crop_ratio, target_size, position_mode):
+    """尺寸、模式都相同的非JPEG帧裁剪框都相同：只算一次，按内存预算整批读入数组裁剪
+    返回 (已处理的帧数, 仍需逐张处理的文件)；JPEG仍逐张走无损裁剪
+    """
+    candidates = [f for f in files if not f.lower().endswith(('.jpg', '.jpeg'))]
+    if position_mode == 4 or not frame_stack.available(len(candidates)):
+        return 0, files     # 自定义坐标需要逐张输入
+    shape = frame_stack.uniform([os.path.join(input_folder, f) for f in candidates])
+    if shape is None or shape[0][0] * shape[0][1] > tiled_io.TILE_THRESHOLD:
+        return 0, files
+    (width, height), mode = shape
+    crop_box = calculate_crop_box(width, height, crop_ratio, target_size, position_mode)
+    if not crop_box:
+        return 0, files
+    crop_box = (max(0, crop_box[0]), max(0, crop_box[1]), min(width, crop_box[2]), min(height, crop_box[3]))
+    print(f"\n=== 整批裁剪 {len(candidates)} 张 {width}x{height} 的图片，裁剪区域: {crop_box} ===")
+
+    processed = 0
+    retry = set()
+    for batch in frame_stack.batches(candidates, (width, height), mode):
+        try:
+            stack = frame_stack.crop(frame_stack.load(
+                [os.path.join(input_folder, f) for f in batch], (width, height), mode), crop_box)
+        except Exception as e:
+            print(f"⚠️ 整批读取失败（{str(e)}），这一批改为逐张处理")
+            retry.update(batch)
+            continue
+
+        def save_frame(index):
+            """取出一帧编码到临时文件后覆盖原文件（在线程池中并行执行）"""
+            input_path = os.path.join(input_folder, batch[index])
+            temp_path = None
+            try:
+                # 只在目标格式存不下当前模式时转换，PNG等保留透明通道
+                out_mode = pixel_pipeline.mode_for_file(input_path, mode)
+                cropped = frame_stack.frame(frame_stack.convert(stack[index:index + 1], mode, out_mode), 0, out_mode)
+                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(input_path)[1]) as tmp_file:
+                    temp_path = tmp_file.name
+                cropped.save(temp_path, quality=95)
+                os.replace(temp_path, input_path)
+                return cropped.size
+            finally:
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+        for index, new_size, error in frame_stack.map_frames(save_frame, range(len(batch))):
+            if error is not None:
+                print(f"❌ 处理失败: {batch[index]}: {str(error)}")
+                continue
+            pixel_pipeline.frame_done()
+            processed += 1
+            print(f"✅ 整批裁剪成功: {batch[index]} | 新尺寸: {new_size[0]}x{new_size[1]}")
+        del stack
+    done = set(candidates) - retry
+    return processed, [f for f in files if f not in done]
+
 def batch_crop_images(input_folder):
     """批量裁剪主逻辑"""
     if not input_folder or not os.path.isdir(input_folder):
@@ -156,9 +251,7 @@ def batch_crop_images(input_folder):
         return
 
     try:
-        files = sorted([f for f in os.listdir(input_folder) 
-                      if f.lower().endswith(file_exts)],
-                      key=natural_sort_key)
+        files = frame_index.ordered_files(input_folder, file_exts)
     except Exception as e:
         messagebox.showerror("错误", f"读取目录失败: {str(e)}")
         return
@@ -168,9 +261,20 @@ def batch_crop_images(input_folder):
     if not all([crop_ratio or target_size, position_mode]):
         messagebox.showinfo("信息", "操作已取消")
         return
+    
+    # 自动定位：整批计算并确认裁剪计划，不再逐张询问
+    plan = None
+    if position_mode == 7:
+        plan = prepare_auto_plan(input_folder, files, crop_ratio, target_size)
+        if plan is None:
+            messagebox.showinfo("信息", "未应用裁剪计划")
+            return
 
     processed = 0
-    for filename in files:
+    remaining = files
+    if plan is None:
+        processed, remaining = crop_uniform_frames(input_folder, files, crop_ratio, target_size, position_mode)
+    for filename in remaining:
         # 处理特殊字符文件名
         safe_filename = filename.encode('utf-8', 'surrogateescape').decode('utf-8')
         input_path = os.path.join(input_folder, safe_filename)
@@ -192,10 +296,13 @@ def batch_crop_images(input_folder):
                 # 计算裁剪区域
                 original_width, original_height = img.size
                 print(f"原始尺寸: {original_width}x{original_height}")
-                crop_box = calculate_crop_box(
-                    original_width, original_height,
-                    crop_ratio, target_size, position_mode
-                )
+                if plan is not None:
+                    crop_box = plan.get(safe_filename)
+                else:
+                    crop_box = calculate_crop_box(
+                        original_width, original_height,
+                        crop_ratio, target_size, position_mode
+                    )
                 
                 # 严格验证裁剪框
                 if not crop_box:
@@ -214,8 +321,13 @@ def batch_crop_images(input_folder):
                 
                 print(f"最终裁剪区域: {crop_box}")
                 
-                # 执行裁剪
-                cropped = img.crop(crop_box)
+                # JPEG裁剪框左上角对齐MCU时直接在DCT系数域无损裁剪
+                if img.format == 'JPEG' and jpeg_lossless.transform_jpeg_file(input_path, temp_path, crop_box=crop_box):
+                    img.close()  # 先释放原文件句柄再覆盖
+                    os.replace(temp_path, input_path)
+                    processed += 1
+                    print(f"✅ 无损裁剪成功 | 新尺寸: {crop_box[2]-crop_box[0]}x{crop_box[3]-crop_box[1]}")
+                    continue
                 
                 # 保存文件
                 save_args = {'quality': 95}
@@ -224,9 +336,30 @@ def batch_crop_images(input_folder):
                 
                 # 保留元数据（兼容处理）
                 exif = img.info.get('exif', b'')
-                if cropped.mode in ('P', 'RGBA'):
-                    cropped = cropped.convert('RGB')
+                
+                # 超大原图：按条带只解码裁剪区域并逐条带写出，结果与整幅裁剪相同
+                if tiled_io.should_tile(img):
+                    out_mode = pixel_pipeline.mode_for_file(input_path, img.mode)
+                    crop_size = (crop_box[2] - crop_box[0], crop_box[3] - crop_box[1])
+                    img.close()
+                    tiled_io.save_strips(
+                        tiled_io.iter_strips(input_path, crop_box), temp_path, crop_size,
+                        convert=lambda strip: pixel_pipeline.convert(strip, out_mode),
+                        exif=exif, **save_args
+                    )
+                    pixel_pipeline.frame_done()
+                    os.replace(temp_path, input_path)
+                    processed += 1
+                    print(f"✅ 分块裁剪成功 | 新尺寸: {crop_size[0]}x{crop_size[1]}")
+                    continue
+                
+                # 执行裁剪
+                cropped = pixel_pipeline.prepare(img, img.mode, box=crop_box)
+                
+                # 只在目标格式存不下当前模式时转换（例如JPEG不能带透明），PNG等保留透明通道
+                cropped = pixel_pipeline.convert(cropped, pixel_pipeline.mode_for_file(input_path, cropped.mode))
                 cropped.save(temp_path, exif=exif, **save_args)
+                pixel_pipeline.frame_done()
                 
                 # 覆盖原始文件
                 os.replace(temp_path, input_path)
@@ -243,6 +376,13 @@ def batch_crop_images(input_folder):
                 except Exception as e:
                     print(f"清理临时文件失败: {str(e)}")
 
+    # 计划已应用，改名留档，避免下次对已裁剪的图片重复使用
+    if plan is not None:
+        plan_path = os.path.join(input_folder, saliency_crop.PLAN_FILENAME)
+        if os.path.exists(plan_path):
+            os.replace(plan_path, plan_path + ".applied")
+
+    pixel_pipeline.report()
     messagebox.showinfo("完成", f"成功处理 {processed}/{len(files)} 张图片")
 
 if __name__ == "__main__":
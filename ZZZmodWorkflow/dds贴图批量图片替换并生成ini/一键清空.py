@@ -1,10 +1,20 @@
 import os
-import shutil
+import stat
+import time
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
 
+# ========== 全局配置 ==========
 CONFIG_FILE = "clear_config.json"
+TRASH_DIRNAME = ".clear_trash"   # 回收目录，建在被清空文件夹的上级目录（同一磁盘，改名即完成清空）
+RETENTION_HOURS = 0              # 回收内容保留时长（小时）：0 表示立即后台删除，大于0时可撤销
+PURGE_WORKERS = 8                # 后台删除线程数
+PURGE_CHUNK = 256                # 每个删除任务处理的文件数
+# =============================
 
 class FolderManager:
     def __init__(self, tree_widget=None):
@@ -113,54 +123,286 @@ def create_gui():
     ttk.Button(btn_frame, text="移除选中", 
               command=manager.remove_folders).pack(side='left', padx=5)
     
+    # 后台删除进度
+    progress = ttk.Progressbar(root, orient=tk.HORIZONTAL, length=400, mode='determinate')
+    progress.pack(pady=5)
+    status_var = tk.StringVar()
+    ttk.Label(root, textvariable=status_var).pack()
+    purger = TrashPurger(root, progress, status_var)
+    
     # 操作按钮
     ttk.Button(root, text="清空所有文件夹", 
-              command=lambda: clear_folders(manager.folders, root)).pack(pady=10)
+              command=lambda: clear_folders(manager.folders, root, purger)).pack(pady=10)
+    if RETENTION_HOURS > 0:
+        ttk.Button(root, text="撤销上次清空",
+                  command=lambda: undo_last_clear(manager.folders, root)).pack(pady=5)
     ttk.Button(root, text="退出", command=root.destroy).pack()
     
+    # 启动时清理过期（或上次未删完）的回收内容
+    purger.purge(expired_batches(manager.folders), report=False)
     return root
 
-def clear_folders(folders, parent):
-    """执行清空操作"""
+# ------------------------- 回收目录 -------------------------
+def trash_root_for(folder):
+    """回收目录位于文件夹的上级目录，保证与其在同一磁盘"""
+    parent = os.path.dirname(os.path.normpath(folder))
+    if not parent or parent == os.path.normpath(folder):
+        return None  # 磁盘根目录没有上级目录
+    return os.path.join(parent, TRASH_DIRNAME)
+
+def move_to_trash(folder, batch_id):
+    """把文件夹内容改名移入回收目录，返回 (批次目录, 移走的条目数)
+    优先整体改名文件夹后重建空文件夹（一次改名即完成），
+    文件夹被占用时改为逐项改名。
+    """
+    trash_root = trash_root_for(folder)
+    if trash_root is None:
+        raise OSError("无法在磁盘根目录旁建立回收目录")
+    os.makedirs(trash_root, exist_ok=True)
+    batch_dir = os.path.join(trash_root, f"{batch_id}_{os.path.basename(os.path.normpath(folder))}")
+    os.makedirs(batch_dir)
+    content_dir = os.path.join(batch_dir, "content")
+    
+    with os.scandir(folder) as it:
+        names = [entry.name for entry in it]
+    manifest = {"folder": folder, "time": time.time(), "batch": batch_id, "count": len(names)}
+    
+    try:
+        mode = stat.S_IMODE(os.stat(folder).st_mode)
+        os.rename(folder, content_dir)
+        os.mkdir(folder)
+        os.chmod(folder, mode)
+    except OSError:
+        # 整体改名失败（被资源管理器或其它程序占用），逐项改名
+        if not os.path.isdir(folder):
+            raise
+        os.makedirs(content_dir, exist_ok=True)
+        for name in names:
+            os.rename(os.path.join(folder, name), os.path.join(content_dir, name))
+    
+    with open(os.path.join(batch_dir, "manifest.json"), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return batch_dir, len(names)
+
+def list_batches(folders):
+    """列出这些文件夹对应回收目录中的全部批次：[(批次目录, manifest)]"""
+    batches = []
+    roots = {trash_root_for(folder) for folder in folders} - {None}
+    for trash_root in roots:
+        if not os.path.isdir(trash_root):
+            continue
+        with os.scandir(trash_root) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                try:
+                    with open(os.path.join(entry.path, "manifest.json"), 'r', encoding='utf-8') as f:
+                        manifest = json.load(f)
+                except (OSError, ValueError):
+                    manifest = {"folder": None, "time": 0, "batch": ""}  # 清空中途中断的批次
+                batches.append((entry.path, manifest))
+    return batches
+
+def expired_batches(folders):
+    """超过保留时长的批次"""
+    deadline = time.time() - RETENTION_HOURS * 3600
+    return [path for path, manifest in list_batches(folders) if manifest["time"] <= deadline]
+
+def undo_last_clear(folders, parent):
+    """把最近一次清空的内容移回原文件夹（同名文件已存在时保留新文件并跳过）"""
+    batches = list_batches(folders)
+    if not batches:
+        messagebox.showinfo("撤销", "没有可撤销的清空记录", parent=parent)
+        return
+    last_batch = max(manifest["batch"] for _, manifest in batches)
+    restored, skipped = 0, []
+    for batch_dir, manifest in batches:
+        if manifest["batch"] != last_batch or not manifest["folder"]:
+            continue
+        content_dir = os.path.join(batch_dir, "content")
+        os.makedirs(manifest["folder"], exist_ok=True)
+        with os.scandir(content_dir) as it:
+            for entry in it:
+                target = os.path.join(manifest["folder"], entry.name)
+                if os.path.exists(target):
+                    skipped.append(target)
+                    continue
+                os.rename(entry.path, target)
+                restored += 1
+        if not skipped:
+            os.rmdir(content_dir)
+            os.remove(os.path.join(batch_dir, "manifest.json"))
+            os.rmdir(batch_dir)
+    
+    result = [f"已恢复 {restored} 项"]
+    if skipped:
+        result.append("\n以下文件已存在，未恢复（仍保留在回收目录中）:")
+        result.extend(skipped[:20])
+    messagebox.showinfo("撤销结果", "\n".join(result), parent=parent)
+
+# ------------------------- 后台删除 -------------------------
+def _remove_file(path):
+    """删除单个文件，只读文件先去掉只读属性再删"""
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE)
+        os.remove(path)
+
+class TrashPurger:
+    """在后台线程池中删除回收目录中的批次，通过队列向界面汇报进度"""
+    def __init__(self, root, progress, status_var):
+        self.root = root
+        self.progress = progress
+        self.status_var = status_var
+        self.message_queue = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=PURGE_WORKERS)
+        self.root.after(100, self.process_messages)
+    
+    def purge(self, batch_dirs, report=True, cleared=()):
+        """启动后台删除
+        参数：
+            batch_dirs - 要删除的批次目录
+            report - 完成后是否弹窗汇报
+            cleared - 已清空的文件夹（用于最终汇报）
+        """
+        if not batch_dirs:
+            return
+        threading.Thread(
+            target=self._purge_worker,
+            args=(list(batch_dirs), report, list(cleared)),
+            daemon=True
+        ).start()
+    
+    def _purge_worker(self, batch_dirs, report, cleared):
+        start = time.time()
+        files, dirs = [], []
+        for batch_dir in batch_dirs:
+            stack = [batch_dir]
+            while stack:
+                current = stack.pop()
+                dirs.append(current)
+                try:
+                    with os.scandir(current) as it:
+                        for entry in it:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            else:
+                                files.append(entry.path)
+                except OSError as e:
+                    self.message_queue.put(("error", f"{current} - {str(e)}"))
+        
+        total = len(files)
+        self.message_queue.put(("start", total))
+        failed = []
+        chunks = [files[i:i + PURGE_CHUNK] for i in range(0, total, PURGE_CHUNK)]
+        
+        def remove_chunk(paths):
+            errors = []
+            for path in paths:
+                try:
+                    _remove_file(path)
+                except OSError as e:
+                    errors.append(f"{path} - {str(e)}")
+            self.message_queue.put(("progress", len(paths)))
+            return errors
+        
+        for errors in self.executor.map(remove_chunk, chunks):
+            failed.extend(errors)
+        
+        # 目录按深度从深到浅删除
+        for path in sorted(dirs, key=lambda p: p.count(os.sep), reverse=True):
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                if not failed:  # 有文件删除失败时目录必然删不掉，不再重复记录
+                    failed.append(f"{path} - {str(e)}")
+        
+        self.message_queue.put(("done", {
+            "report": report,
+            "cleared": cleared,
+            "deleted": total - len(failed),
+            "failed": failed,
+            "seconds": time.time() - start,
+        }))
+    
+    def process_messages(self):
+        """处理来自后台线程的消息"""
+        while not self.message_queue.empty():
+            msg = self.message_queue.get()
+            if msg[0] == "start":
+                self.progress['maximum'] = max(msg[1], 1)
+                self.progress['value'] = 0
+            elif msg[0] == "progress":
+                self.progress['value'] += msg[1]
+                self.status_var.set(
+                    f"后台删除中：{int(self.progress['value'])}/{int(self.progress['maximum'])}")
+            elif msg[0] == "error":
+                print(f"扫描回收目录失败：{msg[1]}")
+            elif msg[0] == "done":
+                self.show_report(msg[1])
+        self.root.after(100, self.process_messages)
+    
+    def show_report(self, info):
+        """显示最终删除结果"""
+        self.status_var.set(f"后台删除完成：{info['deleted']} 个文件，用时 {info['seconds']:.1f} 秒")
+        if not info["report"]:
+            return
+        result = []
+        if info["cleared"]:
+            result.append("成功清空:")
+            result.extend(info["cleared"])
+        result.append(f"\n已删除 {info['deleted']} 个文件，用时 {info['seconds']:.1f} 秒")
+        if info["failed"]:
+            result.append("\n失败列表:")
+            result.extend(info["failed"][:50])
+        messagebox.showinfo("操作结果", "\n".join(result))
+
+def clear_folders(folders, parent, purger):
+    """执行清空操作：先把内容改名移入回收目录（立即完成），再在后台删除"""
     if not folders:
         messagebox.showwarning("警告", "没有选择任何文件夹")
         return
     
+    if RETENTION_HOURS > 0:
+        notice = f"\n\n内容将在回收目录中保留 {RETENTION_HOURS} 小时，可撤销。"
+    else:
+        notice = "\n\n请确认已做好备份！"
     confirm = messagebox.askyesno(
         "危险操作",
-        "即将永久清空以下文件夹:\n\n" + 
+        "即将清空以下文件夹:\n\n" + 
         "\n".join(folders) + 
-        "\n\n请确认已做好备份！\n确定要继续吗？",
+        notice + "\n确定要继续吗？",
         parent=parent
     )
     
     if confirm:
         success = []
         failed = []
+        batch_dirs = []
+        batch_id = time.strftime("%Y%m%d-%H%M%S") + f"{time.time() % 1:.3f}"[1:]
         for folder in folders:
             try:
-                for filename in os.listdir(folder):
-                    path = os.path.join(folder, filename)
-                    try:
-                        if os.path.isfile(path) or os.path.islink(path):
-                            os.remove(path)
-                        elif os.path.isdir(path):
-                            shutil.rmtree(path)
-                    except Exception as e:
-                        failed.append(f"{path} - {str(e)}")
-                success.append(folder)
+                batch_dir, count = move_to_trash(folder, batch_id)
+                batch_dirs.append(batch_dir)
+                success.append(f"{folder}（{count} 项）")
             except Exception as e:
                 failed.append(f"{folder} - {str(e)}")
         
-        result = []
-        if success:
-            result.append("成功清空:")
-            result.extend(success)
         if failed:
+            result = []
+            if success:
+                result.append("成功清空:")
+                result.extend(success)
             result.append("\n失败列表:")
             result.extend(failed)
+            messagebox.showinfo("操作结果", "\n".join(result))
         
-        messagebox.showinfo("操作结果", "\n".join(result))
+        if RETENTION_HOURS > 0:
+            purger.status_var.set(f"已清空 {len(success)} 个文件夹，内容保留在回收目录中")
+        else:
+            purger.status_var.set(f"已清空 {len(success)} 个文件夹，后台删除中…")
+            purger.purge(batch_dirs, report=not failed, cleared=success)
 
 if __name__ == "__main__":
     gui = create_gui()
@@ -0,0 +1,207 @@
+##### 帧序索引 #####
+"""
+为序列帧目录维护一个持久化的帧序索引（.frame_index.json），
+序号 -> 文件名 的映射按自然排序首次建立，之后增量更新：
+已有文件保持原序号顺序，新文件按自然排序并入，已删除的文件移出。
+
+各拼接/批处理脚本直接按索引顺序读取文件，不再需要先用rename.py
+把文件物理重命名成000、001……；导出时如仍需要规范文件名，
+export_rename 会用“两阶段重命名 + 日志”一次性完成且不会撞名。
+"""
+import os
+import re
+import json
+import uuid
+import tempfile
+
+# ========== 全局配置 ==========
+INDEX_FILENAME = ".frame_index.json"        # 索引文件名（存放在帧目录内）
+JOURNAL_FILENAME = ".rename_journal.json"   # 重命名日志（中断后可续做）
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.dds', '.webp', '.tiff')
+# =============================
+
+
+def natural_sort_key(s):
+    """自然排序键函数（处理数字序号排序）"""
+    return [int(text) if text.isdigit() else text.lower()
+            for text in re.split(r'(\d+)', s)]
+
+
+def _write_json(path, data):
+    """先写同目录下的临时文件再原子替换，避免中途崩溃留下半个文件
+    临时文件名每次唯一：预览线程和拼接线程可能同时更新同一个索引"""
+    fd, temp_path = tempfile.mkstemp(prefix=".~", suffix=".tmp", dir=os.path.dirname(path) or ".")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def load_index(folder):
+    """读取索引，不存在或损坏时返回空索引"""
+    path = os.path.join(folder, INDEX_FILENAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data.get("frames"), list):
+            return data
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {"version": 1, "frames": []}
+
+
+def _merge(existing, new_names):
+    """把新文件按自然排序并入已有序列（已有顺序保持不变）"""
+    new_names = sorted(new_names, key=natural_sort_key)
+    merged = []
+    i = 0
+    for entry in existing:
+        key = natural_sort_key(entry["file"])
+        while i < len(new_names) and natural_sort_key(new_names[i]) < key:
+            merged.append(new_names[i])
+            i += 1
+        merged.append(entry["file"])
+    merged.extend(new_names[i:])
+    return merged
+
+
+def update_index(folder, exts=IMAGE_EXTS):
+    """扫描目录并增量更新索引，返回按序号排列的文件名列表
+    参数：
+        folder - 帧目录
+        exts - 纳入索引的扩展名
+    """
+    stats = {}
+    with os.scandir(folder) as it:
+        for entry in it:
+            if (entry.is_file() and entry.name.lower().endswith(exts)
+                    and not entry.name.startswith('.~')):
+                st = entry.stat()
+                stats[entry.name] = (st.st_size, st.st_mtime_ns)
+
+    index = load_index(folder)
+    existing = [e for e in index["frames"]
+                if isinstance(e, dict) and e.get("file") in stats]
+    known = {e["file"] for e in existing}
+    new_names = [name for name in stats if name not in known]
+
+    order = _merge(existing, new_names) if new_names else [e["file"] for e in existing]
+    frames = [{"file": name, "size": stats[name][0], "mtime_ns": stats[name][1]}
+              for name in order]
+
+    if frames != index["frames"]:
+        index["frames"] = frames
+        try:
+            _write_json(os.path.join(folder, INDEX_FILENAME), index)
+        except OSError as e:
+            print(f"⚠️ 帧序索引写入失败（仅本次使用）：{str(e)}")
+    return order
+
+
+def ordered_files(folder, exts=IMAGE_EXTS):
+    """按帧序返回目录中指定扩展名的文件名（供各脚本替代 sorted(os.listdir())）"""
+    return [name for name in update_index(folder, tuple(set(IMAGE_EXTS) | set(exts)))
+            if name.lower().endswith(exts)]
+
+
+def ordered_paths(folder, exts=IMAGE_EXTS):
+    """按帧序返回完整路径"""
+    return [os.path.join(folder, name) for name in ordered_files(folder, exts)]
+
+
+# ------------------------- 导出时的两阶段重命名 -------------------------
+def _recover_journal(folder):
+    """发现未完成的重命名日志时按日志继续做完（只向前推进，不回滚）"""
+    journal_path = os.path.join(folder, JOURNAL_FILENAME)
+    if not os.path.exists(journal_path):
+        return False
+    with open(journal_path, 'r', encoding='utf-8') as f:
+        journal = json.load(f)
+    print(f"发现未完成的重命名日志（{len(journal['moves'])} 项，已完成 {journal.get('phase', 1) - 1}/2 个阶段），继续执行")
+    _apply_moves(folder, journal)
+    _finish(folder, journal)
+    return True
+
+
+def _apply_moves(folder, journal):
+    """第一阶段：原名 -> 临时名；第二阶段：临时名 -> 目标名
+    每个阶段完成后把阶段号写回日志：第一阶段做完后原名可能已被其它文件的目标名占用
+    （如 000 与 001 互换），续做时不能再执行第一阶段，否则会把已改好的文件又移走"""
+    journal_path = os.path.join(folder, JOURNAL_FILENAME)
+    if journal.get("phase", 1) == 1:
+        for old, temp, _ in journal["moves"]:
+            old_path = os.path.join(folder, old)
+            temp_path = os.path.join(folder, temp)
+            if os.path.exists(old_path) and not os.path.exists(temp_path):
+                os.rename(old_path, temp_path)
+        journal["phase"] = 2
+        _write_json(journal_path, journal)
+    if journal["phase"] == 2:
+        for _, temp, new in journal["moves"]:
+            temp_path = os.path.join(folder, temp)
+            if os.path.exists(temp_path):
+                os.rename(temp_path, os.path.join(folder, new))
+        journal["phase"] = 3        # 文件已全部改名，只剩更新索引
+        _write_json(journal_path, journal)
+
+
+def _renamed_frames(index, moves):
+    """索引中的文件名换成目标名"""
+    renamed = {old: new for old, _, new in moves}
+    return [dict(entry, file=renamed.get(entry["file"], entry["file"])) for entry in index["frames"]]
+
+
+def _finish(folder, journal):
+    """写入重命名后的索引并删除日志
+    新索引在写日志时就已算好，重复执行结果相同（不会对已改名的索引再换一次名）"""
+    index = load_index(folder)
+    if "frames" in journal:
+        index["frames"] = journal["frames"]
+    else:       # 旧版日志
+        index["frames"] = _renamed_frames(index, journal["moves"])
+    _write_json(os.path.join(folder, INDEX_FILENAME), index)
+    update_index(folder)
+    os.remove(os.path.join(folder, JOURNAL_FILENAME))
+
+
+def export_rename(folder, prefix="", suffix="", exts=IMAGE_EXTS, start=0):
+    """按帧序把文件批量重命名为 {prefix}{000}{suffix}.扩展名
+    先写日志，再两阶段重命名，目标名与现有文件交叉也不会冲突；
+    中途中断后再次调用会先按日志续做。
+    返回：[(旧名, 新名)]
+    """
+    _recover_journal(folder)
+
+    files = ordered_files(folder, exts)
+    moves = []
+    token = uuid.uuid4().hex[:8]
+    for seq, name in enumerate(files, start=start):
+        ext = os.path.splitext(name)[1]
+        new_name = f"{prefix}{seq:03d}{suffix}{ext}"
+        if new_name != name:
+            moves.append((name, f".~{token}_{seq}{ext}", new_name))
+
+    # 目标名被索引外的文件占用时直接终止，避免覆盖
+    moving = {old for old, _, _ in moves}
+    targets = {new for _, _, new in moves}
+    conflicts = [new for new in targets
+                 if new not in moving and os.path.exists(os.path.join(folder, new))]
+    if conflicts:
+        raise FileExistsError(f"目标文件名已被占用：{', '.join(sorted(conflicts)[:5])}")
+    if len(targets) != len(moves):
+        raise ValueError("生成的目标文件名重复，请检查前缀/后缀设置")
+    if not moves:
+        return []
+
+    journal = {"phase": 1, "moves": [list(m) for m in moves],
+               "frames": _renamed_frames(load_index(folder), moves)}
+    _write_json(os.path.join(folder, JOURNAL_FILENAME), journal)
+    _apply_moves(folder, journal)
+    _finish(folder, journal)
+    return [(old, new) for old, _, new in moves]
@@ -0,0 +1,234 @@
+##### 后台预读/写盘 #####
+"""
+网络共享和机械硬盘上，逐张“读取→处理→写回”的循环大部分时间CPU都在等I/O。这里把I/O移到后台线程：
+    - Prefetcher：按处理顺序提前读入后面几个文件的全部字节，解码直接用内存中的 BytesIO。
+      预读深度按实测的单文件读取耗时与每帧处理耗时自动调整（读得越慢、处理越快，预读越深），
+      同时受 PREFETCH_BYTES 限制；超过 LARGE_FILE 的文件不预读，仍按路径交给调用方（分块路径按需读取）
+    - WriteBehind：编码好的字节交给后台线程写临时文件、记进度、替换原文件，队列有上限，
+      写盘跟不上时处理线程才等待
+统计读取/写入的字节数和耗时，以及处理线程因等待I/O而空闲的时间，脚本结束时 report() 输出。
+"""
+import os
+import io
+import math
+import time
+import queue
+import tempfile
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# ========== 全局配置 ==========
+IO_WORKERS = 4                  # 同时读取的文件数
+MIN_DEPTH = 2                   # 预读深度（已提交未取走的文件数）范围
+MAX_DEPTH = 32
+PREFETCH_BYTES = 256 << 20      # 预读缓存的字节上限
+LARGE_FILE = 64 << 20           # 超过此大小的文件不预读
+WRITE_QUEUE = 8                 # 等待写盘的文件数上限
+# =============================
+
+_stats = Counter()
+_lock = threading.Lock()
+
+
+def _add(**values):
+    with _lock:
+        _stats.update(values)
+
+
+def _ewma(old, new, weight=0.3):
+    return new if old is None else old + (new - old) * weight
+
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+# ------------------------- 统计 -------------------------
+def stats():
+    """当前统计值（读取/写入字节数与耗时、处理线程等待I/O的秒数、最大预读深度）"""
+    with _lock:
+        return dict(_stats)
+
+
+def summary():
+    """I/O统计的文字说明，没有读写时返回None"""
+    s = stats()
+    if not s.get("read_files") and not s.get("write_files"):
+        return None
+    return (f"I/O统计：读取 {s.get('read_files', 0)} 个文件 {s.get('read_bytes', 0) / 2**20:.1f}MB"
+            f"（{s.get('read_seconds', 0):.2f}秒，最大预读 {s.get('max_depth', 0)} 个），"
+            f"写入 {s.get('write_files', 0)} 个文件 {s.get('write_bytes', 0) / 2**20:.1f}MB"
+            f"（{s.get('write_seconds', 0):.2f}秒）；处理线程等待读取 {s.get('read_wait', 0):.2f}秒，"
+            f"等待写入 {s.get('write_wait', 0):.2f}秒")
+
+
+def report():
+    """输出I/O统计"""
+    text = summary()
+    if text:
+        print(text)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+# ------------------------- 预读 -------------------------
+class Prefetcher:
+    """按 paths 的顺序在后台预读文件
+    用法：
+        prefetcher = Prefetcher(paths)
+        for path in paths:
+            source = prefetcher.take(path)      # BytesIO（大文件为路径本身），可直接 Image.open
+        prefetcher.close()
+    take 可以按任意顺序、在多个线程中调用；读取失败时在 take 中抛出异常
+    """
+    def __init__(self, paths, workers=None):
+        self.paths = list(paths)
+        self.executor = ThreadPoolExecutor(max_workers=workers or IO_WORKERS)
+        self.lock = threading.Lock()
+        self.futures = {}       # 路径 -> (future, 大小)，已提交、未取走
+        self.taken = set()
+        self.position = 0       # 下一个要提交的序号
+        self.buffered = 0       # 已提交未取走的字节数
+        self.depth = MIN_DEPTH
+        self.read_time = None   # 单文件读取耗时（滑动平均）
+        self.interval = None    # 调用方处理一帧的耗时（两次 take 之间，滑动平均）
+        self.last_take = None
+        with self.lock:
+            self._fill()
+
+    def _read(self, path):
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            data = f.read()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.read_time = _ewma(self.read_time, elapsed)
+        _add(read_files=1, read_bytes=len(data), read_seconds=elapsed)
+        return data
+
+    def _fill(self):
+        """在深度和字节上限内继续提交预读（调用时需持有锁）"""
+        while self.position < len(self.paths) and len(self.futures) < self.depth:
+            path = self.paths[self.position]
+            if path in self.taken or path in self.futures:
+                self.position += 1
+                continue
+            size = _size(path)
+            if size > LARGE_FILE:
+                self.position += 1
+                continue
+            if self.futures and self.buffered + size > PREFETCH_BYTES:
+                break
+            self.position += 1
+            self.futures[path] = (self.executor.submit(self._read, path), size)
+            self.buffered += size
+
+    def _adapt(self):
+        """读取耗时 / 每帧处理耗时 即为保持不断供所需的在途文件数"""
+        if self.read_time is None or self.interval is None:
+            return
+        wanted = math.ceil(self.read_time / max(self.interval, 1e-4)) + 1
+        self.depth = max(MIN_DEPTH, min(MAX_DEPTH, wanted))
+        with _lock:
+            _stats["max_depth"] = max(_stats["max_depth"], self.depth)
+
+    def take(self, path):
+        """取出 path 的内容：BytesIO，或超过 LARGE_FILE 时返回路径本身"""
+        start = time.perf_counter()
+        with self.lock:
+            if self.last_take is not None:
+                self.interval = _ewma(self.interval, start - self.last_take)
+            self.taken.add(path)
+            future, size = self.futures.pop(path, (None, 0))
+            self._adapt()
+        try:
+            if future is not None:
+                data = future.result()
+            elif _size(path) > LARGE_FILE:
+                return path
+            else:
+                data = self._read(path)     # 未预读到（顺序不同或已超出深度），当场读取
+        finally:
+            now = time.perf_counter()
+            _add(read_wait=now - start)
+            with self.lock:
+                self.buffered -= size
+                self.last_take = now
+                self._fill()
+        return io.BytesIO(data)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        with self.lock:
+            self.futures.clear()
+            self.buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ------------------------- 后台写盘 -------------------------
+class WriteBehind:
+    """后台线程按提交顺序写盘
+    submit(path, data, record, done)：先把 data 写到 path 同目录的临时文件，调用 record(临时文件路径)
+    （例如记进度日志），再 os.replace 覆盖 path，最后调用 done()；任一步失败都会删除临时文件。
+    close() 写完剩余的文件，返回失败的个数。
+    """
+    def __init__(self, depth=None):
+        self.queue = queue.Queue(maxsize=depth or WRITE_QUEUE)
+        self.failures = 0
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, path, data, record=None, done=None, failed=None):
+        """排队写入；failed(异常) 在写入失败时调用，默认打印错误"""
+        start = time.perf_counter()
+        self.queue.put((path, data, record, done, failed))
+        _add(write_wait=time.perf_counter() - start)
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            path, data, record, done, failed = item
+            temp_path = None
+            try:
+                start = time.perf_counter()
+                with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(path)[1],
+                                                 dir=os.path.dirname(os.path.abspath(path))) as tmp_file:
+                    temp_path = tmp_file.name
+                    tmp_file.write(data)
+                _add(write_files=1, write_bytes=len(data), write_seconds=time.perf_counter() - start)
+                if record:
+                    record(temp_path)
+                os.replace(temp_path, path)
+                temp_path = None
+                if done:
+                    done()
+            except Exception as e:
+                self.failures += 1
+                if failed:
+                    failed(e)
+                else:
+                    print(f"❌ 写入 {os.path.basename(path)} 失败: {str(e)}")
+            finally:
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def close(self):
+        """等待所有排队的文件写完，返回失败的个数"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        return self.failures
@@ -0,0 +1,171 @@
+##### 帧数重采样 #####
+"""
+视频逐帧导出的序列帧数量不固定，而拼接图需要正好 N 帧（25、192……）。
+这里按帧序把任意数量的帧重采样成指定帧数，不必再手动删帧：
+    - stride：等间隔抽帧
+    - nearest：取时间上最近的一帧（文件名末尾的数字递增时按它作时间戳，例如 ffmpeg -frame_pts 导出的帧，
+      否则视为等间隔）
+    - blend：在相邻两帧之间按时间位置线性交叉混合（Image.blend 整帧一次完成）
+LOOP 为 True 时按循环动画处理：N 帧均分一个完整周期，最后几帧向第一帧过渡；
+否则首尾两帧对齐原序列的首尾。
+抽帧模式只挑选文件、不解码；混合模式由 Resampler 按顺序逐帧生成，同时最多缓存两帧原图。
+"""
+import os
+import re
+import bisect
+from collections import OrderedDict
+from PIL import Image
+import pixel_pipeline
+
+# ========== 全局配置 ==========
+MODE = "stride"             # stride / nearest / blend
+LOOP = True                 # 按循环动画采样（最后一帧之后接回第一帧）
+TIMESTAMP_PATTERN = r"(\d+(?:\.\d+)?)\D*$"      # 从文件名取时间戳的正则（取第1组），None 为按帧序等间隔
+CACHE_FRAMES = 2            # 混合模式缓存的原图帧数
+# =============================
+
+MODES = ("stride", "nearest", "blend")
+WEIGHT_EPSILON = 1e-6       # 混合权重小于此值时直接取原帧
+
+
+class Sample:
+    """重采样后的一帧：原帧 path，或 path 与 next_path 按 weight 混合（weight 为 next_path 所占比例）"""
+    def __init__(self, path, next_path=None, weight=0.0):
+        if weight < WEIGHT_EPSILON or next_path is None:
+            next_path, weight = None, 0.0
+        elif weight > 1 - WEIGHT_EPSILON:
+            path, next_path, weight = next_path, None, 0.0
+        self.path = path
+        self.next_path = next_path
+        self.weight = weight
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def blended(self):
+        return self.next_path is not None
+
+    def describe(self):
+        if not self.blended:
+            return self.name
+        return f"{self.name}+{os.path.basename(self.next_path)}@{self.weight:.2f}"
+
+
+def timestamps(paths):
+    """各帧的时间戳：文件名中的数字严格递增时用它，否则按帧序 0, 1, 2……"""
+    if TIMESTAMP_PATTERN and len(paths) > 1:
+        times = []
+        for path in paths:
+            match = re.search(TIMESTAMP_PATTERN, os.path.splitext(os.path.basename(path))[0])
+            if not match:
+                break
+            times.append(float(match.group(1)))
+        else:
+            if all(a < b for a, b in zip(times, times[1:])):
+                return times
+    return [float(i) for i in range(len(paths))]
+
+
+def _targets(times, count, loop):
+    """count 个采样时刻，以及循环时一个周期的结束时刻（即回到第一帧的时刻）"""
+    first, last = times[0], times[-1]
+    if loop:
+        step = (last - first) / (len(times) - 1) if len(times) > 1 else 1.0
+        end = last + step
+        return [first + (end - first) * j / count for j in range(count)], end
+    if count == 1:
+        return [first], None
+    return [first + (last - first) * j / (count - 1) for j in range(count)], None
+
+
+def plan(paths, count, mode=None, loop=None):
+    """把 paths（已按帧序排列）重采样为 count 帧，返回 Sample 列表"""
+    mode = mode or MODE
+    loop = LOOP if loop is None else loop
+    if mode not in MODES:
+        raise ValueError(f"未知的重采样方式：{mode}（可选 {'/'.join(MODES)}）")
+    if not paths or count < 1:
+        raise ValueError("没有可重采样的帧")
+    n = len(paths)
+    if mode == "stride":
+        if loop or count == 1:
+            return [Sample(paths[j * n // count]) for j in range(count)]
+        return [Sample(paths[j * (n - 1) // (count - 1)]) for j in range(count)]
+
+    times = timestamps(paths)
+    targets, end = _targets(times, count, loop)
+    samples = []
+    for target in targets:
+        i = max(0, bisect.bisect_right(times, target) - 1)
+        if i + 1 < n:
+            next_index, next_time = i + 1, times[i + 1]
+        elif end is not None:
+            next_index, next_time = 0, end      # 循环：最后一帧之后是第一帧
+        else:
+            samples.append(Sample(paths[i]))
+            continue
+        weight = (target - times[i]) / (next_time - times[i])
+        if mode == "nearest":
+            samples.append(Sample(paths[next_index] if weight > 0.5 else paths[i]))
+        else:
+            samples.append(Sample(paths[i], paths[next_index], weight))
+    return samples
+
+
+def source_paths(samples):
+    """按首次用到的顺序列出各帧用到的原图（用于预读），重复的只列一次"""
+    seen = {}
+    for sample in samples:
+        seen.setdefault(sample.path, None)
+        if sample.blended:
+            seen.setdefault(sample.next_path, None)
+    return list(seen)
+
+
+def describe(samples, source_count):
+    blended = sum(sample.blended for sample in samples)
+    used = len({sample.path for sample in samples} | {s.next_path for s in samples if s.blended})
+    return (f"重采样：{source_count} 帧 -> {len(samples)} 帧，用到 {used} 帧原图"
+            f"{f'，其中 {blended} 帧为相邻两帧混合' if blended else ''}")
+
+
+class Resampler:
+    """按 Sample 生成帧图像
+    用法：
+        resampler = Resampler(samples, open_image)     # open_image(路径) -> PIL图像（可配合 Prefetcher）
+        img = resampler.load(index)                     # 调用方负责关闭
+    原帧直接返回 open_image 打开的图像；混合帧用缓存的两帧原图 Image.blend 生成。
+    按顺序访问时相邻样本共用原图，每帧原图只解码一次
+    """
+    def __init__(self, samples, open_image=Image.open):
+        self.samples = samples
+        self.open_image = open_image
+        self.cache = OrderedDict()
+
+    def _decoded(self, path):
+        if path in self.cache:
+            self.cache.move_to_end(path)
+            return self.cache[path]
+        decoded = self.open_image(path)
+        decoded.load()
+        if decoded.mode not in ("L", "RGB", "RGBA"):
+            with decoded:
+                decoded = pixel_pipeline.convert(decoded, "RGBA" if pixel_pipeline.has_alpha(decoded) else "RGB")
+        self.cache[path] = decoded
+        while len(self.cache) > CACHE_FRAMES:
+            self.cache.popitem(last=False)
+        return decoded
+
+    def load(self, index):
+        sample = self.samples[index]
+        if not sample.blended:
+            return self.open_image(sample.path)
+        first, second = self._decoded(sample.path), self._decoded(sample.next_path)
+        if first.size != second.size:
+            raise ValueError(f"相邻两帧尺寸不同，无法混合：{first.size} / {second.size}")
+        if first.mode != second.mode:
+            mode = "RGBA" if "A" in first.mode + second.mode else "RGB"
+            first, second = first.convert(mode), second.convert(mode)
+        return Image.blend(first, second, sample.weight)
@@ -0,0 +1,175 @@
+##### 帧堆叠批处理 #####
+"""
+resizing.py 之后 ./out 里的序列帧尺寸、模式都相同，逐张交给PIL时每帧都有一遍调用开销。
+这里把同尺寸、同模式的帧按内存预算分批读进一个 (K, H, W, C) 数组，在整批上一次完成：
+    - 翻转/旋转（Image.Transpose 的各种方式，结果与 img.transpose 逐像素相同）
+    - 裁剪（同一个裁剪框，直接取视图不拷贝）
+    - 合成到背景（前景带透明时按PIL带蒙版粘贴的同一公式混合）
+    - 模式转换（L / LA / RGB / RGBA 之间，公式与PIL相同）
+一批中各帧的解码（load）和编码（map_frames）在线程池中并行（PIL编解码时释放GIL），
+中间的像素处理不再逐帧调用PIL。
+需要numpy；没有numpy、帧数太少或帧的尺寸/模式不一致时调用方仍按单张处理。
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import memory_scheduler
+try:
+    import numpy as np  # 批处理需要numpy
+except ImportError:
+    np = None
+
+# ========== 全局配置 ==========
+MIN_FRAMES = 4          # 帧数少于此值时不启用批处理
+STACK_COPIES = 3        # 每帧在一批中同时存在的整帧副本数（读入 + 处理结果 + 编码），用于估算每批帧数
+WORKERS = None          # 解码/编码线程数，None 为CPU核心数
+# =============================
+
+STACK_MODES = {"L": 1, "LA": 2, "RGB": 3, "RGBA": 4}
+_pool = None
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS or os.cpu_count() or 4)
+    return _pool
+
+
+def available(frame_count):
+    """是否值得（且能够）用批处理"""
+    return np is not None and frame_count >= MIN_FRAMES
+
+
+def uniform(paths):
+    """只读文件头，所有帧尺寸和模式都相同且模式可以批处理时返回 (尺寸, 模式)，否则None
+    带调色板透明色、ICC配置或EXIF的帧不批处理（数组中不保留这些信息）
+    """
+    shape = None
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                current = (img.size, img.mode)
+                extra = any(key in img.info for key in ("transparency", "icc_profile", "exif"))
+        except Exception:
+            return None
+        if extra or current[1] not in STACK_MODES or shape not in (None, current):
+            return None
+        shape = current
+    return shape
+
+
+def batches(items, size, mode, budget=None):
+    """按内存预算把 items 分成若干批，每批的 (K, H, W, C) 数组及其副本不超过预算"""
+    frame_bytes = size[0] * size[1] * STACK_MODES[mode] * STACK_COPIES
+    budget = budget or memory_scheduler.default_budget()
+    count = max(1, budget // max(1, frame_bytes))
+    for start in range(0, len(items), count):
+        yield items[start:start + count]
+
+
+# ------------------------- 读入/取出 -------------------------
+def load(sources, size, mode):
+    """把各帧并行解码进一个 (K, H, W, C) 的uint8数组；尺寸或模式与批不符时抛出 ValueError"""
+    stack = np.empty((len(sources), size[1], size[0], STACK_MODES[mode]), np.uint8)
+
+    def decode(index):
+        with Image.open(sources[index]) as img:
+            if img.size != tuple(size) or img.mode != mode:
+                raise ValueError(f"帧尺寸/模式与批不符：{img.size} {img.mode}")
+            stack[index] = np.asarray(img).reshape(stack.shape[1:])
+
+    for future in [_executor().submit(decode, index) for index in range(len(sources))]:
+        future.result()
+    return stack
+
+
+def map_frames(func, items):
+    """对一批中的各项并行调用 func（通常是取出一帧并编码），按原顺序产出 (项, 结果, 异常或None)"""
+    futures = [(item, _executor().submit(func, item)) for item in items]
+    for item, future in futures:
+        try:
+            yield item, future.result(), None
+        except Exception as e:
+            yield item, None, e
+
+
+def frame(stack, index, mode):
+    """取出第 index 帧为PIL图像"""
+    array = stack[index]
+    if array.shape[2] == 1:
+        array = array[:, :, 0]
+    return Image.fromarray(np.ascontiguousarray(array), mode)
+
+
+# ------------------------- 处理步骤 -------------------------
+def transpose(stack, method):
+    """与 Image.transpose(method) 相同的翻转/旋转（ROTATE_90 为逆时针，与PIL一致）"""
+    method = Image.Transpose(method)
+    if method == Image.Transpose.FLIP_LEFT_RIGHT:
+        return stack[:, :, ::-1]
+    if method == Image.Transpose.FLIP_TOP_BOTTOM:
+        return stack[:, ::-1]
+    if method == Image.Transpose.ROTATE_90:
+        return np.rot90(stack, 1, axes=(1, 2))
+    if method == Image.Transpose.ROTATE_180:
+        return stack[:, ::-1, ::-1]
+    if method == Image.Transpose.ROTATE_270:
+        return np.rot90(stack, 3, axes=(1, 2))
+    if method == Image.Transpose.TRANSPOSE:
+        return stack.swapaxes(1, 2)
+    return stack.swapaxes(1, 2)[:, ::-1, ::-1]     # TRANSVERSE
+
+
+def crop(stack, box):
+    """按 (left, top, right, bottom) 裁剪整批（视图，不拷贝）"""
+    left, top, right, bottom = (int(v) for v in box)
+    return stack[:, top:bottom, left:right]
+
+
+def _luma(rgb):
+    """RGB -> L，与PIL的定点公式相同"""
+    weights = np.array([19595, 38470, 7471], np.uint32)
+    return ((rgb.astype(np.uint32) * weights).sum(axis=-1, keepdims=True) + 0x8000 >> 16).astype(np.uint8)
+
+
+def convert(stack, mode, target):
+    """整批从 mode 转换到 target（L / LA / RGB / RGBA）"""
+    if mode == target:
+        return stack
+    if target not in STACK_MODES or mode not in STACK_MODES:
+        raise ValueError(f"批处理不支持 {mode} -> {target}")
+    color = stack[..., :1] if mode in ("L", "LA") else stack[..., :3]
+    alpha = stack[..., -1:] if mode in ("LA", "RGBA") else None
+    if target in ("L", "LA"):
+        color = color if color.shape[-1] == 1 else _luma(color)
+    elif color.shape[-1] == 1:
+        color = np.repeat(color, 3, axis=-1)
+    if target in ("LA", "RGBA"):
+        if alpha is None:
+            alpha = np.full(stack.shape[:3] + (1,), 255, np.uint8)
+        return np.concatenate([color, alpha], axis=-1)
+    return np.ascontiguousarray(color)
+
+
+def composite(stack, mode, background, position):
+    """把整批前景贴到背景（PIL图像）的 position 处，返回 (结果数组, 模式)
+    结果模式与背景相同；前景带透明时按PIL带蒙版粘贴的公式混合，否则直接覆盖
+    """
+    bg_mode = background.mode if background.mode in STACK_MODES else "RGB"
+    base = np.asarray(background.convert(bg_mode)).reshape(background.size[1], background.size[0], -1)
+    out = np.repeat(base[np.newaxis], len(stack), axis=0)
+    x, y = position
+    if x < 0 or y < 0:
+        raise ValueError("前景超出背景范围")
+    height, width = stack.shape[1:3]
+    region = out[:, y:y + height, x:x + width]
+    fg = stack[:, :region.shape[1], :region.shape[2]]
+    if mode in ("LA", "RGBA"):
+        alpha = fg[..., -1:].astype(np.uint32)
+        fg = convert(fg, mode, bg_mode).astype(np.uint32)
+        blended = region * (255 - alpha) + fg * alpha + 128
+        region[...] = ((blended >> 8) + blended >> 8).astype(np.uint8)
+    else:
+        region[...] = convert(fg, mode, bg_mode)
+    return out, bg_mode
@@ -0,0 +1,93 @@
+##### 自动排版 #####
+"""
+按帧数和单帧尺寸自动选择拼接图的行列数，不必再手动填写 rows/columns 并保证与帧数一致：
+    - 枚举列数（行数取放得下全部帧的最少行数），空白格超过 MAX_WASTE_TILES 的排法跳过
+    - 优先整张放进一页（不超过 MAX_SHEET_SIZE）；放不下时在 MIN_SCALE 以内按比例缩小单帧，
+      缩小得越少越好；仍放不下时按最大尺寸分页（见 sheet_builder）
+    - 同样缩放下选拼接图像素最少的排法（POWER_OF_TWO 时按补齐到2的幂后的尺寸计算），
+      宽高比偏离 ASPECT 超过 MAX_ASPECT 倍的排法不选，像素相同时选更接近 ASPECT 的
+给出行列数、单帧尺寸、拼接图尺寸，以及空白格和补齐部分占整张图面积的比例。
+"""
+import math
+import sheet_builder
+
+# ========== 全局配置 ==========
+MAX_WASTE_TILES = None      # 最多允许的空白格数，None 为不限
+MIN_SCALE = 1.0             # 放不进一页时单帧最多缩小到的比例，1.0 为不缩小（直接分页）
+POWER_OF_TWO = False        # 拼接图宽高补齐到2的幂
+ASPECT = 1.0                # 偏好的拼接图宽高比（宽/高）
+MAX_ASPECT = 4.0            # 宽高比与 ASPECT 相差的最大倍数
+# =============================
+
+
+def scaled_size(frame_size, scale):
+    """单帧按比例缩小后的尺寸（向下取整，保证缩小后的整行/整列不超过限制）"""
+    if scale >= 1:
+        return tuple(frame_size)
+    return max(1, int(frame_size[0] * scale)), max(1, int(frame_size[1] * scale))
+
+
+class GridPlan:
+    """一种排法：rows×columns 格、单帧尺寸 tile_size（已缩放）及其排版结果"""
+    def __init__(self, frame_count, rows, columns, tile_size, scale=1.0, max_size=None, power_of_two=False):
+        self.frame_count = frame_count
+        self.rows = rows
+        self.columns = columns
+        self.tile_size = tuple(tile_size)
+        self.scale = scale
+        self.layout = sheet_builder.SheetLayout(rows, columns, tile_size, max_size, power_of_two)
+        page_w, page_h = self.layout.page_size
+        self.pixels = page_w * page_h * self.layout.pages
+        used = frame_count * self.tile_size[0] * self.tile_size[1]
+        self.wasted = 1 - used / self.pixels
+        self.blank_tiles = self.layout.pages * self.layout.per_page - frame_count
+
+    def aspect_deviation(self, aspect):
+        """拼接图宽高比与 aspect 相差的倍数（≥1）"""
+        page_w, page_h = self.layout.page_size
+        ratio = page_w / page_h / aspect
+        return max(ratio, 1 / ratio)
+
+    def describe(self):
+        page_w, page_h = self.layout.page_size
+        scaled = f"（缩小到 {self.scale:.0%}）" if self.scale < 1 else ""
+        pages = f"，共 {self.layout.pages} 页" if self.layout.pages > 1 else ""
+        return (f"自动排版：{self.rows}行 {self.columns}列，单帧 {self.tile_size[0]}x{self.tile_size[1]}{scaled}，"
+                f"拼接图 {page_w}x{page_h}{pages}，空白 {self.blank_tiles} 格，浪费面积 {self.wasted:.1%}")
+
+
+def solve(frame_count, frame_size, max_size=None, power_of_two=None, aspect=None, max_waste_tiles=None,
+          min_scale=None):
+    """为 frame_count 帧、单帧 frame_size 的拼接图选择排法，返回 GridPlan
+    参数默认取本模块的全局配置（max_size 默认 sheet_builder.MAX_SHEET_SIZE）
+    """
+    if frame_count < 1:
+        raise ValueError("没有可拼接的帧")
+    max_size = max_size or sheet_builder.MAX_SHEET_SIZE
+    power_of_two = POWER_OF_TWO if power_of_two is None else power_of_two
+    if power_of_two:
+        max_size = 1 << (max_size.bit_length() - 1)
+    aspect = aspect or ASPECT
+    max_waste_tiles = MAX_WASTE_TILES if max_waste_tiles is None else max_waste_tiles
+    min_scale = MIN_SCALE if min_scale is None else min_scale
+    frame_w, frame_h = frame_size
+
+    candidates = []
+    for columns in range(1, frame_count + 1):
+        rows = math.ceil(frame_count / columns)
+        if max_waste_tiles is not None and rows * columns - frame_count > max_waste_tiles:
+            continue
+        scale = min(1.0, max_size / (columns * frame_w), max_size / (rows * frame_h))
+        if scale < min_scale:
+            continue
+        candidates.append(GridPlan(frame_count, rows, columns, scaled_size(frame_size, scale), scale,
+                                   max_size, power_of_two))
+
+    preferred = [plan for plan in candidates if plan.aspect_deviation(aspect) <= MAX_ASPECT] or candidates
+    if preferred:
+        return min(preferred, key=lambda plan: (-plan.scale, plan.pixels, plan.aspect_deviation(aspect)))
+
+    # 缩小到 MIN_SCALE 也放不进一页：按原尺寸每页排满，由 sheet_builder 分页
+    columns = max(1, min(frame_count, max_size // frame_w))
+    return GridPlan(frame_count, math.ceil(frame_count / columns), columns, frame_size, 1.0,
+                    max_size, power_of_two)
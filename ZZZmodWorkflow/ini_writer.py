@@ -0,0 +1,104 @@
+##### 3DMigoto INI 写出 #####
+"""
+按节组织要写出的INI内容，代替逐行拼接字符串：
+    - 每节按加入顺序保存 键 = 值 和原样行（命令列表中的 if/elif/endif、注释）
+    - branch() 生成 if / elif / endif 条件链，分支内的行自动缩进
+    - 节之间空一行；先写临时文件再替换，中途失败不会留下半个INI
+DDS贴图工具的静态替换INI和 animatedTexture.py 的动态贴图INI都用它写出。
+"""
+import os
+
+# ========== 全局配置 ==========
+INDENT = "    "         # 条件分支内的缩进
+# =============================
+
+
+def format_value(value):
+    """Python值 -> INI中的写法（浮点数去掉多余的0）"""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, float):
+        text = f"{value:.6f}".rstrip("0")
+        return text + "0" if text.endswith(".") else text
+    return str(value)
+
+
+class Section:
+    """INI中的一节"""
+    def __init__(self, name):
+        self.name = name
+        self.lines = []
+
+    def set(self, key, value):
+        self.lines.append(f"{key} = {format_value(value)}")
+        return self
+
+    def line(self, text):
+        """原样加入一行（命令、条件语句等）"""
+        self.lines.append(text)
+        return self
+
+    def comment(self, text):
+        self.lines.extend(f"; {line}" if line else ";" for line in text.splitlines())
+        return self
+
+    def branch(self, cases, default=None):
+        """条件链：cases 为 [(条件, [(键, 值) 或 原样行字符串, ...]), ...]，default 为都不满足时的内容"""
+        if not cases:
+            return self
+        keyword = "if"
+        for condition, body in cases:
+            self.lines.append(f"{keyword} {condition}")
+            self._body(body)
+            keyword = "elif"
+        if default:
+            self.lines.append("else")
+            self._body(default)
+        self.lines.append("endif")
+        return self
+
+    def _body(self, body):
+        for entry in body:
+            text = entry if isinstance(entry, str) else f"{entry[0]} = {format_value(entry[1])}"
+            self.lines.append(INDENT + text)
+
+    def render(self):
+        return "\n".join([f"[{self.name}]"] + self.lines)
+
+
+class IniWriter:
+    """按节收集INI内容后一次写出
+    用法：
+        ini = IniWriter()
+        ini.section("TextureOverride_IB_SlotCheck").set("hash", slot_hash).set("match_priority", 0)
+        ini.write(path)
+    """
+    def __init__(self):
+        self.header = []
+        self.sections = []
+
+    def comment(self, text):
+        """文件开头的注释"""
+        self.header.extend(f"; {line}" if line else ";" for line in text.splitlines())
+        return self
+
+    def section(self, name):
+        section = Section(name)
+        self.sections.append(section)
+        return section
+
+    def render(self):
+        blocks = ["\n".join(self.header)] if self.header else []
+        blocks.extend(section.render() for section in self.sections)
+        return "\n\n".join(blocks) + "\n"
+
+    def write(self, path):
+        temp_path = path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return path
@@ -0,0 +1,119 @@
+##### 任务进度日志 #####
+"""
+批处理脚本的断点续做日志：每完成一个文件追加一行记录，
+中途崩溃、报错或关掉窗口后重新运行，已完成的文件会被跳过，
+原地覆盖模式下不会再对已处理的文件重复缩放/合成。
+
+每条记录保存输出文件的 大小/修改时间：原地覆盖时先对临时文件记账、
+再 os.replace（替换不改变修改时间），所以无论崩溃发生在替换前还是替换后，
+续做时都能从文件本身判断这一项是否已生效。
+记录写入后立即交给系统（进程崩溃不会丢），每 FSYNC_EVERY 条或
+FSYNC_SECONDS 秒才真正落盘一次，开销远小于图片编解码本身。
+"""
+import os
+import json
+import time
+
+# ========== 全局配置 ==========
+FSYNC_EVERY = 64        # 每多少条记录落盘一次
+FSYNC_SECONDS = 2.0     # 距上次落盘超过多少秒也落盘
+# =============================
+
+
+def _stat(path):
+    """文件指纹 [大小, 修改时间]，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+class JobJournal:
+    """断点续做日志
+    用法：
+        journal = JobJournal(folder, "resize", params)
+        if journal.done(name, path): 跳过
+        ...写好临时文件后 journal.record(name, temp_path)，再 os.replace
+        journal.finish(complete=全部成功)
+    """
+    def __init__(self, folder, job, params=None):
+        self.path = os.path.join(folder, f".job_{job}.journal")
+        self.params = json.loads(json.dumps(params))   # 元组等统一成JSON读回后的形式再比较
+        self.records = {}
+        self.pending = 0
+        self.last_sync = time.monotonic()
+        self._load()
+        fresh = not os.path.exists(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if fresh:
+            self._write({"job": job, "params": self.params})
+
+    def _load(self):
+        """读取已有日志；参数变化或日志损坏时从头开始"""
+        if not os.path.exists(self.path):
+            return
+        records = {}
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if header.get("params") != self.params:
+            print("⚠️ 处理参数与上次不同，忽略旧的进度日志")
+            os.remove(self.path)
+            return
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+                records[entry["key"]] = entry
+            except (ValueError, KeyError, TypeError):
+                break   # 最后一行可能只写了一半
+        self.records = records
+        if records:
+            print(f"发现未完成的任务进度：已完成 {len(records)} 项，将跳过这些文件")
+
+    def _write(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.pending += 1
+        if self.pending >= FSYNC_EVERY or time.monotonic() - self.last_sync >= FSYNC_SECONDS:
+            self.sync()
+
+    def sync(self):
+        """把已写入的记录落盘"""
+        if self.pending:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def done(self, key, path, source=None):
+        """该项是否已完成：输出文件（及源文件）仍与记录一致"""
+        entry = self.records.get(key)
+        if entry is None or entry["out"] != _stat(path):
+            return False
+        return source is None or entry.get("src") == _stat(source)
+
+    def record(self, key, path, source=None):
+        """记录一项已完成；path 为最终输出（原地覆盖时传替换前的临时文件）"""
+        entry = {"key": key, "out": _stat(path)}
+        if source is not None:
+            entry["src"] = _stat(source)
+        self.records[key] = entry
+        self._write(entry)
+
+    def finish(self, complete=True):
+        """任务结束：全部成功时删除日志，否则保留以便下次续做"""
+        self.sync()
+        self.file.close()
+        if complete:
+            os.remove(self.path)
+        else:
+            print("进度已记录，修正问题后重新运行将从中断处继续")
+
+    def close(self):
+        """异常退出时调用，保留日志"""
+        if not self.file.closed:
+            self.sync()
+            self.file.close()
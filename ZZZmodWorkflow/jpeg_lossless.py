@@ -0,0 +1,613 @@
+##### JPEG无损变换（DCT系数域，仿jpegtran） #####
+"""
+直接在DCT系数上完成JPEG的翻转/旋转/裁剪，不解码像素、不重新量化，
+结果与原图逐系数一致（无损）。
+
+默认只在找到外部 jpegtran 时走无损路径，否则返回 False 由调用方按像素处理；
+本文件内置的纯Python实现比PIL解码再编码慢约100倍（1024x1024旋转约3秒），
+需设置 use_builtin = True 才会在没有jpegtran时使用，适合少量必须无损的文件。
+只支持基线/扩展顺序Huffman编码的8位JPEG；渐进式、算术编码或
+变换/裁剪边界没有对齐MCU时返回 False，由调用方回退到像素路径。
+"""
+import os
+import shutil
+import struct
+import subprocess
+from PIL import Image
+
+# ========== 全局配置 ==========
+jpegtran_path = "jpegtran"      # 外部jpegtran可执行文件（可填完整路径，如 jpegtran.exe）
+use_external_jpegtran = True    # False 则不调用jpegtran（此时只有 use_builtin 为True才走无损路径）
+use_builtin = False             # 没有jpegtran时是否使用内置纯Python实现（无损但很慢）
+# =============================
+
+# zigzag序号 -> 8x8块内自然序号（行*8+列）
+ZIGZAG = [
+    0, 1, 8, 16, 9, 2, 3, 10, 17, 24, 32, 25, 18, 11, 4, 5,
+    12, 19, 26, 33, 40, 48, 41, 34, 27, 20, 13, 6, 7, 14, 21, 28,
+    35, 42, 49, 56, 57, 50, 43, 36, 29, 22, 15, 23, 30, 37, 44, 51,
+    58, 59, 52, 45, 38, 31, 39, 46, 53, 60, 61, 54, 47, 55, 62, 63,
+]
+_NATURAL_TO_ZZ = [0] * 64
+for _k, _n in enumerate(ZIGZAG):
+    _NATURAL_TO_ZZ[_n] = _k
+
+# 水平/垂直翻转时需要取反的系数（奇数水平频率 / 奇数垂直频率），zigzag序号
+_ODD_COL_ZZ = [k for k in range(64) if ZIGZAG[k] % 8 % 2 == 1]
+_ODD_ROW_ZZ = [k for k in range(64) if ZIGZAG[k] // 8 % 2 == 1]
+# 转置：新块zigzag位置k取旧块的哪个zigzag位置
+_TRANSPOSE_ZZ = [_NATURAL_TO_ZZ[(ZIGZAG[k] % 8) * 8 + ZIGZAG[k] // 8] for k in range(64)]
+
+# PIL转置方式 -> 内置实现的基本步骤（注意PIL的ROTATE_90为逆时针）
+TRANSPOSE_STEPS = {
+    Image.Transpose.FLIP_LEFT_RIGHT: ("flip_h",),
+    Image.Transpose.FLIP_TOP_BOTTOM: ("flip_v",),
+    Image.Transpose.ROTATE_180: ("flip_h", "flip_v"),
+    Image.Transpose.ROTATE_90: ("transpose", "flip_v"),
+    Image.Transpose.ROTATE_270: ("transpose", "flip_h"),
+    Image.Transpose.TRANSPOSE: ("transpose",),
+    Image.Transpose.TRANSVERSE: ("transpose", "flip_h", "flip_v"),
+}
+
+# PIL转置方式 -> jpegtran参数（jpegtran的-rotate为顺时针）
+JPEGTRAN_ARGS = {
+    Image.Transpose.FLIP_LEFT_RIGHT: ["-flip", "horizontal"],
+    Image.Transpose.FLIP_TOP_BOTTOM: ["-flip", "vertical"],
+    Image.Transpose.ROTATE_180: ["-rotate", "180"],
+    Image.Transpose.ROTATE_90: ["-rotate", "270"],
+    Image.Transpose.ROTATE_270: ["-rotate", "90"],
+    Image.Transpose.TRANSPOSE: ["-transpose"],
+    Image.Transpose.TRANSVERSE: ["-transverse"],
+}
+
+
+class UnsupportedJPEG(Exception):
+    """无法在系数域处理的JPEG（渐进式、算术编码、非8位精度等）"""
+
+
+# ------------------------- 头部解析 -------------------------
+def _read_segments(data):
+    """逐个读取标记段，返回 (marker, 段内容, 段结束位置) 的生成器，遇到SOS后停止"""
+    if data[:2] != b"\xff\xd8":
+        raise UnsupportedJPEG("不是JPEG文件")
+    pos = 2
+    while pos < len(data):
+        if data[pos] != 0xFF:
+            raise UnsupportedJPEG(f"位置{pos}处缺少标记")
+        while data[pos] == 0xFF:
+            pos += 1
+        marker = data[pos]
+        pos += 1
+        if marker == 0xD9:
+            return
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            continue
+        length = struct.unpack(">H", data[pos:pos + 2])[0]
+        segment = data[pos + 2:pos + length]
+        pos += length
+        yield marker, segment, pos
+        if marker == 0xDA:
+            return
+
+
+def read_jpeg_info(path):
+    """读取JPEG尺寸与MCU大小（不解码）
+    返回：dict(width, height, mcu_width, mcu_height, progressive)，非JPEG返回None
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read(65536 * 4)
+        for marker, seg, _ in _read_segments(data):
+            if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", seg[1:5])
+                nf = seg[5]
+                if nf == 1:
+                    hmax = vmax = 1
+                else:
+                    hmax = max(seg[7 + 3 * i] >> 4 for i in range(nf))
+                    vmax = max(seg[7 + 3 * i] & 15 for i in range(nf))
+                return {
+                    "width": width,
+                    "height": height,
+                    "mcu_width": 8 * hmax,
+                    "mcu_height": 8 * vmax,
+                    "progressive": marker not in (0xC0, 0xC1),
+                }
+    except (OSError, UnsupportedJPEG, struct.error, IndexError):
+        return None
+    return None
+
+
+def is_lossless_possible(info, transpose_method=None, crop_box=None):
+    """判断变换/裁剪能否完全无损（等同jpegtran -perfect）
+    参数：
+        info - read_jpeg_info 的返回值
+        transpose_method - PIL转置方式或None
+        crop_box - (left, top, right, bottom)，基于变换后的图像，或None
+    """
+    if not info or info["progressive"]:
+        return False
+    w, h = info["width"], info["height"]
+    mw, mh = info["mcu_width"], info["mcu_height"]
+    if transpose_method is not None:
+        if transpose_method not in TRANSPOSE_STEPS:
+            return False
+        for step in TRANSPOSE_STEPS[transpose_method]:
+            if step == "flip_h" and w % mw:
+                return False
+            if step == "flip_v" and h % mh:
+                return False
+            if step == "transpose":
+                w, h, mw, mh = h, w, mh, mw
+    if crop_box is not None:
+        left, top, right, bottom = crop_box
+        if left % mw or top % mh:
+            return False
+        if not (0 <= left < right <= w and 0 <= top < bottom <= h):
+            return False
+    return True
+
+
+# ------------------------- Huffman -------------------------
+def _build_codes(bits, values):
+    """根据码长计数和符号表生成规范Huffman码：{符号: (码字, 码长)}"""
+    codes = {}
+    code = 0
+    k = 0
+    for length in range(1, 17):
+        for _ in range(bits[length - 1]):
+            codes[values[k]] = (code, length)
+            code += 1
+            k += 1
+        code <<= 1
+    return codes
+
+
+def _build_lut(bits, values):
+    """生成16位前瞻查找表：表项 = 符号<<8 | 码长"""
+    lut = [0] * 65536
+    for symbol, (code, length) in _build_codes(bits, values).items():
+        start = code << (16 - length)
+        count = 1 << (16 - length)
+        lut[start:start + count] = [(symbol << 8) | length] * count
+    return lut
+
+
+def _optimal_table(freq):
+    """按符号频率生成码长不超过16位的最优Huffman表（JPEG标准K.2，同libjpeg）"""
+    freq = list(freq) + [1]  # 保留一个全1码字
+    codesize = [0] * 257
+    others = [-1] * 257
+    while True:
+        c1, v = -1, None
+        for i in range(257):
+            if freq[i] and (v is None or freq[i] <= v):
+                v, c1 = freq[i], i
+        c2, v = -1, None
+        for i in range(257):
+            if freq[i] and i != c1 and (v is None or freq[i] <= v):
+                v, c2 = freq[i], i
+        if c2 < 0:
+            break
+        freq[c1] += freq[c2]
+        freq[c2] = 0
+        codesize[c1] += 1
+        while others[c1] >= 0:
+            c1 = others[c1]
+            codesize[c1] += 1
+        others[c1] = c2
+        codesize[c2] += 1
+        while others[c2] >= 0:
+            c2 = others[c2]
+            codesize[c2] += 1
+
+    bits = [0] * 33
+    for size in codesize:
+        if size:
+            bits[size] += 1
+    for i in range(32, 16, -1):
+        while bits[i] > 0:
+            j = i - 2
+            while bits[j] == 0:
+                j -= 1
+            bits[i] -= 2
+            bits[i - 1] += 1
+            bits[j + 1] += 2
+            bits[j] -= 1
+    i = 16
+    while bits[i] == 0:
+        i -= 1
+    bits[i] -= 1
+
+    values = [s for size in range(1, 33) for s in range(256) if codesize[s] == size]
+    return bits[1:17], values
+
+
+# ------------------------- 熵解码 -------------------------
+def _entropy_segments(data, pos):
+    """从SOS之后截取熵编码数据，按RST标记切分并去除0xFF00填充
+    返回：(去填充后的段列表, 熵数据结束位置)
+    """
+    segments = []
+    start = pos
+    while True:
+        i = data.find(b"\xff", pos)
+        if i < 0 or i + 1 >= len(data):
+            raise UnsupportedJPEG("熵编码数据不完整")
+        j = i + 1
+        while j < len(data) and data[j] == 0xFF:  # 标记前的填充字节
+            j += 1
+        if j >= len(data):
+            raise UnsupportedJPEG("熵编码数据不完整")
+        nxt = data[j]
+        if nxt == 0x00 and j == i + 1:
+            pos = j + 1
+            continue
+        segments.append(data[start:i].replace(b"\xff\x00", b"\xff"))
+        if 0xD0 <= nxt <= 0xD7:
+            start = pos = j + 1
+            continue
+        return segments, i
+
+
+def _decode_scan(segments, comps, mcux, mcuy, restart_interval, dc_luts, ac_luts):
+    """解码一个交织扫描中的全部DCT系数（zigzag顺序，DC为绝对值）"""
+    layout = []
+    for c in comps:
+        for j in range(c["v"]):
+            for i in range(c["h"]):
+                layout.append((c, i, j, dc_luts[c["td"]], ac_luts[c["ta"]]))
+
+    total = mcux * mcuy
+    per_segment = restart_interval or total
+    mcu = 0
+    for buf in segments:
+        if mcu >= total:
+            break
+        buf = buf + b"\x00\x00\x00\x00"
+        p = 0
+        for c in comps:
+            c["pred"] = 0
+        for _ in range(min(per_segment, total - mcu)):
+            my, mx = divmod(mcu, mcux)
+            for c, i, j, dclut, aclut in layout:
+                block = [0] * 64
+                q = p >> 3
+                e = dclut[((buf[q] << 16 | buf[q + 1] << 8 | buf[q + 2]) >> (8 - (p & 7))) & 0xFFFF]
+                if not e:
+                    raise UnsupportedJPEG("Huffman解码错误")
+                p += e & 0xFF
+                s = e >> 8
+                diff = 0
+                if s:
+                    q = p >> 3
+                    diff = (((buf[q] << 16 | buf[q + 1] << 8 | buf[q + 2]) >> (8 - (p & 7))) & 0xFFFF) >> (16 - s)
+                    p += s
+                    if diff < (1 << (s - 1)):
+                        diff -= (1 << s) - 1
+                c["pred"] += diff
+                block[0] = c["pred"]
+                k = 1
+                while k < 64:
+                    q = p >> 3
+                    e = aclut[((buf[q] << 16 | buf[q + 1] << 8 | buf[q + 2]) >> (8 - (p & 7))) & 0xFFFF]
+                    if not e:
+                        raise UnsupportedJPEG("Huffman解码错误")
+                    p += e & 0xFF
+                    rs = e >> 8
+                    r, s = rs >> 4, rs & 15
+                    if s:
+                        k += r
+                        q = p >> 3
+                        v = (((buf[q] << 16 | buf[q + 1] << 8 | buf[q + 2]) >> (8 - (p & 7))) & 0xFFFF) >> (16 - s)
+                        p += s
+                        if v < (1 << (s - 1)):
+                            v -= (1 << s) - 1
+                        if k > 63:
+                            raise UnsupportedJPEG("AC系数越界")
+                        block[k] = v
+                        k += 1
+                    elif r == 15:
+                        k += 16
+                    else:
+                        break
+                c["blocks"][my * c["v"] + j][mx * c["h"] + i] = block
+            mcu += 1
+    if mcu < total:
+        raise UnsupportedJPEG("扫描数据提前结束")
+
+
+# ------------------------- 读取/写出 -------------------------
+def _load(data):
+    """解析JPEG并解码全部系数"""
+    jpeg = {"markers": [], "qt": {}, "dht": {}, "restart": 0, "sof": None}
+    for marker, seg, end in _read_segments(data):
+        if 0xE0 <= marker <= 0xEF or marker == 0xFE:
+            jpeg["markers"].append((marker, seg))
+        elif marker == 0xDB:
+            i = 0
+            while i < len(seg):
+                pq, tq = seg[i] >> 4, seg[i] & 15
+                if pq:
+                    zz = list(struct.unpack(">64H", seg[i + 1:i + 129]))
+                    i += 129
+                else:
+                    zz = list(seg[i + 1:i + 65])
+                    i += 65
+                jpeg["qt"][tq] = zz
+        elif marker == 0xC4:
+            i = 0
+            while i < len(seg):
+                tc, th = seg[i] >> 4, seg[i] & 15
+                bits = list(seg[i + 1:i + 17])
+                n = sum(bits)
+                jpeg["dht"][(tc, th)] = (bits, list(seg[i + 17:i + 17 + n]))
+                i += 17 + n
+        elif marker in (0xC0, 0xC1):
+            if seg[0] != 8:
+                raise UnsupportedJPEG("仅支持8位精度")
+            height, width, nf = struct.unpack(">HHB", seg[1:6])
+            if height == 0:
+                raise UnsupportedJPEG("不支持DNL标记")
+            comps = []
+            for i in range(nf):
+                cid, hv, tq = seg[6 + 3 * i:9 + 3 * i]
+                comps.append({"id": cid, "h": hv >> 4, "v": hv & 15, "tq": tq})
+            if nf == 1:
+                comps[0]["h"] = comps[0]["v"] = 1
+            jpeg["sof"] = marker
+            jpeg["width"], jpeg["height"], jpeg["comps"] = width, height, comps
+        elif 0xC2 <= marker <= 0xCF and marker not in (0xC4, 0xC8):
+            raise UnsupportedJPEG("不支持渐进式/无损/算术编码JPEG")
+        elif marker == 0xDD:
+            jpeg["restart"] = struct.unpack(">H", seg[:2])[0]
+        elif marker == 0xDA:
+            if jpeg["sof"] is None:
+                raise UnsupportedJPEG("缺少SOF")
+            ns = seg[0]
+            if ns != len(jpeg["comps"]):
+                raise UnsupportedJPEG("不支持多扫描JPEG")
+            by_id = {c["id"]: c for c in jpeg["comps"]}
+            for i in range(ns):
+                c = by_id[seg[1 + 2 * i]]
+                c["td"], c["ta"] = seg[2 + 2 * i] >> 4, seg[2 + 2 * i] & 15
+            segments, scan_end = _entropy_segments(data, end)
+            if data.find(b"\xff\xda", scan_end) >= 0:
+                raise UnsupportedJPEG("不支持多扫描JPEG")
+
+            hmax = max(c["h"] for c in jpeg["comps"])
+            vmax = max(c["v"] for c in jpeg["comps"])
+            mcux = -(-jpeg["width"] // (8 * hmax))
+            mcuy = -(-jpeg["height"] // (8 * vmax))
+            for c in jpeg["comps"]:
+                c["blocks"] = [[None] * (mcux * c["h"]) for _ in range(mcuy * c["v"])]
+            dc_luts = {th: _build_lut(*t) for (tc, th), t in jpeg["dht"].items() if tc == 0}
+            ac_luts = {th: _build_lut(*t) for (tc, th), t in jpeg["dht"].items() if tc == 1}
+            _decode_scan(segments, jpeg["comps"], mcux, mcuy, jpeg["restart"], dc_luts, ac_luts)
+            return jpeg
+    raise UnsupportedJPEG("未找到扫描数据")
+
+
+def _encode_scan(jpeg):
+    """用最优Huffman表重新熵编码，返回 (DHT表字典, 熵编码字节)"""
+    comps = jpeg["comps"]
+    hmax = max(c["h"] for c in comps)
+    vmax = max(c["v"] for c in comps)
+    mcux = -(-jpeg["width"] // (8 * hmax))
+    mcuy = -(-jpeg["height"] // (8 * vmax))
+
+    # 第一遍：生成符号并统计频率
+    dc_freq = {c["td"]: [0] * 256 for c in comps}
+    ac_freq = {c["ta"]: [0] * 256 for c in comps}
+    tokens = []
+    append = tokens.append
+    for c in comps:
+        c["pred"] = 0
+    for my in range(mcuy):
+        for mx in range(mcux):
+            for c in comps:
+                dcf, acf = dc_freq[c["td"]], ac_freq[c["ta"]]
+                td, ta = c["td"], c["ta"]
+                for j in range(c["v"]):
+                    row = c["blocks"][my * c["v"] + j]
+                    for i in range(c["h"]):
+                        block = row[mx * c["h"] + i]
+                        diff = block[0] - c["pred"]
+                        c["pred"] = block[0]
+                        s = abs(diff).bit_length()
+                        dcf[s] += 1
+                        append((0, td, s, diff + (1 << s) - 1 if diff < 0 else diff, s))
+                        run = 0
+                        for k in range(1, 64):
+                            v = block[k]
+                            if v == 0:
+                                run += 1
+                                continue
+                            while run > 15:
+                                acf[0xF0] += 1
+                                append((1, ta, 0xF0, 0, 0))
+                                run -= 16
+                            s = abs(v).bit_length()
+                            rs = (run << 4) | s
+                            acf[rs] += 1
+                            append((1, ta, rs, v + (1 << s) - 1 if v < 0 else v, s))
+                            run = 0
+                        if run:
+                            acf[0x00] += 1
+                            append((1, ta, 0x00, 0, 0))
+
+    tables = {}
+    codes = {}
+    for tc, freqs in ((0, dc_freq), (1, ac_freq)):
+        for th, freq in freqs.items():
+            bits, values = _optimal_table(freq)
+            tables[(tc, th)] = (bits, values)
+            codes[(tc, th)] = _build_codes(bits, values)
+
+    # 第二遍：写出比特流
+    out = bytearray()
+    acc = 0
+    nacc = 0
+    for tc, th, sym, val, nb in tokens:
+        code, length = codes[(tc, th)][sym]
+        acc = (acc << length) | code
+        nacc += length
+        if nb:
+            acc = (acc << nb) | val
+            nacc += nb
+        while nacc >= 8:
+            nacc -= 8
+            out.append((acc >> nacc) & 0xFF)
+        acc &= (1 << nacc) - 1
+    if nacc:
+        out.append(((acc << (8 - nacc)) | ((1 << (8 - nacc)) - 1)) & 0xFF)
+    return tables, bytes(out).replace(b"\xff", b"\xff\x00")
+
+
+def _dump(jpeg):
+    """把系数重新组装为JPEG字节流（保留APPn/COM段，去掉重启间隔）"""
+    tables, scan = _encode_scan(jpeg)
+    out = bytearray(b"\xff\xd8")
+
+    def segment(marker, payload):
+        out.extend(struct.pack(">BBH", 0xFF, marker, len(payload) + 2))
+        out.extend(payload)
+
+    for marker, seg in jpeg["markers"]:
+        segment(marker, seg)
+    for tq, zz in sorted(jpeg["qt"].items()):
+        if max(zz) > 255:
+            segment(0xDB, bytes([0x10 | tq]) + struct.pack(">64H", *zz))
+        else:
+            segment(0xDB, bytes([tq]) + bytes(zz))
+    comps = jpeg["comps"]
+    sof = struct.pack(">BHHB", 8, jpeg["height"], jpeg["width"], len(comps))
+    for c in comps:
+        sof += bytes([c["id"], (c["h"] << 4) | c["v"], c["tq"]])
+    segment(jpeg["sof"], sof)
+    for (tc, th), (bits, values) in sorted(tables.items()):
+        segment(0xC4, bytes([(tc << 4) | th]) + bytes(bits) + bytes(values))
+    sos = bytes([len(comps)])
+    for c in comps:
+        sos += bytes([c["id"], (c["td"] << 4) | c["ta"]])
+    segment(0xDA, sos + b"\x00\x3f\x00")
+    out.extend(scan)
+    out.extend(b"\xff\xd9")
+    return bytes(out)
+
+
+# ------------------------- 系数域变换 -------------------------
+def _flip_h(jpeg):
+    for c in jpeg["comps"]:
+        for row in c["blocks"]:
+            row.reverse()
+            for block in row:
+                for k in _ODD_COL_ZZ:
+                    block[k] = -block[k]
+
+
+def _flip_v(jpeg):
+    for c in jpeg["comps"]:
+        c["blocks"].reverse()
+        for row in c["blocks"]:
+            for block in row:
+                for k in _ODD_ROW_ZZ:
+                    block[k] = -block[k]
+
+
+def _transpose(jpeg):
+    for c in jpeg["comps"]:
+        rows = c["blocks"]
+        c["blocks"] = [
+            [[rows[by][bx][k] for k in _TRANSPOSE_ZZ] for by in range(len(rows))]
+            for bx in range(len(rows[0]))
+        ]
+        c["h"], c["v"] = c["v"], c["h"]
+    jpeg["qt"] = {tq: [zz[k] for k in _TRANSPOSE_ZZ] for tq, zz in jpeg["qt"].items()}
+    jpeg["width"], jpeg["height"] = jpeg["height"], jpeg["width"]
+
+
+def _crop(jpeg, crop_box):
+    left, top, right, bottom = crop_box
+    hmax = max(c["h"] for c in jpeg["comps"])
+    vmax = max(c["v"] for c in jpeg["comps"])
+    width, height = right - left, bottom - top
+    for c in jpeg["comps"]:
+        bx0 = left // (8 * hmax) * c["h"]
+        by0 = top // (8 * vmax) * c["v"]
+        bw = -(-width // (8 * hmax)) * c["h"]
+        bh = -(-height // (8 * vmax)) * c["v"]
+        c["blocks"] = [row[bx0:bx0 + bw] for row in c["blocks"][by0:by0 + bh]]
+    jpeg["width"], jpeg["height"] = width, height
+
+
+_STEP_FUNCS = {"flip_h": _flip_h, "flip_v": _flip_v, "transpose": _transpose}
+
+
+def transform_jpeg_bytes(data, transpose_method=None, crop_box=None):
+    """内置实现：在系数域完成转置与裁剪，返回新的JPEG字节
+    调用前需用 is_lossless_possible 确认边界已对齐。
+    """
+    jpeg = _load(data)
+    if transpose_method is not None:
+        for step in TRANSPOSE_STEPS[transpose_method]:
+            _STEP_FUNCS[step](jpeg)
+    if crop_box is not None:
+        _crop(jpeg, crop_box)
+    return _dump(jpeg)
+
+
+def _find_jpegtran():
+    if not use_external_jpegtran:
+        return None
+    return shutil.which(jpegtran_path)
+
+
+def available():
+    """当前设置下是否有可用的无损实现（找到jpegtran，或允许使用内置实现）"""
+    return use_builtin or _find_jpegtran() is not None
+
+
+def transform_jpeg_file(src_path, dst_path, transpose_method=None, crop_box=None):
+    """无损变换JPEG文件
+    参数：
+        src_path - 源JPEG路径
+        dst_path - 输出路径（可与临时文件配合后 os.replace 覆盖源文件）
+        transpose_method - PIL转置方式（Image.Transpose.*）或None
+        crop_box - 变换后图像上的裁剪框 (left, top, right, bottom) 或None
+    返回：True 表示已无损写出；False 表示无法无损处理（或没有jpegtran且未启用内置实现），调用方应回退像素路径
+    """
+    jpegtran = _find_jpegtran()
+    if jpegtran is None and not use_builtin:
+        return False
+    info = read_jpeg_info(src_path)
+    if not is_lossless_possible(info, transpose_method, crop_box):
+        return False
+
+    if jpegtran:
+        cmd = [jpegtran, "-copy", "all", "-perfect"]
+        if transpose_method is not None:
+            cmd += JPEGTRAN_ARGS[transpose_method]
+        if crop_box is not None:
+            left, top, right, bottom = crop_box
+            cmd += ["-crop", f"{right - left}x{bottom - top}+{left}+{top}"]
+        cmd += ["-outfile", dst_path, src_path]
+        result = subprocess.run(cmd, capture_output=True)
+        if result.returncode == 0:
+            return True
+        message = result.stderr.decode(errors='ignore').strip()
+        if not use_builtin:
+            print(f"jpegtran执行失败，改用普通方式：{message}")
+            return False
+        print(f"jpegtran执行失败，改用内置实现：{message}")
+
+    try:
+        with open(src_path, "rb") as f:
+            data = f.read()
+        output = transform_jpeg_bytes(data, transpose_method, crop_box)
+    except (UnsupportedJPEG, struct.error, IndexError, KeyError) as e:
+        print(f"无法无损处理 {os.path.basename(src_path)}：{e}")
+        return False
+    with open(dst_path, "wb") as f:
+        f.write(output)
+    return True
@@ -0,0 +1,188 @@
+##### 按内存预算调度并行任务 #####
+"""
+帧尺寸差别很大（876x1237 的前景到 8K 原图），固定线程数要么吃不满CPU、要么爆内存。
+这里按文件头估算每个任务解码后的峰值内存（宽 × 高 × 每像素字节 × 流程中的副本数），
+只在全局内存预算允许时才放行任务：
+    - 大任务先开始（总耗时更短）；排在前面的放不下时，用能放下的较小任务补空
+    - 超过整个预算的任务独占运行
+    - 很小的任务打包成一批在同一线程里顺序处理，一批只占用其中最大一项的内存：
+      调用方处理完上一项的结果后才开始下一项，做好的结果不会在队列中堆积
+结果按完成顺序逐个交给调用方，调用方处理完（例如贴进画布并关闭）后才释放对应额度。
+"""
+import os
+import sys
+import queue
+import threading
+import ctypes
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# ========== 全局配置 ==========
+MEMORY_BUDGET = None          # 内存预算（字节），None 为可用物理内存的 BUDGET_FRACTION
+BUDGET_FRACTION = 0.5
+FALLBACK_BUDGET = 2 << 30     # 无法获取可用内存时使用的预算（2GB）
+MAX_WORKERS = None            # 并行线程数，None 为CPU核心数
+DEFAULT_COPIES = 3            # 每个任务同时存在的整帧副本数（解码 + 转换 + 处理结果）
+SMALL_TASK_BYTES = 16 << 20   # 小于此值的任务参与打包
+SMALL_BATCH_SIZE = 16         # 每批最多打包的任务数
+# =============================
+
+# 各模式每像素字节数（调色板图在流程中会转换成RGBA）
+_MODE_BYTES = {"1": 1, "L": 1, "P": 4, "LA": 2, "PA": 4, "RGB": 3, "RGBA": 4,
+               "RGBX": 4, "CMYK": 4, "YCbCr": 3, "I;16": 2, "I": 4, "F": 4}
+
+
+def available_memory():
+    """当前可用物理内存（字节），获取失败返回None"""
+    try:
+        if sys.platform == "win32":
+            class MEMORYSTATUSEX(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong),
+                            ("ullTotalPhys", ctypes.c_ulonglong), ("ullAvailPhys", ctypes.c_ulonglong),
+                            ("ullTotalPageFile", ctypes.c_ulonglong), ("ullAvailPageFile", ctypes.c_ulonglong),
+                            ("ullTotalVirtual", ctypes.c_ulonglong), ("ullAvailVirtual", ctypes.c_ulonglong),
+                            ("ullAvailExtendedVirtual", ctypes.c_ulonglong)]
+            status = MEMORYSTATUSEX()
+            status.dwLength = ctypes.sizeof(MEMORYSTATUSEX)
+            if ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+                return status.ullAvailPhys
+            return None
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def default_budget():
+    if MEMORY_BUDGET:
+        return MEMORY_BUDGET
+    available = available_memory()
+    return int(available * BUDGET_FRACTION) if available else FALLBACK_BUDGET
+
+
+def estimate_footprint(path, copies=DEFAULT_COPIES):
+    """只读文件头估算任务峰值内存（字节）；无法读取时按0计（任务本身会报错）"""
+    try:
+        with Image.open(path) as img:
+            width, height = img.size
+            mode = img.mode
+    except Exception:
+        return 0
+    return width * height * _MODE_BYTES.get(mode, 4) * copies
+
+
+class MemoryScheduler:
+    """在内存预算内并行执行任务
+    用法：
+        scheduler = MemoryScheduler()
+        for item, result, error in scheduler.map(func, items, costs):
+            ...  # 循环体结束后该项占用的额度才释放
+    """
+    def __init__(self, budget=None, max_workers=None):
+        self.budget = budget or default_budget()
+        self.max_workers = max_workers or MAX_WORKERS or os.cpu_count() or 4
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def reserve(self, nbytes, wait=False):
+        """为长期存在的对象（例如输出画布）预留额度；
+        wait=True 时先等到预算够用（或已没有其它占用）再预留"""
+        with self.condition:
+            while wait and self.used and self.used + nbytes > self.budget:
+                self.condition.wait()
+            self.used += nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used -= nbytes
+            self.condition.notify_all()
+
+    def _plan(self, items, costs):
+        """大任务单独成组，小任务打包；按组内最大占用从大到小排序"""
+        order = sorted(range(len(items)), key=lambda i: costs[i], reverse=True)
+        large = [i for i in order if costs[i] >= SMALL_TASK_BYTES]
+        small = [i for i in order if costs[i] < SMALL_TASK_BYTES]
+        units = [[i] for i in large]
+        if small:
+            # 打包后的批数不少于线程数，避免打包反而降低并行度
+            size = max(1, min(SMALL_BATCH_SIZE, len(small) // (self.max_workers * 2)))
+            units.extend(small[start:start + size] for start in range(0, len(small), size))
+        # 超过整个预算的任务按整个预算计算，即独占运行
+        return [(unit, min(max(costs[i] for i in unit), self.budget)) for unit in units]
+
+    def _admit(self, pending, running, stop):
+        """取出下一个能放进预算的组（最大优先，放不下时找能放下的较小组）；全部空闲时放行最大组"""
+        with self.condition:
+            while not stop.is_set():
+                free = self.budget - self.used
+                for position, (unit, cost) in enumerate(pending):
+                    if cost <= free or running[0] == 0:
+                        pending.pop(position)
+                        self.used += cost
+                        running[0] += 1
+                        return unit, cost
+                self.condition.wait()
+        return None
+
+    def map(self, func, items, costs=None):
+        """并行执行 func(item)，按完成顺序产出 (item, 结果, 异常)"""
+        items = list(items)
+        if costs is None:
+            costs = [0] * len(items)
+        pending = self._plan(items, costs)
+        results = queue.Queue()
+        stop = threading.Event()
+        running = [0]       # 已放行、额度尚未释放的组数
+        taken = {unit[0]: threading.Event() for unit, _ in pending}     # 调用方已处理完本组上一项
+        admitted_costs = {}     # 已放行、额度尚未释放的组 -> 额度
+
+        def run_unit(unit, cost):
+            for position, i in enumerate(unit):
+                if position:
+                    taken[unit[0]].wait()
+                    taken[unit[0]].clear()
+                if stop.is_set():
+                    break
+                try:
+                    results.put((i, func(items[i]), None, unit, cost))
+                except Exception as e:
+                    results.put((i, None, e, unit, cost))
+
+        def dispatch():
+            while pending:
+                admitted = self._admit(pending, running, stop)
+                if admitted is None:
+                    return
+                admitted_costs[admitted[0][0]] = admitted[1]
+                try:
+                    executor.submit(run_unit, *admitted)
+                except RuntimeError:    # 调用方已提前结束
+                    return
+
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        dispatcher = threading.Thread(target=dispatch, daemon=True)
+        dispatcher.start()
+        remaining = {}      # 每组还未被调用方处理完的项数
+        try:
+            for _ in range(len(items)):
+                i, result, error, unit, cost = results.get()
+                yield items[i], result, error
+                key = unit[0]
+                taken[key].set()
+                remaining[key] = remaining.get(key, len(unit)) - 1
+                if remaining[key] == 0:
+                    with self.condition:
+                        running[0] -= 1
+                        del admitted_costs[key]
+                    self.release(cost)
+        finally:
+            stop.set()
+            for event in taken.values():
+                event.set()
+            with self.condition:
+                self.condition.notify_all()
+            executor.shutdown(wait=True)
+            dispatcher.join()
+            # 调用方提前结束时，释放已放行但没处理完的组占用的额度
+            with self.condition:
+                running[0] -= len(admitted_costs)
+            self.release(sum(admitted_costs.values()))
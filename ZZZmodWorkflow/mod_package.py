@@ -0,0 +1,161 @@
+##### MOD打包（流式zip） #####
+"""
+把生成好的DDS/INI边生成边写进zip：每个文件交给线程池压缩（zlib压缩和crc32计算时释放GIL，
+多个文件真正并行），写入时按加入顺序依次落盘，压缩与后续的DDS转换同时进行。
+压缩后反而变大的文件按“仅存储”写入。
+
+结束时在包内和包旁各写一份清单（文件名、大小、压缩后大小、SHA-256），
+先写到临时文件，全部完成后才改名为正式文件名，中途失败不会留下残缺的包。
+"""
+import os
+import json
+import time
+import zlib
+import struct
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# ========== 全局配置 ==========
+COMPRESS_LEVEL = 6          # deflate压缩等级（1最快，9最小）
+COMPRESS_WORKERS = None     # 压缩线程数，None 为CPU核心数
+READ_CHUNK = 4 << 20        # 单个文件分块读取/压缩的大小
+MANIFEST_NAME = "manifest.json"
+# =============================
+
+_ZIP_LIMIT = 0xFFFFFFFF     # 未使用ZIP64，单文件与总大小需小于4GB
+
+
+def _dos_time(timestamp):
+    t = time.localtime(max(timestamp, 315532800))   # zip时间从1980年开始
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+           ((t.tm_year - 1980) << 9) | (t.tm_mon << 4) | t.tm_mday
+
+
+def _compress_file(path):
+    """读取并压缩单个文件，返回 (数据, 压缩方式, crc32, 原大小, sha256, 修改时间)"""
+    compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+    sha = hashlib.sha256()
+    crc = 0
+    size = 0
+    parts = []
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            sha.update(chunk)
+            size += len(chunk)
+            parts.append(compressor.compress(chunk))
+    parts.append(compressor.flush())
+    data = b"".join(parts)
+    method = 8
+    if len(data) >= size:   # 压缩无收益时直接存储
+        with open(path, "rb") as f:
+            data, method = f.read(), 0
+    return data, method, crc, size, sha.hexdigest(), os.path.getmtime(path)
+
+
+def _compress_bytes(data):
+    compressed = zlib.compress(data, COMPRESS_LEVEL)[2:-4]   # 去掉zlib头尾得到raw deflate
+    method = 8
+    if len(compressed) >= len(data):
+        compressed, method = data, 0
+    return compressed, method, zlib.crc32(data), len(data), hashlib.sha256(data).hexdigest(), time.time()
+
+
+class PackageWriter:
+    """流式zip写入器
+    用法：
+        package = PackageWriter("TextureMod.zip")
+        package.add(path)          # 可在生成过程中随时加入，压缩在后台进行
+        package.close()            # 写入清单和目录，返回清单
+    """
+    def __init__(self, zip_path, workers=None):
+        self.zip_path = zip_path
+        self.temp_path = zip_path + ".tmp"
+        self.file = open(self.temp_path, "wb")
+        self.executor = ThreadPoolExecutor(max_workers=workers or COMPRESS_WORKERS or os.cpu_count())
+        self.pending = deque()      # (成员名, future)，按加入顺序写出
+        self.entries = []
+        self.names = set()
+
+    def add(self, path, arcname=None):
+        """加入一个文件（后台压缩）；同名成员只保留第一次加入的"""
+        arcname = (arcname or os.path.basename(path)).replace("\\", "/")
+        if arcname in self.names:
+            return
+        self.names.add(arcname)
+        self.pending.append((arcname, self.executor.submit(_compress_file, path)))
+        self._flush(block=False)
+
+    def _flush(self, block):
+        """按顺序写出已压缩完成的成员"""
+        while self.pending and (block or self.pending[0][1].done()):
+            arcname, future = self.pending.popleft()
+            self._write_member(arcname, *future.result())
+
+    def _write_member(self, arcname, data, method, crc, size, sha256, mtime):
+        offset = self.file.tell()
+        if offset + len(data) >= _ZIP_LIMIT or size >= _ZIP_LIMIT:
+            raise ValueError("压缩包超过4GB，请分批打包")
+        name = arcname.encode("utf-8")
+        dos_time, dos_date = _dos_time(mtime)
+        # 本地文件头（通用标志0x0800：文件名为UTF-8）
+        self.file.write(struct.pack("<IHHHHHIIIHH", 0x04034b50, 20, 0x0800, method,
+                                    dos_time, dos_date, crc, len(data), size, len(name), 0))
+        self.file.write(name)
+        self.file.write(data)
+        self.entries.append({"name": arcname, "offset": offset, "method": method, "crc": crc,
+                             "compressed": len(data), "size": size, "sha256": sha256,
+                             "time": dos_time, "date": dos_date})
+
+    def _write_directory(self):
+        start = self.file.tell()
+        for e in self.entries:
+            name = e["name"].encode("utf-8")
+            self.file.write(struct.pack("<IHHHHHHIIIHHHHHII", 0x02014b50, 20, 20, 0x0800, e["method"],
+                                        e["time"], e["date"], e["crc"], e["compressed"], e["size"],
+                                        len(name), 0, 0, 0, 0, 0, e["offset"]))
+            self.file.write(name)
+        end = self.file.tell()
+        if end >= _ZIP_LIMIT:
+            raise ValueError("压缩包超过4GB，请分批打包")
+        self.file.write(struct.pack("<IHHHHIIH", 0x06054b50, 0, 0, len(self.entries),
+                                    len(self.entries), end - start, start, 0))
+
+    def close(self):
+        """等待剩余成员写完，写入清单和目录，返回清单"""
+        try:
+            self._flush(block=True)
+            manifest = {
+                "files": [{"name": e["name"], "size": e["size"], "compressed": e["compressed"],
+                           "sha256": e["sha256"]} for e in self.entries],
+                "total_size": sum(e["size"] for e in self.entries),
+                "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }
+            manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            self._write_member(MANIFEST_NAME, *_compress_bytes(manifest_bytes))
+            self._write_directory()
+            self.file.close()
+            os.replace(self.temp_path, self.zip_path)
+            with open(os.path.splitext(self.zip_path)[0] + ".manifest.json", "wb") as f:
+                f.write(manifest_bytes)
+            return manifest
+        except BaseException:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown(wait=False)
+
+    def abort(self):
+        """放弃打包并删除临时文件"""
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
@@ -0,0 +1,196 @@
+##### 拼接图调色板量化 #####
+"""
+UI、光锥之类的动画通常只用到有限的几种颜色，拼接图却按24位保存。
+这里把拼接好的各页量化成8位索引PNG：
+    - 所有页（即所有帧）共用一个全局调色板，播放时不会因为各帧调色板不同而闪烁
+    - 调色板只在各页等间隔抽取的像素上构建（默认约100万个）：先用PIL中位切分得到初始调色板，
+      再做几轮k-means细化（最近色分配由PIL在C中完成，求均值用numpy整批计算）；没有numpy时只用中位切分
+    - 整页映射到调色板（可选Floyd-Steinberg抖动）由PIL在C中完成，1亿像素的页几秒内完成
+量化完成后输出文件大小的变化。
+"""
+import os
+import math
+from PIL import Image
+import png_parallel
+import memory_scheduler
+try:
+    import numpy as np  # k-means细化需要numpy
+except ImportError:
+    np = None
+
+# ========== 全局配置 ==========
+COLORS = 256                # 调色板颜色数（2~256）
+DITHER = False              # Floyd-Steinberg抖动（渐变多时减少色带，但压缩率会变差）
+METHOD = "kmeans"           # kmeans：中位切分后再k-means细化；mediancut：只用中位切分
+SAMPLE_PIXELS = 1_000_000   # 构建调色板时从所有页中抽取的像素数
+KMEANS_ITERATIONS = 8       # k-means最多迭代次数（调色板不再变化时提前结束）
+# =============================
+
+METHODS = ("kmeans", "mediancut")
+
+
+def sample_image(images, limit=None):
+    """从各图中等间隔抽取共约 limit 个像素，拼成一张RGB图（用于构建调色板）"""
+    limit = limit or SAMPLE_PIXELS
+    total = sum(img.width * img.height for img in images)
+    step = max(1, math.ceil(math.sqrt(total / limit)))
+    parts = []
+    for img in images:
+        size = (max(1, img.width // step), max(1, img.height // step))
+        part = img.resize(size, Image.NEAREST) if step > 1 else img.copy()
+        parts.append(part.convert("RGB") if part.mode != "RGB" else part)
+    sample = Image.new("RGB", (max(part.width for part in parts), sum(part.height for part in parts)))
+    y = 0
+    for part in parts:
+        sample.paste(part, (0, y))
+        y += part.height
+        part.close()
+    return sample
+
+
+def _kmeans(sample, palette, iterations):
+    """在抽样像素上做k-means细化调色板：
+    分配一步用PIL映射到当前调色板（与最终输出的映射方式一致），更新一步用numpy按标签求均值
+    """
+    points = np.asarray(sample).reshape(-1, 3)
+    centers = np.array(palette, np.float64).reshape(-1, 3)
+    for _ in range(iterations):
+        with quantize(sample, palette, dither=False) as indexed:
+            labels = np.asarray(indexed).ravel()
+        counts = np.bincount(labels, minlength=len(centers))[:len(centers)]
+        sums = np.stack([np.bincount(labels, points[:, channel], len(centers))[:len(centers)]
+                         for channel in range(3)], axis=1)
+        used = counts > 0
+        centers[used] = sums[used] / counts[used, np.newaxis]     # 没分到像素的颜色保持不变
+        updated = np.clip(np.rint(centers), 0, 255).astype(np.uint8).ravel().tolist()
+        if updated == palette:
+            break
+        palette = updated
+    return palette
+
+
+def build_palette(images, colors=None, method=None):
+    """为 images 构建共用的调色板，返回 [r, g, b, ...]"""
+    colors = colors or COLORS
+    method = method or METHOD
+    if method not in METHODS:
+        raise ValueError(f"未知的调色板构建方式：{method}（可选 {'/'.join(METHODS)}）")
+    with sample_image(images) as sample:
+        with sample.quantize(colors, method=Image.Quantize.MEDIANCUT) as initial:
+            count = len(initial.getcolors(colors) or [])
+            palette = initial.getpalette()[:3 * max(1, count)]
+        if method == "kmeans" and np is not None and count > 1:
+            palette = _kmeans(sample, palette, KMEANS_ITERATIONS)
+    return palette
+
+
+def palette_image(palette):
+    image = Image.new("P", (1, 1))
+    image.putpalette(palette)
+    return image
+
+
+def quantize(img, palette, dither=None):
+    """把图像映射到给定调色板，返回P模式图像"""
+    dither = DITHER if dither is None else dither
+    rgb = img.convert("RGB") if img.mode != "RGB" else img
+    try:
+        return rgb.quantize(palette=palette_image(palette),
+                            dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE)
+    finally:
+        if rgb is not img:
+            rgb.close()
+
+
+def fits_in_memory(layout, budget=None):
+    """各页画布能否同时留在内存中（整页量化前需要先拼完所有页才能构建全局调色板）"""
+    page_bytes = layout.page_size[0] * layout.page_size[1] * 3
+    return layout.pages == 1 or layout.pages * page_bytes <= (budget or memory_scheduler.default_budget())
+
+
+class PageQuantizer:
+    """代替 PageEncoder.submit 收集拼好的整页画布，close() 时在所有页上构建全局调色板，
+    逐页量化后交给 encoder 编码，省去先存24位再读回量化的一轮编解码
+    用法：
+        quantizer = PageQuantizer(encoder)
+        quantizer.submit(canvas, path, release, quality=95)   # 与 PageEncoder.submit 相同
+        raw_bytes = quantizer.close()       # 出错时改为调用 abort() 释放画布
+    """
+    def __init__(self, encoder, colors=None, dither=None, method=None):
+        self.encoder = encoder
+        self.colors = colors
+        self.dither = dither
+        self.method = method
+        self.pages = []
+
+    def submit(self, canvas, path, release=None, **save_args):
+        if not png_parallel.is_png(path):
+            raise ValueError(f"8位索引图只能保存为PNG：{os.path.basename(path)}")
+        self.pages.append((canvas, path, release, save_args))
+
+    def close(self):
+        """量化并提交全部页，返回这些页按24位未压缩计的字节数"""
+        palette = build_palette([page[0] for page in self.pages], self.colors, self.method)
+        raw_bytes = 0
+        while self.pages:
+            canvas, path, release, save_args = self.pages.pop(0)
+            try:
+                raw_bytes += canvas.size[0] * canvas.size[1] * 3
+                indexed = quantize(canvas, palette, self.dither)
+            finally:
+                canvas.close()
+                if release is not None:
+                    release()
+            self.encoder.submit(indexed, path, **save_args)
+        return raw_bytes
+
+    def abort(self):
+        while self.pages:
+            canvas, _, release, _ = self.pages.pop()
+            canvas.close()
+            if release is not None:
+                release()
+
+
+def quantize_pages(paths, colors=None, dither=None, method=None):
+    """把已写好的各页PNG量化为共用一个调色板的8位索引PNG（原地替换），返回各页按24位未压缩计的字节数"""
+    for path in paths:
+        if not png_parallel.is_png(path):
+            raise ValueError(f"8位索引图只能保存为PNG：{os.path.basename(path)}")
+
+    # 先从每页按面积比例抽样，构建全局调色板（同时只打开一页）
+    sizes = []
+    for path in paths:
+        with Image.open(path) as page:
+            sizes.append(page.width * page.height)
+    samples = []
+    try:
+        for path, pixels in zip(paths, sizes):
+            with Image.open(path) as page:
+                samples.append(sample_image([page], max(1, SAMPLE_PIXELS * pixels // sum(sizes))))
+        palette = build_palette(samples, colors, method)
+    finally:
+        for sample in samples:
+            sample.close()
+
+    # 再逐页映射到调色板，写临时文件后替换
+    for path in paths:
+        temp_path = path + ".tmp"
+        try:
+            with Image.open(path) as page:
+                indexed = quantize(page, palette, dither)
+            with indexed:
+                png_parallel.save(indexed, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    return sum(sizes) * 3
+
+
+def describe(raw_bytes, file_bytes, colors=None, dither=None):
+    """量化结果的说明：各页按24位未压缩计的大小 -> 8位索引PNG文件大小"""
+    saved = 1 - file_bytes / raw_bytes if raw_bytes else 0
+    dither = DITHER if dither is None else dither
+    return (f"调色板量化（{colors or COLORS}色{'，抖动' if dither else ''}）：24位未压缩 {raw_bytes / 1048576:.1f}MB"
+            f" -> 8位索引PNG {file_bytes / 1048576:.1f}MB，减小 {saved:.0%}")
@@ -0,0 +1,169 @@
+##### 像素流程（按输出格式决定通道） #####
+"""
+各脚本共用的逐帧像素处理：
+    - 先由输出格式（DDS的DXGI格式或图片扩展名）决定目标模式（L / RGB / RGBA），每帧最多转换一次；
+      能放进输出格式的透明通道一路保留，不再先转RGB丢掉
+    - 裁剪到目标比例 + 缩放用一次带 box 的重采样完成，不单独生成裁剪副本
+    - 合成时背景按需要的模式缓存，前景有透明才用作蒙版
+
+每次产生整帧副本的操作都会计数（INSTRUMENT），脚本结束时 report() 输出每帧平均次数，
+用来确认多余的拷贝/转换已经去掉。
+"""
+import os
+import threading
+from collections import Counter
+from PIL import Image
+
+# ========== 全局配置 ==========
+INSTRUMENT = True       # 统计整帧拷贝/转换次数
+# =============================
+
+# 带透明通道的DXGI格式前缀（其余按RGB或单通道处理）
+ALPHA_FORMATS = ("R8G8B8A8", "B8G8R8A8", "R10G10B10A2", "R16G16B16A16", "R32G32B32A32",
+                 "B5G5R5A1", "B4G4R4A4", "BC2", "BC3", "BC7")
+SINGLE_CHANNEL_FORMATS = ("R8_", "R16_", "R32_", "A8_", "BC4")
+# 各扩展名能直接保存的模式
+FILE_MODES = {
+    ".jpg": ("L", "RGB", "CMYK"), ".jpeg": ("L", "RGB", "CMYK"),
+    ".png": ("1", "L", "LA", "P", "RGB", "RGBA", "I;16"),
+    ".webp": ("RGB", "RGBA"), ".bmp": ("1", "L", "P", "RGB", "RGBA"),
+}
+# 不能直接做高质量重采样的模式，需要先转换
+RESAMPLE_FIRST = ("1", "P", "PA", "CMYK", "YCbCr", "LAB", "HSV", "I;16")
+
+_counts = Counter()
+_lock = threading.Lock()
+
+
+# ------------------------- 统计 -------------------------
+def count(stage, n=1):
+    """记录一次整帧拷贝"""
+    if INSTRUMENT:
+        with _lock:
+            _counts[stage] += n
+
+
+def frame_done():
+    count("frames")
+
+
+def report():
+    """输出统计结果（每帧平均次数）"""
+    if not INSTRUMENT or not _counts["frames"]:
+        return
+    frames = _counts["frames"]
+    stages = "，".join(f"{stage} {value / frames:.2f}" for stage, value in sorted(_counts.items())
+                      if stage != "frames")
+    print(f"像素流程统计（{frames}帧，每帧整帧拷贝次数）：{stages or '无'}")
+
+
+def reset():
+    with _lock:
+        _counts.clear()
+
+
+# ------------------------- 决定目标模式 -------------------------
+def has_alpha(img):
+    """图像是否带透明信息（含调色板透明色）"""
+    return img.mode in ("RGBA", "LA", "PA", "RGBa", "La") or "transparency" in img.info
+
+
+def mode_for_format(fmt):
+    """DXGI格式 -> 处理用模式"""
+    if fmt.startswith(SINGLE_CHANNEL_FORMATS):
+        return "L"
+    if fmt.startswith(ALPHA_FORMATS):
+        return "RGBA"
+    return "RGB"
+
+
+def mode_for_file(path, mode):
+    """在输出文件能保存的前提下尽量保留 mode，返回实际要保存的模式"""
+    allowed = FILE_MODES.get(os.path.splitext(path)[1].lower())
+    if allowed is None or mode in allowed:
+        return mode
+    if mode in ("LA", "La") and "L" in allowed:
+        return "L"
+    return "RGB"
+
+
+# ------------------------- 处理步骤 -------------------------
+def convert(img, mode):
+    """转换到目标模式，已是该模式时不拷贝"""
+    if img.mode == mode:
+        return img
+    count("convert")
+    if img.mode == "P" and "transparency" in img.info and mode in ("RGB", "L"):
+        # 调色板透明色先展开，避免透明处变成随机颜色
+        img = img.convert("RGBA")
+        count("convert")
+    return img.convert(mode)
+
+
+def fit_box(size, target_size, centering=(0.5, 0.5)):
+    """居中裁剪到目标比例的裁剪框（浮点，交给 resize 的 box 参数）"""
+    width, height = size
+    target_ratio = target_size[0] / target_size[1]
+    if width / height > target_ratio:
+        crop_w, crop_h = height * target_ratio, height
+    else:
+        crop_w, crop_h = width, width / target_ratio
+    left = (width - crop_w) * centering[0]
+    top = (height - crop_h) * centering[1]
+    return (left, top, left + crop_w, top + crop_h)
+
+
+def prepare(img, mode, target_size=None, box=None, resample=Image.LANCZOS):
+    """转换到 mode，并（可选）把 box 区域缩放到 target_size；
+    未给 box 时居中裁剪到目标比例。裁剪和缩放合并为一次重采样，模式最多转换一次。
+    """
+    if img.mode in RESAMPLE_FIRST and (target_size or box):
+        img = convert(img, mode)
+    if target_size and (tuple(target_size) != img.size or box):
+        box = box or fit_box(img.size, target_size)
+        img = img.resize(tuple(target_size), resample, box=box)
+        count("resample")
+    elif box:
+        img = img.crop(box)
+        count("crop")
+    return convert(img, mode)
+
+
+def transpose(img, method):
+    count("transpose")
+    return img.transpose(method)
+
+
+class Compositor:
+    """把前景贴到背景上；背景按输出需要的模式各转换一次后缓存"""
+    def __init__(self, background):
+        background.load()
+        self.mode = "RGBA" if has_alpha(background) and _alpha_used(background) else "RGB"
+        self.backgrounds = {}
+        self.source = background
+
+    def background(self, mode):
+        if mode not in self.backgrounds:
+            self.backgrounds[mode] = convert(self.source, mode)
+        return self.backgrounds[mode]
+
+    def composite(self, frame, position, path=None):
+        """返回合成后的图像；给出输出路径时按该文件能保存的模式合成"""
+        mode = mode_for_file(path, self.mode) if path else self.mode
+        canvas = self.background(mode).copy()
+        count("copy")
+        if has_alpha(frame):
+            if frame.mode not in ("RGBA", "LA"):
+                frame = convert(frame, "RGBA")
+            canvas.paste(frame, position, mask=frame)
+        else:
+            if frame.mode != canvas.mode:
+                count("convert")    # paste 内部会转换
+            canvas.paste(frame, position)
+        return canvas
+
+
+def _alpha_used(img):
+    """透明通道里是否真的有非不透明像素"""
+    alpha = (img if img.mode == "RGBA" else img.convert("RGBA")).getchannel("A")
+    return alpha.getextrema()[0] < 255
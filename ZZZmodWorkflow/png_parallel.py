@@ -0,0 +1,192 @@
+##### 多线程PNG编码 #####
+"""
+几百兆像素的拼接图存PNG时，PIL只在一个线程里跑一条zlib流，导出时间几乎都耗在这里。
+这里仿照 pigz 分块并行压缩：
+    - 画布按行切成若干块，每块在线程里连同前面几行交给PIL以0级压缩编码，取出过滤后的扫描行
+      （PNG行过滤只参照上一行，结果与整幅编码逐字节相同）；也可以用numpy按固定的过滤方式计算
+    - 每块用raw deflate独立压缩（zlib压缩时释放GIL，各块真正并行），以前一块末尾32KB的过滤数据
+      作为预设字典，压缩率接近单线程；除最后一块外以 Z_SYNC_FLUSH 结束，保证在字节边界首尾相接
+    - 各块的adler32按长度合并，按顺序写成同一条zlib流的IDAT
+结果是标准PNG，解压后的扫描行与 canvas.save() 完全相同（自适应过滤时）。
+"""
+import os
+import io
+import zlib
+import struct
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import PngImagePlugin
+import tiled_io
+try:
+    import numpy as np  # 固定过滤方式需要numpy
+except ImportError:
+    np = None
+
+# ========== 全局配置 ==========
+COMPRESS_LEVEL = 6                  # deflate压缩等级（1最快，9最小）
+FILTER = None                       # 行过滤：None 为PIL的逐行自适应；或 "none"/"sub"/"up"/"average"/"paeth"
+STRATEGY = zlib.Z_DEFAULT_STRATEGY  # zlib策略，Z_RLE 明显更快，平涂多的图压缩率也差不多
+CHUNK_BYTES = 4 << 20               # 每块过滤后的数据量
+WORKERS = None                      # 压缩线程数（所有同时保存的图片共用），None 为CPU核心数
+# =============================
+
+WINDOW = 32768                      # deflate回溯窗口，即预设字典的最大长度
+FILTER_TYPES = {"none": 0, "sub": 1, "up": 2, "average": 3, "paeth": 4}
+_ADLER_BASE = 65521
+_pool = None
+
+
+def _executor():
+    """共用的压缩线程池：多页同时保存时总线程数和在途内存不随页数增加"""
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=WORKERS or os.cpu_count() or 4)
+    return _pool
+
+
+def is_png(path):
+    return os.path.splitext(path)[1].lower() == ".png"
+
+
+def adler32_combine(adler1, adler2, length2):
+    """已知两段数据各自的adler32，求拼接后的adler32（length2 为第二段长度）"""
+    a1, b1 = adler1 & 0xFFFF, adler1 >> 16
+    a2, b2 = adler2 & 0xFFFF, adler2 >> 16
+    a = (a1 + a2 - 1) % _ADLER_BASE
+    b = (b1 + b2 + length2 * (a1 - 1)) % _ADLER_BASE
+    return (b << 16) | a
+
+
+def _zlib_header(level):
+    flevel = 2 if level in (-1, 6) else 0 if level < 2 else 1 if level < 6 else 3
+    cmf, flg = 0x78, flevel << 6
+    return bytes((cmf, flg + 31 - (cmf * 256 + flg) % 31))
+
+
+def _crop(img, top, bottom):
+    """取 [top, bottom) 行；RGBX（共享内存映射的画布）按RGB写出"""
+    rows = img.crop((0, top, img.width, bottom))
+    return rows.convert("RGB") if rows.mode == "RGBX" else rows
+
+
+def _encode_rows(img, top, bottom, save_args):
+    """PIL以0级压缩编码 [top, bottom) 行，返回过滤后的扫描行"""
+    buffer = io.BytesIO()
+    _crop(img, top, bottom).save(buffer, "PNG", compress_level=0, **save_args)
+    return zlib.decompress(tiled_io._split_png(buffer.getvalue())[2])
+
+
+def _filter_rows(img, top, bottom, row_len, bpp, filter_type):
+    """用numpy按固定方式过滤 [top, bottom) 行（第一行按上一行为0计算，由调用方丢弃）"""
+    rows = _crop(img, top, bottom)
+    raw = rows.tobytes("raw", PngImagePlugin._OUTMODES[rows.mode][0])
+    rows = bottom - top
+    x = np.frombuffer(raw, np.uint8).reshape(rows, row_len - 1)
+    left = np.zeros_like(x)
+    left[:, bpp:] = x[:, :-bpp]
+    up = np.zeros_like(x)
+    up[1:] = x[:-1]
+    if filter_type == 0:
+        filtered = x
+    elif filter_type == 1:
+        filtered = x - left
+    elif filter_type == 2:
+        filtered = x - up
+    elif filter_type == 3:
+        filtered = x - ((left.astype(np.uint16) + up) >> 1).astype(np.uint8)
+    else:
+        upleft = np.zeros_like(x)
+        upleft[:, bpp:] = up[:, :-bpp]
+        a, b, c = left.astype(np.int16), up.astype(np.int16), upleft.astype(np.int16)
+        pa, pb, pc = np.abs(b - c), np.abs(a - c), np.abs(a + b - 2 * c)
+        filtered = x - np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upleft))
+    out = np.empty((rows, row_len), np.uint8)
+    out[:, 0] = filter_type
+    out[:, 1:] = filtered
+    return out.tobytes()
+
+
+def _header_chunks(img, save_args):
+    """PIL编码第一行，取 IHDR 和IDAT之前的其它块（调色板、透明、ICC等）"""
+    buffer = io.BytesIO()
+    _crop(img, 0, 1).save(buffer, "PNG", compress_level=0, **save_args)
+    ihdr, extra, _ = tiled_io._split_png(buffer.getvalue())
+    return ihdr[:4] + struct.pack(">I", img.height) + ihdr[8:], extra
+
+
+def _compress_chunk(img, y0, y1, row_len, bpp, level, filter_type, save_args):
+    """压缩 [y0, y1) 行：返回 (压缩数据, adler32, 过滤数据长度)"""
+    context = min(y0, -(-WINDOW // row_len))        # 作为字典的前几行
+    start = y0 - context
+    skip = 1 if start > 0 else 0                    # 多编码一行作为参照，结果丢弃
+    if filter_type is None:
+        data = _encode_rows(img, start - skip, y1, save_args)
+    else:
+        data = _filter_rows(img, start - skip, y1, row_len, bpp, filter_type)
+    data = memoryview(data)[skip * row_len:]
+    if len(data) != (y1 - start) * row_len:
+        raise ValueError(f"扫描行长度不符（{img.mode}），无法分块编码")
+    zdict = data[:context * row_len][-WINDOW:]
+    body = data[context * row_len:]
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, STRATEGY, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 9, STRATEGY)
+    flush = zlib.Z_FINISH if y1 == img.height else zlib.Z_SYNC_FLUSH
+    compressed = compressor.compress(body) + compressor.flush(flush)
+    return compressed, zlib.adler32(body), len(body)
+
+
+def save(img, path, compress_level=None, png_filter=None, **save_args):
+    """多线程把 img 存为PNG；其余参数（pnginfo、icc_profile、dpi等）与 Image.save 相同"""
+    level = COMPRESS_LEVEL if compress_level is None else compress_level
+    if save_args.pop("optimize", False):
+        level = 9
+    save_args.pop("quality", None)
+    filter_name = png_filter if png_filter is not None else FILTER
+    filter_type = None
+    if filter_name is not None:
+        filter_type = FILTER_TYPES[filter_name]
+        if np is None or img.mode not in PngImagePlugin._OUTMODES and img.mode != "RGBX":
+            print(f"⚠️ 无法使用固定过滤方式 {filter_name}（需要numpy），改用自适应过滤")
+            filter_type = None
+
+    ihdr, extra = _header_chunks(img, save_args)
+    row_len = tiled_io._row_bytes(ihdr)
+    depth, color = struct.unpack_from(">BB", ihdr, 8)
+    bpp = max(1, depth * tiled_io.PNG_CHANNELS[color] // 8)
+    rows_per_chunk = max(1, CHUNK_BYTES // row_len)
+    if img.height <= rows_per_chunk:
+        _crop(img, 0, img.height).save(path, "PNG", compress_level=level, **save_args)
+        return
+
+    executor = _executor()
+    in_flight = (WORKERS or os.cpu_count() or 4) * 2
+    ranges = deque((y, min(y + rows_per_chunk, img.height)) for y in range(0, img.height, rows_per_chunk))
+    pending = deque()
+    try:
+        with open(path, "wb") as f:
+            f.write(tiled_io.PNG_SIGNATURE + tiled_io._chunk(b"IHDR", ihdr))
+            for ctype, data in extra:
+                f.write(tiled_io._chunk(ctype, data))
+            adler, first = 1, True
+            while ranges or pending:
+                # 同时在途的块数有上限，限制内存
+                while ranges and len(pending) < in_flight:
+                    y0, y1 = ranges.popleft()
+                    pending.append(executor.submit(_compress_chunk, img, y0, y1, row_len, bpp, level,
+                                                   filter_type, save_args))
+                compressed, chunk_adler, length = pending.popleft().result()
+                adler = adler32_combine(adler, chunk_adler, length)
+                if first:
+                    compressed, first = _zlib_header(level) + compressed, False
+                if not ranges and not pending:
+                    compressed += struct.pack(">I", adler)
+                f.write(tiled_io._chunk(b"IDAT", compressed))
+            f.write(tiled_io._chunk(b"IEND", b""))
+    except BaseException:
+        for future in pending:
+            future.cancel()
+        if os.path.exists(path):
+            os.remove(path)
+        raise
@@ -0,0 +1,161 @@
+##### 代理分辨率预览 #####
+"""
+在缩小的代理帧上跑完整流程（裁剪 -> 缩放 -> 合成背景 -> 缩小到格子尺寸 -> 拼接网格），
+用于界面内实时预览；全分辨率输出调用同一个 apply_pipeline（scale=1），
+保证预览与最终结果一致。
+
+代理帧按 1/2、1/4、1/8… 的固定档位解码（JPEG可直接缩小解码）并放入LRU缓存，
+行列数变化时只需重新排版，不必重新解码。
+"""
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# ========== 全局配置 ==========
+CACHE_CAPACITY = 512        # 缓存的代理帧数量上限
+PREVIEW_SIZE = (760, 300)   # 预览区域最大尺寸（像素）
+# =============================
+
+
+def proxy_level(scale):
+    """把任意缩放比例归到不小于它的 1/2^n 档位，返回 n"""
+    level = 0
+    while level < 6 and scale <= 0.5 ** (level + 1):
+        level += 1
+    return level
+
+
+class ThumbnailCache:
+    """代理帧LRU缓存：键为 (路径, 修改时间, 档位)"""
+    def __init__(self, capacity=CACHE_CAPACITY):
+        self.capacity = capacity
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path, level):
+        """取 1/2^level 尺寸的代理帧（RGBA或RGB），未命中时解码"""
+        key = (path, os.path.getmtime(path), level)
+        with self.lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                return self.items[key]
+
+        with Image.open(path) as img:
+            full_size = img.size
+            proxy_size = (max(1, full_size[0] >> level), max(1, full_size[1] >> level))
+            img.draft('RGB', proxy_size)
+            proxy = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+            if proxy.size != proxy_size:
+                proxy = proxy.resize(proxy_size, Image.BILINEAR)
+        entry = (full_size, proxy)
+
+        with self.lock:
+            self.items[key] = entry
+            while len(self.items) > self.capacity:
+                self.items.popitem(last=False)
+        return entry
+
+
+def apply_pipeline(frame, spec, scale=1.0, background=None):
+    """对单帧执行 裁剪 -> 缩放 -> 合成背景 -> 缩小到格子尺寸，返回RGB图像
+    参数：
+        frame - PIL图像（代理帧或全分辨率帧）
+        spec - 流程参数 dict：crop=(l,t,r,b)（原图坐标）、resize=(w,h)、background=路径、
+               tile=(w,h)（自动排版缩小后的格子尺寸）
+        scale - frame 相对原图的比例（全分辨率为1）
+        background - 已按同一比例准备好的背景图（RGBA），None 则不合成
+    """
+    if spec.get("crop"):
+        left, top, right, bottom = spec["crop"]
+        frame = frame.crop((round(left * scale), round(top * scale),
+                            round(right * scale), round(bottom * scale)))
+    if spec.get("resize"):
+        size = (max(1, round(spec["resize"][0] * scale)), max(1, round(spec["resize"][1] * scale)))
+        if frame.size != size:
+            frame = frame.resize(size, Image.LANCZOS if scale == 1 else Image.BILINEAR)
+    if background is not None:
+        composite = background.copy()
+        position = ((composite.size[0] - frame.size[0]) // 2,
+                    (composite.size[1] - frame.size[1]) // 2)
+        if frame.mode != 'RGBA':
+            frame = frame.convert('RGBA')
+        composite.paste(frame, position, mask=frame)
+        frame = composite
+    if spec.get("tile"):
+        size = (max(1, round(spec["tile"][0] * scale)), max(1, round(spec["tile"][1] * scale)))
+        if frame.size != size:
+            frame = frame.resize(size, Image.LANCZOS if scale == 1 else Image.BILINEAR)
+    if frame.mode != 'RGB':
+        frame = frame.convert('RGB')
+    return frame
+
+
+def load_background(spec, scale=1.0):
+    """按比例加载流程中的背景图，没有背景时返回None"""
+    if not spec.get("background"):
+        return None
+    with Image.open(spec["background"]) as bg:
+        bg = bg.convert('RGBA')
+    if scale != 1:
+        bg = bg.resize((max(1, round(bg.size[0] * scale)), max(1, round(bg.size[1] * scale))),
+                       Image.BILINEAR)
+    return bg
+
+
+def output_tile_size(spec, frame_size):
+    """单帧经过流程处理后的尺寸"""
+    tile_w, tile_h = frame_size
+    if spec.get("crop"):
+        tile_w, tile_h = spec["crop"][2] - spec["crop"][0], spec["crop"][3] - spec["crop"][1]
+    if spec.get("resize"):
+        tile_w, tile_h = spec["resize"]
+    if spec.get("background"):
+        with Image.open(spec["background"]) as bg:
+            tile_w, tile_h = bg.size
+    if spec.get("tile"):
+        tile_w, tile_h = spec["tile"]
+    return tile_w, tile_h
+
+
+def render_preview(paths, rows, cols, spec, cache, max_size=PREVIEW_SIZE):
+    """在代理帧上渲染整张拼接图
+    参数：
+        paths - 按帧序排列的图片路径
+        rows, cols - 行列数
+        spec - 流程参数（见 apply_pipeline）
+        cache - ThumbnailCache
+        max_size - 预览图最大尺寸
+    返回：(预览图, 实际使用的帧数, 空白格数)
+    """
+    if not paths:
+        return None, 0, 0
+    # 用第一帧经流程处理后的尺寸估算整张图大小，选择解码档位
+    with Image.open(paths[0]) as first:
+        tile_w, tile_h = output_tile_size(spec, first.size)
+    scale = min(max_size[0] / (cols * tile_w), max_size[1] / (rows * tile_h), 1.0)
+    level = proxy_level(scale)
+    proxy_scale = 0.5 ** level
+
+    background = load_background(spec, proxy_scale)
+    tiles = []
+    for path in paths[:rows * cols]:
+        try:
+            _, proxy = cache.get(path, level)
+            tiles.append(apply_pipeline(proxy, spec, proxy_scale, background))
+        except Exception:
+            tiles.append(None)
+
+    tw = max(1, round(tile_w * proxy_scale))
+    th = max(1, round(tile_h * proxy_scale))
+    sheet = Image.new('RGB', (cols * tw, rows * th), (255, 255, 255))
+    for index, tile in enumerate(tiles):
+        if tile is not None:
+            sheet.paste(tile, ((index % cols) * tw, (index // cols) * th))
+    blank = rows * cols - sum(1 for t in tiles if t is not None)
+
+    fit = min(max_size[0] / sheet.size[0], max_size[1] / sheet.size[1], 1.0)
+    if fit < 1:
+        sheet = sheet.resize((max(1, round(sheet.size[0] * fit)), max(1, round(sheet.size[1] * fit))),
+                             Image.BILINEAR)
+    return sheet, len(tiles), blank
@@ -0,0 +1,496 @@
+##### 多机批处理 #####
+"""
+几十个光锥MOD、上千帧的批处理一台机器要跑很久。这里把逐帧的 裁剪/缩放/翻转旋转/合成背景/DDS编码
+按帧范围分片，经TCP（multiprocessing.connection）分发给多台机器：
+    - 密钥：python render_farm.py keygen 生成随机密钥文件 farm.key（只有当前用户可读），复制到每台机器的同一位置，
+      或在各机器上设置相同的环境变量 ZZZ_FARM_KEY。连接传的是pickle数据，能连上的人就能在节点上执行代码，
+      所以没有密钥时节点和调度端都拒绝启动，不提供默认密钥
+    - 工作节点：python render_farm.py worker [主机:]端口 [存储目录]，用本机的进程池处理分到的帧；
+      不写主机时只监听 127.0.0.1，供其它机器连接时需明确写出（如 0.0.0.0:7341），并只在可信的局域网中使用
+    - 调度端：python render_farm.py run 作业.json [主机:端口,主机:端口,...]
+      作业文件列出若干 输入目录 -> 输出目录 和处理步骤（格式见 load_jobs），每帧依次执行全部步骤
+    - 内容寻址：输入帧和背景图按内容哈希发给节点，节点按哈希保存在存储目录中，同样的内容只传一次；
+      每帧的结果按 (输入哈希, 步骤, 输出格式) 的哈希存进调度端的 .farm_cache，输入和步骤都没变的帧直接跳过，
+      中途中断后重新运行也只处理没完成的帧
+    - 节点断开或超时：这一片放回队列交给其它节点（每片最多重试 MAX_RETRIES 次），断开的节点稍后重连
+    - 全部分片完成后才按帧序写出各输出目录（与哪个节点、以什么顺序完成无关），并写 farm_manifest.json
+本机测试时在几个端口各启动一个 worker 代替多台机器即可。
+"""
+import io
+import os
+import sys
+import json
+import time
+import queue
+import hashlib
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+from PIL import Image
+import frame_index
+import sheet_builder
+import pixel_pipeline
+import dds_encode
+
+# ========== 全局配置 ==========
+NODES = ["127.0.0.1:7341"]          # 默认工作节点（命令行给出时以命令行为准）
+HOST = "127.0.0.1"                  # 工作节点默认只监听本机（命令行写出主机时以命令行为准）
+PORT = 7341                         # 工作节点监听的端口
+KEY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "farm.key")   # 各节点相同的密钥文件
+KEY_ENV = "ZZZ_FARM_KEY"            # 设置了此环境变量时优先用它作密钥
+SHARD_FRAMES = 8                    # 每片的帧数
+MAX_RETRIES = 3                     # 每片最多重试次数；节点连续连接失败这么多次后不再使用
+SHARD_TIMEOUT = 600                 # 等待一片结果的最长秒数，超时按节点丢失处理
+RECONNECT_SECONDS = 5               # 节点断开后隔多久重连
+CACHE_DIR = ".farm_cache"           # 调度端的结果缓存（相对作业文件所在目录）
+STORE_DIR = ".farm_store"           # 工作节点保存输入内容的目录
+WORKERS = None                      # 每个节点的进程数，None 为CPU核心数
+# =============================
+
+FORMAT_VERSION = 1                  # 处理方式改变时加1，使旧缓存失效
+MANIFEST_NAME = "farm_manifest.json"
+STEPS = ("crop", "resize", "transpose", "composite", "dds")
+SAVE_ARGS = {"JPEG": {"quality": 95, "subsampling": 0}}
+
+MIN_KEY_BYTES = 16
+_backgrounds = {}                   # 工作进程内按内容哈希缓存的背景
+
+
+def load_key():
+    """读取部署时设置的密钥（环境变量优先，其次密钥文件）；没有或太短时抛出 ValueError"""
+    key = os.environ.get(KEY_ENV, "").strip().encode("utf-8")
+    if not key and os.path.exists(KEY_FILE):
+        with open(KEY_FILE, "rb") as f:
+            key = f.read().strip()
+    if not key:
+        raise ValueError(f"没有密钥：先运行 python render_farm.py keygen 生成 {KEY_FILE} 并复制到各节点，"
+                         f"或设置环境变量 {KEY_ENV}")
+    if len(key) < MIN_KEY_BYTES:
+        raise ValueError(f"密钥太短（至少 {MIN_KEY_BYTES} 字节）")
+    return key
+
+
+def generate_key():
+    """生成随机密钥文件（只有当前用户可读）；已存在时不覆盖"""
+    fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(secrets.token_hex(32).encode("ascii"))
+    return KEY_FILE
+
+
+def bytes_hash(data):
+    """与 sheet_builder.file_hash 相同的内容哈希"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def blob_path(store, digest):
+    return os.path.join(store, digest[:2], digest)
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+# ------------------------- 处理步骤（在工作节点的进程中执行） -------------------------
+def _compositor(store, digest):
+    if digest not in _backgrounds:
+        _backgrounds[digest] = pixel_pipeline.Compositor(Image.open(blob_path(store, digest)))
+    return _backgrounds[digest]
+
+
+def apply_steps(source, steps, ext, store):
+    """对一帧依次执行 steps，按 ext 编码后返回字节
+    步骤：
+        {"op": "crop", "box": [左, 上, 右, 下]}
+        {"op": "resize", "size": [宽, 高], "fit": "stretch"}     fit 为 crop 时先居中裁剪到目标比例
+        {"op": "transpose", "method": "FLIP_TOP_BOTTOM"}         Image.Transpose 中的名称
+        {"op": "composite", "background": 背景哈希, "position": [x, y]}   position 省略时居中
+        {"op": "dds", "format": "BC3_UNORM_SRGB", "mips": 1}     只能是最后一步
+    """
+    img = Image.open(source)
+    img.load()
+    mode = "RGBA" if pixel_pipeline.has_alpha(img) else "L" if img.mode == "L" else "RGB"
+    img = pixel_pipeline.convert(img, mode)
+    for step in steps:
+        op = step["op"]
+        if op == "crop":
+            img = pixel_pipeline.prepare(img, mode, box=tuple(step["box"]))
+        elif op == "resize":
+            box = None if step.get("fit") == "crop" else (0, 0, img.width, img.height)
+            img = pixel_pipeline.prepare(img, mode, tuple(step["size"]), box=box)
+        elif op == "transpose":
+            img = pixel_pipeline.transpose(img, Image.Transpose[step["method"]])
+        elif op == "composite":
+            compositor = _compositor(store, step["background"])
+            position = step.get("position") or ((compositor.source.width - img.width) // 2,
+                                                (compositor.source.height - img.height) // 2)
+            img = compositor.composite(img, tuple(position), "frame" + ext)
+            mode = img.mode
+        elif op == "dds":
+            return dds_encode.encode(img, step["format"], step.get("mips", 1))
+    fmt = Image.registered_extensions()[ext]
+    img = pixel_pipeline.convert(img, pixel_pipeline.mode_for_file("frame" + ext, mode))
+    buffer = io.BytesIO()
+    img.save(buffer, format=fmt, **SAVE_ARGS.get(fmt, {}))
+    return buffer.getvalue()
+
+
+def _run_frame(store, digest, steps, ext):
+    return apply_steps(blob_path(store, digest), steps, ext, store)
+
+
+# ------------------------- 工作节点 -------------------------
+class FarmWorker:
+    """接收调度端的连接：按哈希收下缺少的内容，处理分片并返回每帧的结果"""
+    def __init__(self, key, host=None, port=None, store=None, workers=None):
+        self.key = key
+        self.host = host or HOST
+        self.port = port or PORT
+        self.store = os.path.abspath(store or STORE_DIR)
+        self.executor = ProcessPoolExecutor(max_workers=workers or WORKERS or os.cpu_count())
+
+    def serve_forever(self):
+        listener = Listener((self.host, self.port), authkey=self.key)
+        print(f"✅ 工作节点已启动：{self.host}:{self.port}，存储目录 {self.store}")
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    print(f"⚠️ 拒绝连接：{e}")
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                kind = request[0]
+                if kind == "missing":
+                    conn.send([digest for digest in request[1]
+                               if not os.path.exists(blob_path(self.store, digest))])
+                elif kind == "put":
+                    _, digest, data = request
+                    if bytes_hash(data) != digest:
+                        print(f"❌ 收到的内容与哈希不符：{digest}")
+                        return      # 断开，调度端按节点丢失重试
+                    _write_atomic(blob_path(self.store, digest), data)
+                elif kind == "run":
+                    conn.send(self._run(request[1]))
+
+    def _run(self, tasks):
+        """tasks 为 [(帧序号, 输入哈希, 步骤, 扩展名)]，返回 [(帧序号, 结果字节, 错误信息或None)]"""
+        start = time.perf_counter()
+        futures = [(index, self.executor.submit(_run_frame, self.store, digest, steps, ext))
+                   for index, digest, steps, ext in tasks]
+        results = []
+        for index, future in futures:
+            try:
+                results.append((index, future.result(), None))
+            except Exception as e:
+                results.append((index, None, str(e) or type(e).__name__))
+        print(f"▶ 完成 {len(tasks)} 帧，用时 {time.perf_counter() - start:.2f}s")
+        return results
+
+
+# ------------------------- 作业 -------------------------
+class Task:
+    """一帧的处理：输入文件、解析后的步骤和结果在缓存中的键"""
+    def __init__(self, index, job, name, info, steps, ext):
+        self.index = index
+        self.job = job
+        self.name = name
+        self.info = info
+        self.digest = info["hash"]
+        self.steps = steps
+        self.ext = ext
+        self.output_name = os.path.splitext(name)[0] + ext
+        self.key = bytes_hash(json.dumps([FORMAT_VERSION, self.digest, steps, ext], sort_keys=True).encode())
+
+    def blobs(self):
+        return [self.digest] + [step["background"] for step in self.steps if step["op"] == "composite"]
+
+
+def _check_steps(steps):
+    for position, step in enumerate(steps):
+        op = step.get("op")
+        if op not in STEPS:
+            raise ValueError(f"未知的步骤：{op}（可选 {'/'.join(STEPS)}）")
+        if op == "dds":
+            if position != len(steps) - 1:
+                raise ValueError("dds 只能是最后一步")
+            if not dds_encode.supported(step["format"]):
+                raise ValueError(f"{step['format']} 需要TexConv编码，不能在节点上处理"
+                                 f"（可选 {'/'.join(sorted(dds_encode.RAW_FORMATS) + sorted(dds_encode.BLOCK_FORMATS))}）")
+        if op == "transpose" and step.get("method") not in Image.Transpose.__members__:
+            raise ValueError(f"未知的翻转方式：{step.get('method')}")
+
+
+def load_jobs(path):
+    """读取作业文件，返回 (作业列表, 各帧Task, 背景哈希 -> 路径)
+    作业文件格式（路径相对作业文件所在目录）：
+        {"jobs": [{"input": "光锥A/out", "output": "光锥A/farm_out", "ext": ".png",
+                   "steps": [{"op": "resize", "size": [876, 1237]},
+                             {"op": "composite", "background": "光锥A/background.png"}]}]}
+    ext 省略时与输入相同（最后一步是 dds 时为 .dds）
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, encoding="utf-8") as f:
+        jobs = json.load(f)["jobs"]
+    tasks, blobs = [], {}
+    for job in jobs:
+        job["input"] = os.path.join(base, job["input"])
+        job["output"] = os.path.join(base, job["output"])
+        if os.path.abspath(job["input"]) == os.path.abspath(job["output"]):
+            raise ValueError(f"输出目录不能与输入目录相同：{job['input']}")
+        _check_steps(job["steps"])
+        steps = []
+        for step in job["steps"]:
+            step = dict(step)
+            if step["op"] == "composite":
+                background = os.path.join(base, step["background"])
+                step["background"] = sheet_builder.file_hash(background)
+                blobs[step["background"]] = background
+            steps.append(step)
+        previous = {frame["name"]: frame["source"] for frame in _read_manifest(job["output"]).get("frames", [])}
+        for name in frame_index.ordered_files(job["input"]):
+            path = os.path.join(job["input"], name)
+            info = sheet_builder.source_info(path, previous.get(name))
+            blobs[info["hash"]] = path
+            ext = job.get("ext") or (".dds" if steps and steps[-1]["op"] == "dds" else os.path.splitext(name)[1])
+            tasks.append(Task(len(tasks), job, name, info, steps, ext.lower()))
+    return jobs, tasks, blobs
+
+
+def _read_manifest(folder):
+    try:
+        with open(os.path.join(folder, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+# ------------------------- 调度端 -------------------------
+class Farm:
+    """把分片分给各节点：每个节点一个线程，从共同的队列中取片；节点丢失时把片放回队列"""
+    def __init__(self, key, nodes, cache, blobs):
+        self.key = key
+        self.nodes = nodes
+        self.cache = cache
+        self.blobs = blobs
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.remaining = 0
+        self.errors = {}            # 帧序号 -> 错误信息
+        self.done_frames = 0
+        self.total_frames = 0
+
+    def cache_path(self, key):
+        return os.path.join(self.cache, key[:2], key)
+
+    def process(self, shards):
+        """处理全部分片，返回 {帧序号: 错误信息}（成功的帧结果已写入缓存）"""
+        for shard in shards:
+            self.queue.put((shard, 0))
+        self.remaining = len(shards)
+        self.total_frames = sum(len(shard) for shard in shards)
+        threads = [threading.Thread(target=self._node_loop, args=(node,), daemon=True) for node in self.nodes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 所有节点都不可用时，剩下的片记为失败（结果已缓存的帧下次运行不会重做）
+        while not self.queue.empty():
+            shard, _ = self.queue.get()
+            for task in shard:
+                self.errors[task.index] = "没有可用的工作节点"
+        return self.errors
+
+    def _finished(self):
+        with self.lock:
+            return self.remaining == 0
+
+    def _node_loop(self, node):
+        conn, failures = None, 0
+        while not self._finished():
+            if conn is None:
+                if failures >= MAX_RETRIES:
+                    print(f"❌ 节点 {node} 连续 {failures} 次连接失败，不再使用")
+                    return
+                try:
+                    host, port = node.rsplit(":", 1)
+                    conn = Client((host, int(port)), authkey=self.key)
+                    failures = 0
+                    print(f"✅ 已连接节点 {node}")
+                except (OSError, EOFError, AuthenticationError) as e:
+                    failures += 1
+                    print(f"⚠️ 连接节点 {node} 失败（{e}），{RECONNECT_SECONDS}秒后重试")
+                    time.sleep(RECONNECT_SECONDS)
+                    continue
+            try:
+                shard, attempts = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                results = self._run_shard(conn, shard)
+            except (OSError, EOFError, TimeoutError) as e:
+                conn.close()
+                conn = None
+                failures += 1
+                self._requeue(shard, attempts, f"节点 {node} 丢失（{str(e) or type(e).__name__}）")
+                continue
+            except ValueError as e:
+                conn.close()        # 发送到一半，重新连接以免收发错位
+                conn = None
+                self._fail(shard, str(e))
+                continue
+            self._collect(shard, results, node)
+        if conn is not None:
+            conn.close()
+
+    def _run_shard(self, conn, shard):
+        """把这一片缺少的内容发给节点，执行后取回结果"""
+        digests = list(dict.fromkeys(digest for task in shard for digest in task.blobs()))
+        conn.send(("missing", digests))
+        for digest in self._recv(conn):
+            with open(self.blobs[digest], "rb") as f:
+                data = f.read()
+            if bytes_hash(data) != digest:
+                raise ValueError(f"输入在运行过程中被修改：{self.blobs[digest]}")
+            conn.send(("put", digest, data))
+        conn.send(("run", [(task.index, task.digest, task.steps, task.ext) for task in shard]))
+        return self._recv(conn)
+
+    def _recv(self, conn):
+        if not conn.poll(SHARD_TIMEOUT):
+            raise TimeoutError(f"{SHARD_TIMEOUT}秒内没有响应")
+        return conn.recv()
+
+    def _fail(self, shard, reason):
+        print(f"❌ {reason}，第 {shard[0].index}~{shard[-1].index} 帧失败")
+        with self.lock:
+            for task in shard:
+                self.errors[task.index] = reason
+            self.remaining -= 1
+
+    def _requeue(self, shard, attempts, reason):
+        if attempts + 1 > MAX_RETRIES:
+            self._fail(shard, f"{reason}，重试 {MAX_RETRIES} 次后放弃")
+        else:
+            print(f"⚠️ {reason}，第 {shard[0].index}~{shard[-1].index} 帧重新排队")
+            self.queue.put((shard, attempts + 1))
+
+    def _collect(self, shard, results, node):
+        tasks = {task.index: task for task in shard}
+        for index, data, error in results:
+            if error is None:
+                _write_atomic(self.cache_path(tasks[index].key), data)
+        with self.lock:
+            for index, data, error in results:
+                if error is not None:
+                    self.errors[index] = error
+            self.remaining -= 1
+            self.done_frames += len(shard)
+            print(f"[{self.done_frames}/{self.total_frames}] 节点 {node} 完成 {tasks[shard[0].index].name}"
+                  f" 等 {len(shard)} 帧")
+
+
+def shard_tasks(tasks):
+    """同一作业中连续的帧分成一片"""
+    shards = []
+    for task in tasks:
+        if shards and shards[-1][0].job is task.job and len(shards[-1]) < SHARD_FRAMES:
+            shards[-1].append(task)
+        else:
+            shards.append([task])
+    return shards
+
+
+def assemble(jobs, tasks, cache, errors):
+    """按帧序从缓存写出各输出目录（内容与上次相同的文件不重写），写清单，返回写出的文件数"""
+    written = 0
+    for job in jobs:
+        os.makedirs(job["output"], exist_ok=True)
+        previous = {frame["name"]: frame for frame in _read_manifest(job["output"]).get("frames", [])}
+        frames = []
+        for task in (task for task in tasks if task.job is job):
+            if task.index in errors:
+                print(f"❌ {task.name}：{errors[task.index]}")
+                continue
+            output_path = os.path.join(job["output"], task.output_name)
+            old = previous.get(task.name)
+            if not (old and old["key"] == task.key and os.path.exists(output_path)):
+                with open(os.path.join(cache, task.key[:2], task.key), "rb") as f:
+                    _write_atomic(output_path, f.read())
+                written += 1
+            frames.append({"name": task.name, "output": task.output_name, "key": task.key, "source": task.info})
+        manifest = {"steps": job["steps"], "frames": frames}
+        _write_atomic(os.path.join(job["output"], MANIFEST_NAME),
+                      json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+    return written
+
+
+def run(jobs_path, nodes=None):
+    """执行作业文件，返回失败的帧数"""
+    start = time.perf_counter()
+    key = load_key()
+    jobs, tasks, blobs = load_jobs(jobs_path)
+    cache = os.path.join(os.path.dirname(os.path.abspath(jobs_path)), CACHE_DIR)
+    farm = Farm(key, nodes or NODES, cache, blobs)
+    todo = [task for task in tasks if not os.path.exists(farm.cache_path(task.key))]
+    print(f"共 {len(tasks)} 帧（{len(jobs)} 个作业），{len(tasks) - len(todo)} 帧内容和步骤未变化，跳过")
+    errors = farm.process(shard_tasks(todo)) if todo else {}
+    written = assemble(jobs, tasks, cache, errors)
+    print(f"\n处理完成！写出 {written} 个文件，失败 {len(errors)} 帧，用时 {time.perf_counter() - start:.1f}秒")
+    return len(errors)
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "keygen":
+        try:
+            print(f"✅ 已生成密钥文件：{generate_key()}，请复制到各节点的同一位置")
+        except FileExistsError:
+            print(f"密钥文件已存在：{KEY_FILE}（如需更换请先删除）")
+    elif command == "worker":
+        host, port = None, None
+        if len(sys.argv) > 2:
+            host, _, port = sys.argv[2].rpartition(":")
+            host, port = host or None, int(port)
+        store = sys.argv[3] if len(sys.argv) > 3 else None
+        try:
+            FarmWorker(load_key(), host, port, store).serve_forever()
+        except ValueError as e:
+            print(f"❌ {e}")
+        except KeyboardInterrupt:
+            print("\n工作节点已停止")
+    elif command == "run" and len(sys.argv) > 2:
+        nodes = sys.argv[3].split(",") if len(sys.argv) > 3 else None
+        try:
+            run(sys.argv[2], nodes)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ 作业失败：{e}")
+    else:
+        print("用法：python render_farm.py keygen")
+        print("      python render_farm.py worker [主机:]端口 [存储目录]")
+        print("      python render_farm.py run 作业.json [主机:端口,主机:端口,...]")
+
+
+if __name__ == "__main__":
+    main()
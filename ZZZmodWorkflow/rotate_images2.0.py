@@ -4,6 +4,12 @@ import os
 from PIL import Image
 import threading
 import queue
+import io
+import tempfile
+import jpeg_lossless
+import frame_index
+import frame_io
+import frame_stack
 
 # 操作映射字典
 OPERATIONS = {
@@ -72,7 +78,7 @@ class ProcessingWindow(tk.Toplevel):
         # 构建日志消息
         messages = {
             'start': f"开始处理 {filename}",
-            'success': f"成功处理: {filename}",
+            'success': f"成功处理: {filename}{details}",
             'skip': f"跳过非图片文件: {filename}",
             'error': f"处理失败: {filename} - {details}"
         }
@@ -162,24 +168,102 @@ def select_operation(parent):
     parent.wait_window(dialog)
     return dialog.operation
 
+def transform_jpeg_lossless(filepath, transpose_method):
+    """通过临时文件无损变换JPEG并覆盖原文件，返回是否成功"""
+    if not jpeg_lossless.available():
+        return False
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg',
+                                     dir=os.path.dirname(filepath)) as tmp_file:
+        temp_path = tmp_file.name
+    try:
+        if jpeg_lossless.transform_jpeg_file(filepath, temp_path, transpose_method):
+            os.replace(temp_path, filepath)
+            return True
+        return False
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
 def process_images(dir_path, operation, progress_window):
     """处理目录中的所有图片（在工作线程中运行）"""
     transpose_method = OPERATIONS[operation]
     supported_exts = ('.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp')
     
+    # 图片按帧序索引处理，其余文件记为跳过
+    image_files = frame_index.ordered_files(dir_path, supported_exts)
     for filename in os.listdir(dir_path):
-        filepath = os.path.join(dir_path, filename)
-        if not filename.lower().endswith(supported_exts):
+        if not filename.lower().endswith(supported_exts) and not filename.startswith('.'):
             progress_window.message_queue.put(('skip', filename, ""))
-            continue
-        
-        try:
-            progress_window.message_queue.put(('start', filename, ""))
-            with Image.open(filepath) as img:
-                img.transpose(transpose_method).save(filepath, format=img.format)
-            progress_window.message_queue.put(('success', filename, ""))
-        except Exception as e:
-            progress_window.message_queue.put(('error', filename, str(e)))
+    
+    # 尺寸、模式都相同的非JPEG帧整批读入数组一次翻转/旋转；JPEG仍逐张走无损变换
+    stacked = [f for f in image_files if not f.lower().endswith(('.jpg', '.jpeg'))]
+    shape = None
+    if frame_stack.available(len(stacked)):
+        shape = frame_stack.uniform([os.path.join(dir_path, f) for f in stacked])
+    if shape is None:
+        stacked = []
+    stacked_set = set(stacked)
+    single = [f for f in image_files if f not in stacked_set]
+    
+    # 后台预读（JPEG走无损变换直接读文件，不预读）、后台写盘
+    prefetcher = frame_io.Prefetcher([os.path.join(dir_path, f) for f in image_files
+                                      if not f.lower().endswith(('.jpg', '.jpeg'))])
+    writer = frame_io.WriteBehind()
+    
+    def encode(image, fmt):
+        buffer = io.BytesIO()
+        image.save(buffer, format=fmt)
+        return buffer
+    
+    def submit(filename, buffer):
+        """编码好的字节交给后台写盘"""
+        writer.submit(
+            os.path.join(dir_path, filename), buffer.getbuffer(),
+            done=lambda name=filename: progress_window.message_queue.put(('success', name, "")),
+            failed=lambda e, name=filename: progress_window.message_queue.put(('error', name, str(e)))
+        )
+    
+    try:
+        if stacked:
+            size, mode = shape
+            for batch in frame_stack.batches(stacked, size, mode):
+                for filename in batch:
+                    progress_window.message_queue.put(('start', filename, ""))
+                try:
+                    stack = frame_stack.transpose(frame_stack.load(
+                        [prefetcher.take(os.path.join(dir_path, f)) for f in batch], size, mode), transpose_method)
+                except Exception:
+                    single.extend(batch)    # 读取失败或与批不符，改为逐张处理以便定位出错的文件
+                    continue
+                # 各帧并行编码，按顺序交给后台写盘
+                encoded = frame_stack.map_frames(
+                    lambda index: encode(frame_stack.frame(stack, index, mode),
+                                         Image.registered_extensions()[os.path.splitext(batch[index])[1].lower()]),
+                    range(len(batch)))
+                for index, buffer, error in encoded:
+                    if error is not None:
+                        progress_window.message_queue.put(('error', batch[index], str(error)))
+                    else:
+                        submit(batch[index], buffer)
+                del stack
+        
+        for filename in single:
+            filepath = os.path.join(dir_path, filename)
+            
+            try:
+                progress_window.message_queue.put(('start', filename, ""))
+                # JPEG优先在DCT系数域无损变换，边界未对齐MCU时回退像素路径
+                if filename.lower().endswith(('.jpg', '.jpeg')) and transform_jpeg_lossless(filepath, transpose_method):
+                    progress_window.message_queue.put(('success', filename, "（无损）"))
+                    continue
+                with Image.open(prefetcher.take(filepath)) as img:
+                    submit(filename, encode(img.transpose(transpose_method), img.format))
+            except Exception as e:
+                progress_window.message_queue.put(('error', filename, str(e)))
+    finally:
+        prefetcher.close()
+        writer.close()
+    frame_io.report()
     
     # 处理完成后显示统计
     progress_window.after(0, progress_window.show_summary)
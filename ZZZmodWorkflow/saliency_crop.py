@@ -0,0 +1,164 @@
+##### 自动裁剪定位（显著性） #####
+"""
+为cut.py的“自动定位”模式批量计算裁剪位置：
+每张图缩小后计算梯度能量图（可选叠加人脸检测），同尺寸的图堆成一个数组，
+用积分图一次性求出所有候选窗口的能量，取能量最高的窗口作为裁剪框。
+
+结果先写成裁剪计划文件（CSV，可用表格软件检查/修改），确认后再应用。
+需要 numpy；安装 opencv-python 时自动启用CPU人脸检测加权。
+"""
+import os
+import csv
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+import tiled_io
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# ========== 全局配置 ==========
+PLAN_FILENAME = "crop_plan.csv"   # 裁剪计划文件（存放在图片目录内）
+ANALYSIS_SIZE = 256               # 分析用缩略图最长边（像素）
+CENTER_BIAS = 0.15                # 中心偏好权重（画面平坦时趋向居中）
+USE_FACE_DETECTION = True         # 安装了opencv-python时启用人脸检测加权
+FACE_WEIGHT = 2.0                 # 人脸区域总权重（相对整幅图能量）
+LOAD_WORKERS = 4                  # 并行解码缩略图的线程数
+CHUNK_SIZE = 64                   # 每批向量化计算的图片数
+# =============================
+
+_face_cascade = None
+
+
+def _detect_faces(gray):
+    """在缩略图上检测人脸，返回 [(x, y, w, h)]；未安装opencv时返回空列表"""
+    global _face_cascade
+    if cv2 is None or not USE_FACE_DETECTION:
+        return []
+    if _face_cascade is None:
+        _face_cascade = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    faces = _face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4)
+    return [tuple(int(v) for v in face) for face in faces]
+
+
+def _load_thumbnail(path):
+    """解码分析用灰度缩略图，返回 (原图尺寸, 灰度数组, 人脸框)"""
+    with tiled_io.open_image(path) as img:
+        size = img.size
+        img.draft('L', (ANALYSIS_SIZE, ANALYSIS_SIZE))  # JPEG可直接按比例缩小解码
+        scale = ANALYSIS_SIZE / max(size)
+        thumb_size = (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+        if tiled_io.should_tile(img):   # 超大原图按条带缩小，不整幅解码
+            gray = tiled_io.resize_tiled(path, thumb_size, Image.BILINEAR, convert=lambda s: s.convert('L'))
+        else:
+            gray = img.convert('L').resize(thumb_size, Image.BILINEAR)
+    array = np.asarray(gray, dtype=np.uint8)
+    return size, array, _detect_faces(array)
+
+
+def energy_maps(stack, faces=None):
+    """批量计算能量图
+    参数：
+        stack - (K, H, W) 灰度数组
+        faces - 每张图的人脸框列表（可选）
+    返回：(K, H, W) float32 能量图
+    """
+    data = stack.astype(np.float32)
+    energy = np.zeros_like(data)
+    energy[:, :, 1:] += np.abs(np.diff(data, axis=2))
+    energy[:, 1:, :] += np.abs(np.diff(data, axis=1))
+
+    k, h, w = energy.shape
+    totals = energy.reshape(k, -1).sum(axis=1) + 1e-6
+    if CENTER_BIAS:
+        ys = np.linspace(-1, 1, h, dtype=np.float32)[:, None]
+        xs = np.linspace(-1, 1, w, dtype=np.float32)[None, :]
+        prior = np.exp(-(xs ** 2 + ys ** 2) * 2)
+        prior *= 1.0 / prior.sum()
+        energy += CENTER_BIAS * totals[:, None, None] * prior[None]
+    if faces:
+        for i, boxes in enumerate(faces):
+            for x, y, fw, fh in boxes:
+                energy[i, y:y + fh, x:x + fw] += FACE_WEIGHT * totals[i] / max(fw * fh, 1) / len(boxes)
+    return energy
+
+
+def best_windows(energy, win_w, win_h):
+    """用积分图对所有图的所有候选窗口求和，返回每张图最佳窗口左上角 (xs, ys, 得分)"""
+    k, h, w = energy.shape
+    integral = np.zeros((k, h + 1, w + 1), dtype=np.float64)
+    integral[:, 1:, 1:] = energy.cumsum(axis=1).cumsum(axis=2)
+    sums = (integral[:, win_h:, win_w:] - integral[:, :-win_h, win_w:]
+            - integral[:, win_h:, :-win_w] + integral[:, :-win_h, :-win_w])
+    flat = sums.reshape(k, -1)
+    best = flat.argmax(axis=1)
+    ys, xs = np.divmod(best, sums.shape[2])
+    totals = integral[:, -1, -1]
+    scores = flat[np.arange(k), best] / np.maximum(totals, 1e-6)
+    return xs, ys, scores
+
+
+def build_crop_plan(folder, files, size_func):
+    """为目录内的图片计算自动裁剪框并写出计划文件
+    参数：
+        folder - 图片目录
+        files - 文件名列表（按处理顺序）
+        size_func - (原图宽, 原图高) -> (裁剪宽, 裁剪高)
+    返回：(计划文件路径, [(文件名, 裁剪框, 得分)])
+    """
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        thumbs = list(pool.map(
+            lambda name: _safe_load(os.path.join(folder, name)), files))
+
+    # 原图尺寸相同的缩略图尺寸也相同，分组后整批计算
+    groups = {}
+    for name, thumb in zip(files, thumbs):
+        if thumb is not None:
+            groups.setdefault(thumb[0], []).append((name, thumb))
+
+    results = {}
+    for (width, height), items in groups.items():
+        crop_w, crop_h = size_func(width, height)
+        for start in range(0, len(items), CHUNK_SIZE):
+            chunk = items[start:start + CHUNK_SIZE]
+            stack = np.stack([thumb[1] for _, thumb in chunk])
+            energy = energy_maps(stack, [thumb[2] for _, thumb in chunk])
+            th, tw = stack.shape[1:]
+            sx, sy = tw / width, th / height
+            win_w = min(tw, max(1, round(crop_w * sx)))
+            win_h = min(th, max(1, round(crop_h * sy)))
+            xs, ys, scores = best_windows(energy, win_w, win_h)
+            for (name, _), x, y, score in zip(chunk, xs, ys, scores):
+                left = min(max(0, round(x / sx)), width - crop_w)
+                top = min(max(0, round(y / sy)), height - crop_h)
+                results[name] = ((left, top, left + crop_w, top + crop_h), float(score))
+
+    plan = [(name, *results[name]) for name in files if name in results]
+    plan_path = os.path.join(folder, PLAN_FILENAME)
+    with open(plan_path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(["file", "left", "top", "right", "bottom", "score"])
+        for name, box, score in plan:
+            writer.writerow([name, *box, f"{score:.3f}"])
+    return plan_path, plan
+
+
+def _safe_load(path):
+    try:
+        return _load_thumbnail(path)
+    except Exception as e:
+        print(f"无法分析 [{path}]: {str(e)}")
+        return None
+
+
+def load_crop_plan(folder):
+    """读取（可能经过手工修改的）裁剪计划：{文件名: (left, top, right, bottom)}"""
+    plan_path = os.path.join(folder, PLAN_FILENAME)
+    plan = {}
+    with open(plan_path, 'r', newline='', encoding='utf-8-sig') as f:
+        for row in csv.DictReader(f):
+            plan[row["file"]] = tuple(int(float(row[k])) for k in ("left", "top", "right", "bottom"))
+    return plan
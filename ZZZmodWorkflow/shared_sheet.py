@@ -0,0 +1,126 @@
+##### 多进程共享内存拼接 #####
+"""
+几百格的拼接图逐帧解码、处理、贴图都挤在一个进程里，受GIL限制只能用到一个核心。这里改为：
+    - 每页画布分配在 multiprocessing.shared_memory 中，按PIL内部存RGB的布局（每像素4字节RGBX）
+    - 各工作进程分到一批格子，自己解码、执行流程（裁剪/缩放/合成背景），直接写进画布上自己那一格；
+      格子互不重叠（超出格子的部分裁掉），不需要加锁
+    - 一页写完后主进程把共享内存直接映射成PIL图像交给编码线程（不复制），编码完成后才释放共享内存
+工作进程数受内存预算限制（按最大一帧的解码占用估算），整个拼接过程共用一个进程池。
+需要numpy；没有numpy或格子太少（进程启动开销不划算）时调用方仍用线程加载。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+from PIL import Image
+import preview
+try:
+    import numpy as np  # 共享内存画布需要numpy
+except ImportError:
+    np = None
+
+# ========== 全局配置 ==========
+WORKERS = None          # 工作进程数，None 为CPU核心数（再受内存预算限制）
+MIN_TILES = 16          # 格子数少于此值时不启动进程
+BATCH_TILES = 4         # 每次交给一个进程的格子数
+# =============================
+
+_backgrounds = {}       # 工作进程内缓存的背景图（按路径）
+
+
+def available(tile_count):
+    """是否值得用多进程拼接"""
+    return np is not None and tile_count >= MIN_TILES
+
+
+def worker_count(costs, budget):
+    """按最大一帧的解码占用，在内存预算内能同时运行的进程数"""
+    workers = WORKERS or os.cpu_count() or 4
+    largest = max(costs, default=0)
+    if largest:
+        workers = min(workers, max(1, budget // largest))
+    return workers
+
+
+class SharedPage:
+    """共享内存中的页画布"""
+    def __init__(self, size, color=(255, 255, 255)):
+        width, height = size
+        self.size = size
+        self.shm = shared_memory.SharedMemory(create=True, size=width * height * 4)
+        self.name = self.shm.name
+        pixels = np.ndarray((height, width, 4), np.uint8, self.shm.buf)
+        pixels[...] = (*color, 255)
+        del pixels
+
+    def image(self):
+        """映射成PIL图像（RGBX模式，不复制；保存PNG时 png_parallel 按RGB写出）"""
+        return Image.frombuffer("RGBX", self.size, self.shm.buf, "raw", "RGBX", 0, 1)
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _background(spec):
+    path = spec.get("background")
+    if path not in _backgrounds:
+        _backgrounds[path] = preview.load_background(spec)
+    return _backgrounds[path]
+
+
+def _paste_tiles(name, page_size, tile_size, tasks, spec):
+    """工作进程：把一批 (序号, 路径, 位置) 解码处理后写进共享画布，返回 [(序号, 错误信息或None)]"""
+    page_w, page_h = page_size
+    shm = shared_memory.SharedMemory(name=name)     # 进程池与主进程共用资源跟踪器，由主进程释放
+    results = []
+    try:
+        pixels = np.ndarray((page_h, page_w, 4), np.uint8, shm.buf)
+        for index, path, (x, y) in tasks:
+            try:
+                with Image.open(path) as img:
+                    if spec:
+                        tile = preview.apply_pipeline(img, spec, 1.0, _background(spec))
+                    else:
+                        tile = img.convert('RGB')
+                width = min(tile.width, tile_size[0], page_w - x)
+                height = min(tile.height, tile_size[1], page_h - y)
+                block = np.frombuffer(tile.tobytes("raw", "RGBX"), np.uint8).reshape(tile.height, tile.width, 4)
+                pixels[y:y + height, x:x + width] = block[:height, :width]
+                tile.close()
+            except Exception as e:
+                results.append((index, str(e)))
+            else:
+                results.append((index, None))
+        del pixels
+    finally:
+        shm.close()
+    return results
+
+
+class SheetAssembler:
+    """多进程把格子写进共享内存页
+    用法：
+        assembler = SheetAssembler(spec, workers)
+        page = SharedPage(layout.page_size)
+        for index, error in assembler.paste(page, tile_size, [(序号, 路径, 位置), ...]):
+            ...
+        assembler.close()
+    """
+    def __init__(self, spec=None, workers=None):
+        self.spec = dict(spec or {})
+        self.executor = ProcessPoolExecutor(max_workers=workers or WORKERS or os.cpu_count())
+
+    def paste(self, page, tile_size, tasks):
+        """并行写入一页的格子，按完成顺序产出 (序号, 错误信息或None)"""
+        futures = [self.executor.submit(_paste_tiles, page.name, page.size, tile_size,
+                                        tasks[start:start + BATCH_TILES], self.spec)
+                   for start in range(0, len(tasks), BATCH_TILES)]
+        try:
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
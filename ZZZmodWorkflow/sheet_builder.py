@@ -0,0 +1,388 @@
+##### 多页拼接图 #####
+"""
+D3D11单张贴图的宽高上限是16384，拼接图超过 MAX_SHEET_SIZE 时自动分页：
+    - 每页尽量保留设定的列数，放不下时减少列数/行数，帧按原来的行优先顺序依次排到各页
+    - 所有页尺寸相同（最后一页不足的格子留空），INI可以用统一的UV步长寻址
+    - 每页拼完立即交给线程池编码（PIL编码时释放GIL，多页同时压缩），同时开始拼下一页；
+      PNG页由 png_parallel 分块多线程压缩，单页也能用满所有核心
+      页画布的内存向 memory_scheduler 预留，预算不足时等前面的页写完再开新页
+    - 输出 <输出文件名>.index.json（含扩展名，o.png 与 o.jpg 的索引互不干扰）：每页的文件名，每帧所在页、格子位置和UV范围，
+      以及每格的源文件路径/大小/修改时间/内容哈希和拼接参数
+    - 再次拼接时按索引比较，只重贴内容变了的格子（changed_frames / patch_pages）：
+      未压缩的单层DDS页直接改写文件中这几格的像素字节，PNG等无损格式打开所在页贴好后重新编码；
+      JPEG等有损格式解码再编码会让没变的格子一次次劣化，改为按源帧重建整页，结果与整张重新拼接完全相同
+只有一页时输出文件名不变，与原来的单张拼接图相同。
+"""
+import os
+import json
+import math
+import struct
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import png_parallel
+import dds_header
+
+# ========== 全局配置 ==========
+MAX_SHEET_SIZE = 16384      # 单页最大宽/高（像素）
+PAGE_WORKERS = None         # 同时编码的页数，None 为CPU核心数
+HASH_CHUNK = 1 << 20        # 计算内容哈希时每次读取的字节数
+# =============================
+
+# 可以读回已有页、只贴变化格子后重新编码的无损格式；其它格式（JPEG、WebP、BCn压缩DDS等）按源帧重建整页
+LOSSLESS_PAGE_EXTS = ('.png', '.bmp', '.tga', '.tif', '.tiff')
+
+# 可以直接改写像素字节的未压缩DDS格式 -> (PIL模式, rawmode, 每像素字节数)
+RAW_DDS_FORMATS = {
+    "B8G8R8A8_UNORM": ("RGBA", "BGRA", 4), "B8G8R8A8_UNORM_SRGB": ("RGBA", "BGRA", 4),
+    "R8G8B8A8_UNORM": ("RGBA", "RGBA", 4), "R8G8B8A8_UNORM_SRGB": ("RGBA", "RGBA", 4),
+    "B8G8R8X8_UNORM": ("RGB", "BGRX", 4), "B8G8R8X8_UNORM_SRGB": ("RGB", "BGRX", 4),
+    "R8_UNORM": ("L", "L", 1),
+}
+# 24位旧式头（PIL保存RGB时的格式）按 (R掩码, G掩码, B掩码) 区分字节顺序
+RAW_DDS_24BPP = {
+    (0x00ff0000, 0x0000ff00, 0x000000ff): ("RGB", "BGR", 3),
+    (0x000000ff, 0x0000ff00, 0x00ff0000): ("RGB", "RGB", 3),
+}
+
+
+def index_path(output_path):
+    """索引按完整的输出文件名命名（含扩展名），不同格式的同名输出各有各的索引"""
+    return output_path + ".index.json"
+
+
+def file_hash(path):
+    """文件内容的哈希（blake2b，32位十六进制）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_CHUNK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def source_info(path, previous=None):
+    """帧源文件的 路径/大小/修改时间/内容哈希
+    与上次记录（previous）的路径、大小、修改时间都相同时沿用上次的哈希，不再读取文件
+    """
+    stat = os.stat(path)
+    info = {"source": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if previous and previous.get("hash") and all(previous.get(key) == value for key, value in info.items()):
+        info["hash"] = previous["hash"]
+    else:
+        info["hash"] = file_hash(path)
+    return info
+
+
+def _normalize(params):
+    """拼接参数统一成JSON中的形式（元组变列表等），便于与索引中记录的比较"""
+    return json.loads(json.dumps(params or {}, ensure_ascii=False, sort_keys=True, default=str))
+
+
+def _content(frame):
+    """决定格子内容的部分：帧的哈希，混合帧再加第二帧的哈希和权重"""
+    blend = frame.get("blend") or {}
+    return frame["hash"], blend.get("hash"), blend.get("weight")
+
+
+def _raw_dds(path, size):
+    """未压缩、单层mipmap、尺寸为 size 的DDS页 -> (像素数据偏移, PIL模式, rawmode, 每像素字节数)，否则None"""
+    if os.path.splitext(path)[1].lower() != ".dds":
+        return None
+    try:
+        with open(path, "rb") as f:
+            data = f.read(dds_header.HEADER_BYTES)
+        header = dds_header.parse_header(data)
+    except (OSError, ValueError):
+        return None
+    if header["mip_count"] != 1 or (header["width"], header["height"]) != tuple(size):
+        return None
+    if header["format"] == "24bpp":
+        raw = RAW_DDS_24BPP.get(struct.unpack_from("<3I", data, 92))
+    else:
+        raw = RAW_DDS_FORMATS.get(header["format"])
+    if raw is None:
+        return None
+    return (148 if header["dx10"] else 128,) + raw
+
+
+class SheetLayout:
+    """rows×columns 个格子的拼接图按最大尺寸分页后的排版"""
+    def __init__(self, rows, columns, tile_size, max_size=None, power_of_two=False):
+        """power_of_two 时每页宽高向上补齐到2的幂（补齐部分留空，UV按补齐后的尺寸计算）"""
+        max_size = max_size or MAX_SHEET_SIZE
+        if power_of_two:
+            max_size = 1 << (max_size.bit_length() - 1)     # 补齐后也不超过最大尺寸
+        tile_w, tile_h = tile_size
+        if tile_w > max_size or tile_h > max_size:
+            raise ValueError(f"单帧尺寸 {tile_w}x{tile_h} 超过最大贴图尺寸 {max_size}")
+        self.slots = rows * columns
+        self.tile_size = (tile_w, tile_h)
+        self.max_size = max_size
+        self.columns = min(columns, max_size // tile_w)
+        self.rows = min(math.ceil(self.slots / self.columns), max_size // tile_h)
+        self.per_page = self.columns * self.rows
+        self.pages = math.ceil(self.slots / self.per_page)
+        self.page_size = (self.columns * tile_w, self.rows * tile_h)
+        if power_of_two:
+            self.page_size = tuple(1 << (side - 1).bit_length() for side in self.page_size)
+
+    @classmethod
+    def from_index(cls, index):
+        """按已有的页/帧索引恢复排版"""
+        layout = cls.__new__(cls)
+        layout.tile_size = tuple(index["tile"])
+        layout.max_size = index["max_size"]
+        layout.columns = index["columns"]
+        layout.rows = index["rows"]
+        layout.per_page = index["frames_per_page"]
+        layout.pages = len(index["pages"])
+        layout.slots = index.get("slots", len(index["frames"]))
+        layout.page_size = tuple(index["page_size"])
+        return layout
+
+    def page_frames(self, page):
+        """第 page 页上的格子序号"""
+        return range(page * self.per_page, min((page + 1) * self.per_page, self.slots))
+
+    def locate(self, index):
+        """第 index 格 -> (页, 列, 行)"""
+        page, slot = divmod(index, self.per_page)
+        row, col = divmod(slot, self.columns)
+        return page, col, row
+
+    def position(self, index):
+        """第 index 格在所在页上的左上角坐标"""
+        _, col, row = self.locate(index)
+        return col * self.tile_size[0], row * self.tile_size[1]
+
+    def page_path(self, output_path, page):
+        if self.pages == 1:
+            return output_path
+        stem, ext = os.path.splitext(output_path)
+        return f"{stem}_{page + 1}{ext}"
+
+    def describe(self):
+        if self.pages == 1:
+            return f"{self.page_size[0]}x{self.page_size[1]}"
+        return (f"超过最大尺寸 {self.max_size}，分为 {self.pages} 页，"
+                f"每页 {self.rows}行 {self.columns}列（{self.page_size[0]}x{self.page_size[1]}）")
+
+    def write_index(self, output_path, names, sources=None, params=None):
+        """写出页/帧索引（names 为各格对应的帧文件名），清理上次多出来的页，返回索引路径
+        sources 为各格的 source_info（加载失败的格子哈希记为None，下次重试），params 为拼接参数
+        """
+        tile_w, tile_h = self.tile_size
+        page_w, page_h = self.page_size
+        frames = []
+        for index, name in enumerate(names[:self.slots]):
+            page, col, row = self.locate(index)
+            x, y = col * tile_w, row * tile_h
+            frames.append({
+                "frame": index, "name": name, "page": page, "column": col, "row": row, "x": x, "y": y,
+                "uv": [x / page_w, y / page_h, (x + tile_w) / page_w, (y + tile_h) / page_h],
+            })
+            if sources is not None and index < len(sources):
+                frames[-1].update(sources[index])
+        index = {
+            "max_size": self.max_size, "tile": [tile_w, tile_h], "page_size": [page_w, page_h],
+            "columns": self.columns, "rows": self.rows, "frames_per_page": self.per_page,
+            "slots": self.slots, "params": _normalize(params),
+            "pages": [{"page": page, "file": os.path.basename(self.page_path(output_path, page))}
+                      for page in range(self.pages)],
+            "frames": frames,
+        }
+        folder = os.path.dirname(os.path.abspath(output_path))
+        old = read_index(output_path)
+        if old is not None:
+            # 只删除这个输出上次分页写出的 <名>_<N><扩展名>，不碰索引里记录的其它文件
+            stem, ext = os.path.splitext(os.path.basename(output_path))
+            owned = {f"{stem}_{page + 1}{ext}" for page in range(len(old["pages"]))}
+            current = {page["file"] for page in index["pages"]}
+            for page in old["pages"]:
+                stale = os.path.join(folder, page["file"])
+                if page["file"] in owned and page["file"] not in current and os.path.exists(stale):
+                    os.remove(stale)
+
+        path = index_path(output_path)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+        return path
+
+    def _matches(self, index, output_path):
+        """索引记录的排版与本次相同且各页文件都在"""
+        folder = os.path.dirname(os.path.abspath(output_path))
+        return (index.get("max_size") == self.max_size and index.get("tile") == list(self.tile_size)
+                and index.get("page_size") == list(self.page_size) and index.get("columns") == self.columns
+                and index.get("rows") == self.rows and index.get("slots", self.slots) == self.slots
+                and [page["file"] for page in index["pages"]]
+                == [os.path.basename(self.page_path(output_path, page)) for page in range(self.pages)]
+                and all(os.path.exists(os.path.join(folder, page["file"])) for page in index["pages"]))
+
+    def changed_frames(self, output_path, paths, params=None, blends=None):
+        """与上次拼接的索引比较，返回 (需要重贴的格子序号, 各格的 source_info)
+        没有索引（或索引中没有哈希）、排版或拼接参数变了、页文件缺失时序号为None，需要整张重建；
+        内容哈希不同、上次加载失败、新增的格子需要重贴，上次有帧而本次没有的格子也列入（贴空白）
+        blends 为各格混合的第二帧 (路径, 权重) 或None（见 frame_resample），两帧任一变化都重贴
+        """
+        old = read_index(output_path)
+        previous = {}
+        for frame in old["frames"] if old else []:
+            previous[frame.get("source")] = frame
+            if frame.get("blend"):
+                previous.setdefault(frame["blend"].get("source"), frame["blend"])
+        sources = []
+        for index, path in enumerate(paths[:self.slots]):
+            sources.append(source_info(path, previous.get(os.path.abspath(path))))
+            blend = blends[index] if blends and index < len(blends) else None
+            if blend:
+                sources[-1]["blend"] = dict(source_info(blend[0], previous.get(os.path.abspath(blend[0]))),
+                                            weight=blend[1])
+        if (old is None or old.get("params") != _normalize(params) or not self._matches(old, output_path)
+                or any("hash" not in frame for frame in old["frames"])):
+            return None, sources
+        old_frames = old["frames"]
+        changed = [index for index, info in enumerate(sources)
+                   if index >= len(old_frames) or not old_frames[index]["hash"]
+                   or _content(old_frames[index]) != _content(info)]
+        changed.extend(range(len(sources), min(len(old_frames), self.slots)))
+        return changed, sources
+
+    def _changed_pages(self, changed):
+        """页 -> 该页上要重贴的格子序号"""
+        pages = {}
+        for index in changed:
+            pages.setdefault(self.locate(index)[0], []).append(index)
+        return pages
+
+    def _rebuilds(self, path):
+        """该页是否要按源帧整页重建（有损格式）"""
+        return (os.path.splitext(path)[1].lower() not in LOSSLESS_PAGE_EXTS
+                and _raw_dds(path, self.page_size) is None)
+
+    def patch_cells(self, output_path, changed):
+        """patch_pages 会调用 load 的格子序号（有损格式的页包含整页的格子），供调用方预读"""
+        cells = []
+        for page, indices in sorted(self._changed_pages(changed).items()):
+            cells.extend(self.page_frames(page) if self._rebuilds(self.page_path(output_path, page)) else indices)
+        return cells
+
+    def patch_pages(self, output_path, changed, load, color=(255, 255, 255), **save_args):
+        """把 changed 中的格子重新贴进已有的各页，返回 [(序号, 异常或None)]
+        load(序号) 返回该格的图片（None 表示留空）；加载失败的格子同样留空。
+        未压缩的单层DDS页直接在文件中改写这几格的像素行；无损格式打开整页贴好后写临时文件再替换；
+        有损格式不读回旧页，按源帧重新拼出整页（其它格子也调用 load，加载失败的同样列入返回值）
+        """
+        results = []
+        for page, indices in sorted(self._changed_pages(changed).items()):
+            path = self.page_path(output_path, page)
+            raw = _raw_dds(path, self.page_size)
+            mode = raw[1] if raw else 'RGB'
+            rebuild = self._rebuilds(path)
+            cells = []
+            for index in (self.page_frames(page) if rebuild else indices):
+                cell = Image.new('RGB', self.tile_size, color).convert(mode)
+                try:
+                    tile = load(index)
+                except Exception as e:
+                    results.append((index, e))
+                else:
+                    if tile is not None:
+                        with tile:
+                            cell.paste(tile.convert(mode) if tile.mode != mode else tile)
+                    if index in indices:
+                        results.append((index, None))
+                cells.append((index, cell))
+            if raw:
+                self._write_raw(path, raw, cells)
+            else:
+                self._write_page(path, cells, save_args, color if rebuild else None)
+        return results
+
+    def _write_raw(self, path, raw, cells):
+        """在未压缩DDS页中逐行改写格子的像素字节"""
+        offset, _, rawmode, bpp = raw
+        page_w = self.page_size[0]
+        with open(path, "r+b") as f:
+            for index, cell in cells:
+                x, y = self.position(index)
+                data = cell.tobytes("raw", rawmode)
+                row_len = cell.width * bpp
+                for r in range(cell.height):
+                    f.seek(offset + ((y + r) * page_w + x) * bpp)
+                    f.write(data[r * row_len:(r + 1) * row_len])
+                cell.close()
+
+    def _write_page(self, path, cells, save_args, color=None):
+        """打开整页（给出 color 时改为该底色的空白页）贴入格子，写临时文件后替换"""
+        if color is not None:
+            sheet = Image.new('RGB', self.page_size, color)
+        else:
+            with Image.open(path) as sheet:
+                sheet = sheet.convert('RGB')
+        for index, cell in cells:
+            sheet.paste(cell, self.position(index))
+            cell.close()
+        temp_path = path + ".tmp"
+        try:
+            if png_parallel.is_png(path):
+                png_parallel.save(sheet, temp_path, **save_args)
+            else:
+                sheet.save(temp_path, format=Image.registered_extensions()[os.path.splitext(path)[1].lower()],
+                           **save_args)
+            os.replace(temp_path, path)
+        finally:
+            sheet.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def read_index(output_path):
+    """读取拼接图的页/帧索引，不存在或损坏时返回None"""
+    try:
+        with open(index_path(output_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class PageEncoder:
+    """页画布交给线程池编码；close() 等全部写完，有页失败时抛出第一个异常
+    给出 scheduler 时，新页画布先向它预留内存，写完后释放
+    """
+    def __init__(self, scheduler=None, workers=None):
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(max_workers=workers or PAGE_WORKERS or os.cpu_count())
+        self.futures = []
+
+    def reserve_page(self, layout):
+        """为一页画布预留内存（new_page 已包含；自行分配画布时先调用）"""
+        if self.scheduler is not None:
+            self.scheduler.reserve(layout.page_size[0] * layout.page_size[1] * 3, wait=True)
+
+    def new_page(self, layout, color=(255, 255, 255)):
+        self.reserve_page(layout)
+        return Image.new('RGB', layout.page_size, color)
+
+    def submit(self, canvas, path, release=None, **save_args):
+        """后台保存一页；release 为画布写完后的清理函数（例如释放共享内存）"""
+        self.futures.append(self.executor.submit(self._save, canvas, path, release, save_args))
+
+    def _save(self, canvas, path, release, save_args):
+        nbytes = canvas.size[0] * canvas.size[1] * 3
+        try:
+            if png_parallel.is_png(path):
+                png_parallel.save(canvas, path, **save_args)
+            else:
+                canvas.save(path, **save_args)
+        finally:
+            canvas.close()
+            if release is not None:
+                release()
+            if self.scheduler is not None:
+                self.scheduler.release(nbytes)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for future in self.futures:
+            future.result()
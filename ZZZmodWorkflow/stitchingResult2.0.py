@@ -4,6 +4,15 @@ from tkinter import ttk, filedialog, scrolledtext, messagebox
 import os
 import threading
 import queue
+import frame_index
+import preview
+import memory_scheduler
+import sheet_builder
+import frame_io
+import shared_sheet
+import grid_layout
+import palette_quant
+import png_parallel
 
 class StitchingApp:
     def __init__(self):
@@ -25,11 +34,26 @@ class StitchingApp:
                   command=self.select_input_folder).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="设置行列", 
                   command=self.set_grid).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="裁剪/缩放（可选）",
+                  command=self.set_crop_resize).pack(side=tk.LEFT, padx=5)
+        ttk.Button(control_frame, text="选择背景（可选）", 
+                  command=self.select_background).pack(side=tk.LEFT, padx=5)
         ttk.Button(control_frame, text="开始拼接", 
                   command=self.start_stitching).pack(side=tk.LEFT, padx=5)
+        # 调色板量化：所有帧共用一个调色板，保存为8位索引PNG
+        self.palette_var = tk.BooleanVar(value=False)
+        self.dither_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="8位调色板PNG",
+                        variable=self.palette_var).pack(side=tk.LEFT, padx=5)
+        ttk.Checkbutton(control_frame, text="抖动",
+                        variable=self.dither_var).pack(side=tk.LEFT, padx=5)
+
+        # 代理分辨率预览
+        self.preview_label = ttk.Label(self.root, anchor=tk.CENTER)
+        self.preview_label.pack(padx=10, pady=5)
 
         # 日志显示
-        self.log_area = scrolledtext.ScrolledText(self.root, wrap=tk.WORD)
+        self.log_area = scrolledtext.ScrolledText(self.root, wrap=tk.WORD, height=8)
         self.log_area.pack(expand=True, fill=tk.BOTH, padx=10, pady=5)
 
         # 状态栏
@@ -39,9 +63,13 @@ class StitchingApp:
 
         # 初始化参数
         self.input_folder = ""
-        self.rows = 4
-        self.cols = 4
+        self.rows = None  # 行列数，None 为按帧数自动排版（见 grid_layout）
+        self.cols = None
         self.output_path = ""
+        self.spec = {}  # 拼接前对每帧执行的流程（见 preview.apply_pipeline）
+        self.palette = None  # 调色板量化设置 {"colors", "dither"}，None 为保存24位
+        self.thumbnails = preview.ThumbnailCache()
+        self.preview_generation = 0
         
     def setup_queue(self):
         """设置消息队列"""
@@ -52,6 +80,9 @@ class StitchingApp:
         """处理队列消息"""
         while not self.message_queue.empty():
             msg_type, content = self.message_queue.get()
+            if msg_type == "preview":
+                self.show_preview(*content)
+                continue
             self.update_log(msg_type, content)
         self.root.after(100, self.process_messages)
 
@@ -74,27 +105,152 @@ class StitchingApp:
         self.input_folder = filedialog.askdirectory(title="选择图片文件夹")
         if self.input_folder:
             self.message_queue.put(("info", f"已选择输入文件夹：{self.input_folder}"))
+            self.request_preview()
+
+    def select_background(self):
+        """选择背景图片（如相框），每帧居中合成到背景上"""
+        path = filedialog.askopenfilename(
+            title="选择背景图片（取消则不使用背景）",
+            filetypes=[("图片文件", "*.png *.jpg *.jpeg")]
+        )
+        if path:
+            self.spec["background"] = path
+            self.message_queue.put(("info", f"已选择背景：{path}"))
+        else:
+            self.spec.pop("background", None)
+            self.message_queue.put(("info", "不使用背景"))
+        self.request_preview()
+
+    def set_crop_resize(self):
+        """设置每帧的裁剪框和缩放尺寸弹窗（留空则不裁剪/不缩放）"""
+        class CropResizeDialog(tk.Toplevel):
+            def __init__(self, parent, spec):
+                super().__init__(parent)
+                self.title("裁剪/缩放")
+                self.result = None  # 关闭窗口时保持原设置
+
+                fields = [("裁剪 左", "crop", 0), ("裁剪 上", "crop", 1), ("裁剪 右", "crop", 2),
+                          ("裁剪 下", "crop", 3), ("缩放 宽", "resize", 0), ("缩放 高", "resize", 1)]
+                self.entries = {}
+                for row, (label, key, i) in enumerate(fields):
+                    ttk.Label(self, text=f"{label}：").grid(row=row, column=0, padx=5, pady=3)
+                    entry = ttk.Entry(self, width=8)
+                    entry.grid(row=row, column=1, padx=5, pady=3)
+                    if spec.get(key):
+                        entry.insert(0, str(spec[key][i]))
+                    self.entries.setdefault(key, []).append(entry)
+                ttk.Label(self, text="裁剪框为原图像素坐标，全部留空则不裁剪/不缩放").grid(
+                    row=len(fields), column=0, columnspan=2, padx=5)
+
+                ttk.Button(self, text="确定", command=self.on_confirm).grid(row=len(fields) + 1, column=0, pady=10)
+                ttk.Button(self, text="清除", command=self.on_clear).grid(row=len(fields) + 1, column=1, pady=10)
+
+            def read(self, key):
+                """读取一组输入框：全部留空返回None，否则须全部为整数"""
+                values = [entry.get().strip() for entry in self.entries[key]]
+                if not any(values):
+                    return None
+                return tuple(int(value) for value in values)
+
+            def on_confirm(self):
+                try:
+                    crop, resize = self.read("crop"), self.read("resize")
+                    if crop and (min(crop) < 0 or crop[2] <= crop[0] or crop[3] <= crop[1]):
+                        raise ValueError
+                    if resize and min(resize) < 1:
+                        raise ValueError
+                except ValueError:
+                    messagebox.showerror("错误", "裁剪框需满足 0 ≤ 左 < 右、0 ≤ 上 < 下，缩放尺寸需为正整数")
+                    return
+                self.result = (crop, resize)
+                self.destroy()
+
+            def on_clear(self):
+                self.result = (None, None)
+                self.destroy()
+
+        dialog = CropResizeDialog(self.root, self.spec)
+        self.root.wait_window(dialog)
+        if dialog.result is None:
+            return
+        for key, value in zip(("crop", "resize"), dialog.result):
+            if value:
+                self.spec[key] = value
+            else:
+                self.spec.pop(key, None)
+        crop, resize = dialog.result
+        self.message_queue.put(("info", f"裁剪：{crop or '不裁剪'}，缩放：{f'{resize[0]}x{resize[1]}' if resize else '不缩放'}"))
+        self.request_preview()
+
+    def request_preview(self, rows=None, cols=None):
+        """在后台线程中用代理帧渲染预览（新请求会使旧结果作废）"""
+        if not self.input_folder:
+            return
+        self.preview_generation += 1
+        generation = self.preview_generation
+        rows = rows or self.rows
+        cols = cols or self.cols
+        spec = dict(self.spec)
+
+        def worker(rows, cols):
+            try:
+                paths = frame_index.ordered_paths(self.input_folder, ('.png', '.jpg', '.jpeg'))
+                if rows is None and paths:
+                    # 自动排版：按帧数和流程处理后的单帧尺寸选择行列数
+                    with Image.open(paths[0]) as first:
+                        plan = grid_layout.solve(len(paths), preview.output_tile_size(spec, first.size))
+                    rows, cols = plan.rows, plan.columns
+                image, used, blank = preview.render_preview(paths, rows, cols, spec, self.thumbnails)
+                self.message_queue.put(("preview", (generation, image, rows, cols, used, blank)))
+            except Exception as e:
+                self.message_queue.put(("error", f"预览失败：{str(e)}"))
+
+        threading.Thread(target=worker, args=(rows, cols), daemon=True).start()
+
+    def show_preview(self, generation, image, rows, cols, used, blank):
+        """在主线程中显示预览图"""
+        if generation != self.preview_generation or image is None:
+            return
+        photo = ImageTk.PhotoImage(image)
+        self.preview_label.configure(image=photo)
+        self.preview_label.image = photo  # 保持引用，防止被回收
+        self.status_var.set(f"预览：{rows}行 {cols}列，使用 {used} 帧，空白 {blank} 格")
 
     def set_grid(self):
         """设置行列数弹窗"""
         class GridDialog(tk.Toplevel):
-            def __init__(self, parent):
+            def __init__(self, parent, on_change=None, current=(None, None)):
                 super().__init__(parent)
                 self.parent = parent
+                self.on_change = on_change
                 self.title("设置行列数")
-                self.grid_values = (4, 4)  # 默认值
+                self.grid_values = current  # 关闭窗口时保持原设置
 
                 ttk.Label(self, text="行数：").grid(row=0, column=0, padx=5, pady=5)
-                self.row_spin = ttk.Spinbox(self, from_=1, to=20, width=5)
+                self.row_spin = ttk.Spinbox(self, from_=1, to=20, width=5, command=self.on_spin)
                 self.row_spin.grid(row=0, column=1, padx=5, pady=5)
-                self.row_spin.set(4)
+                self.row_spin.set(current[0] or 4)
 
                 ttk.Label(self, text="列数：").grid(row=1, column=0, padx=5, pady=5)
-                self.col_spin = ttk.Spinbox(self, from_=1, to=20, width=5)
+                self.col_spin = ttk.Spinbox(self, from_=1, to=20, width=5, command=self.on_spin)
                 self.col_spin.grid(row=1, column=1, padx=5, pady=5)
-                self.col_spin.set(4)
+                self.col_spin.set(current[1] or 4)
+
+                # 手动输入时同样实时刷新预览
+                self.row_spin.bind("<KeyRelease>", lambda e: self.on_spin())
+                self.col_spin.bind("<KeyRelease>", lambda e: self.on_spin())
+
+                ttk.Button(self, text="确定", command=self.on_confirm).grid(row=2, column=0, pady=10)
+                ttk.Button(self, text="自动", command=self.on_auto).grid(row=2, column=1, pady=10)
 
-                ttk.Button(self, text="确定", command=self.on_confirm).grid(row=2, columnspan=2, pady=10)
+            def on_spin(self):
+                try:
+                    rows = int(self.row_spin.get())
+                    cols = int(self.col_spin.get())
+                except ValueError:
+                    return
+                if rows >= 1 and cols >= 1 and self.on_change:
+                    self.on_change(rows, cols)
 
             def on_confirm(self):
                 try:
@@ -107,11 +263,20 @@ class StitchingApp:
                 except:
                     messagebox.showerror("错误", "请输入有效的正整数")
 
-        dialog = GridDialog(self.root)
+            def on_auto(self):
+                """按帧数自动排版"""
+                self.grid_values = (None, None)
+                self.destroy()
+
+        dialog = GridDialog(self.root, on_change=self.request_preview, current=(self.rows, self.cols))
         self.root.wait_window(dialog)
         if hasattr(dialog, 'grid_values'):
             self.rows, self.cols = dialog.grid_values
-            self.message_queue.put(("info", f"已设置行列数：{self.rows}行 {self.cols}列"))
+            if self.rows is None:
+                self.message_queue.put(("info", "已设置为按帧数自动排版"))
+            else:
+                self.message_queue.put(("info", f"已设置行列数：{self.rows}行 {self.cols}列"))
+        self.request_preview()
 
     def start_stitching(self):
         """开始拼接"""
@@ -126,6 +291,8 @@ class StitchingApp:
         )
         if not self.output_path:
             return
+        self.palette = ({"colors": palette_quant.COLORS, "dither": self.dither_var.get()}
+                        if self.palette_var.get() else None)
 
         # 启动处理线程
         threading.Thread(
@@ -133,76 +300,211 @@ class StitchingApp:
             daemon=True
         ).start()
 
+    def load_frame(self, source, spec, background):
+        """加载一帧并执行流程（没有流程时原样返回）"""
+        img = Image.open(source)
+        if spec:
+            with img:
+                return preview.apply_pipeline(img, spec, 1.0, background)
+        img.load()
+        return img
+
+    def quantize_pages(self, layout):
+        """把写好的各页整体量化为共用一个调色板的8位索引PNG"""
+        page_paths = [layout.page_path(self.output_path, page) for page in range(layout.pages)]
+        raw_bytes = palette_quant.quantize_pages(page_paths, self.palette["colors"], self.palette["dither"])
+        self.message_queue.put(("info", palette_quant.describe(
+            raw_bytes, sum(os.path.getsize(path) for path in page_paths),
+            self.palette["colors"], self.palette["dither"])))
+
+    def build_sheet(self, layout, paths, image_files, sources, spec, background, quantize=False):
+        """整张重新拼接，返回加载失败（用空白替代）的帧数"""
+        blank_count = 0
+        # 按内存预算并行解码/处理，每帧处理完立即贴到画布上并释放，
+        # 不再把所有图片同时留在内存里；每页拼完后在后台编码，同时拼下一页
+        scheduler = memory_scheduler.MemoryScheduler()
+        encoder = sheet_builder.PageEncoder(scheduler)
+        costs = [memory_scheduler.estimate_footprint(p) for p in paths]
+        frame_io.reset()
+        # 格子多时由多个进程各自解码并直接写进共享内存画布；否则在线程中加载，
+        # 按帧序在后台预读文件字节，解码线程不再等待磁盘/网络
+        assembler = None
+        prefetcher = None
+        if shared_sheet.available(len(paths)):
+            assembler = shared_sheet.SheetAssembler(
+                spec, shared_sheet.worker_count(costs, scheduler.budget))
+        else:
+            prefetcher = frame_io.Prefetcher(paths)
+        # 量化时各页放得进内存就拼完后直接在内存中量化再编码，否则写好后再读回量化
+        quantizer = None
+        save_args = {"quality": 95}
+        if quantize:
+            if palette_quant.fits_in_memory(layout, scheduler.budget):
+                quantizer = palette_quant.PageQuantizer(encoder, self.palette["colors"], self.palette["dither"])
+            else:
+                save_args["compress_level"] = 1
+
+        def load(index):
+            return self.load_frame(prefetcher.take(paths[index]), spec, background)
+
+        def paste_loaded(canvas, frames):
+            """线程加载后贴到画布，按完成顺序产出 (序号, 异常)"""
+            for index, img, error in scheduler.map(load, frames, [costs[i] for i in frames]):
+                if error is None:
+                    canvas.paste(img, layout.position(index))
+                    img.close()
+                yield index, error
+
+        try:
+            for page in range(layout.pages):
+                frames = [i for i in layout.page_frames(page) if i < len(paths)]
+                if assembler is not None:
+                    encoder.reserve_page(layout)
+                    shared = shared_sheet.SharedPage(layout.page_size)
+                    canvas, release = shared.image(), shared.release
+                    results = assembler.paste(shared, layout.tile_size,
+                                              [(i, paths[i], layout.position(i)) for i in frames])
+                else:
+                    canvas, release = encoder.new_page(layout), None
+                    results = paste_loaded(canvas, frames)
+                try:
+                    for index, error in results:
+                        filename = image_files[index]
+                        if error is not None:
+                            blank_count += 1
+                            sources[index]["hash"] = None      # 下次拼接时重试
+                            self.message_queue.put(("error", f"加载失败：{filename} - 已用空白替代"))
+                            continue
+                        _, col, row = layout.locate(index)
+                        where = f"第{page+1}页 " if layout.pages > 1 else ""
+                        self.message_queue.put(("info", 
+                            f"已拼接：{filename}（{where}第{row+1}行 第{col+1}列）"))
+                except BaseException:
+                    canvas.close()
+                    if release is not None:
+                        release()
+                    raise
+                (quantizer or encoder).submit(canvas, layout.page_path(self.output_path, page),
+                                              release=release, **save_args)
+            if quantizer is not None:
+                raw_bytes = quantizer.close()
+        finally:
+            if quantizer is not None:
+                quantizer.abort()
+            if assembler is not None:
+                assembler.close()
+            if prefetcher is not None:
+                prefetcher.close()
+            encoder.close()
+        io_summary = frame_io.summary()
+        if io_summary:
+            self.message_queue.put(("info", io_summary))
+        if quantizer is not None:
+            page_paths = [layout.page_path(self.output_path, page) for page in range(layout.pages)]
+            self.message_queue.put(("info", palette_quant.describe(
+                raw_bytes, sum(os.path.getsize(path) for path in page_paths),
+                self.palette["colors"], self.palette["dither"])))
+        elif quantize:
+            self.quantize_pages(layout)
+        return blank_count
+
+    def patch_sheet(self, layout, paths, image_files, changed, sources, spec, background, quantize=False):
+        """只把内容变了的格子重新贴进已有的各页，返回加载失败（用空白替代）的帧数"""
+        if not changed:
+            self.message_queue.put(("info", "所有帧与上次拼接相同，无需更新"))
+            return 0
+        self.message_queue.put(("info", f"增量更新：{len(changed)} 格需要重贴"))
+        frame_io.reset()
+        # 有损格式的页按源帧整页重建，同页其它格子也要读取
+        cells = layout.patch_cells(self.output_path, changed)
+        prefetcher = frame_io.Prefetcher([paths[i] for i in cells if i < len(paths)])
+
+        def load(index):
+            if index >= len(paths):
+                return None     # 本次没有对应的帧，留空
+            return self.load_frame(prefetcher.take(paths[index]), spec, background)
+
+        try:
+            # 量化时之后整张重新量化，先快速压缩
+            results = layout.patch_pages(self.output_path, changed, load, quality=95,
+                                         **({"compress_level": 1} if quantize else {}))
+        finally:
+            prefetcher.close()
+        if quantize:
+            self.quantize_pages(layout)
+        blank_count = 0
+        for index, error in results:
+            if index >= len(paths):
+                continue
+            filename = image_files[index]
+            if error is not None:
+                blank_count += 1
+                sources[index]["hash"] = None
+                self.message_queue.put(("error", f"加载失败：{filename} - 已用空白替代"))
+                continue
+            page, col, row = layout.locate(index)
+            where = f"第{page+1}页 " if layout.pages > 1 else ""
+            self.message_queue.put(("info", f"已更新：{filename}（{where}第{row+1}行 第{col+1}列）"))
+        return blank_count
+
     def stitch_images(self):
         """执行拼接操作"""
         try:
-            # 读取图片
-            image_files = sorted([
-                f for f in os.listdir(self.input_folder)
-                if f.lower().endswith(('.png', '.jpg', '.jpeg'))
-            ])
+            # 按帧序索引读取图片
+            image_files = frame_index.ordered_files(self.input_folder, ('.png', '.jpg', '.jpeg'))
             
-            total_needed = self.rows * self.cols
-            images = []
             blank_count = 0
 
-            # 获取基准尺寸
+            # 获取基准尺寸（经过流程处理后的尺寸，与预览一致）
             first_image = Image.open(os.path.join(self.input_folder, image_files[0]))
-            img_width, img_height = first_image.size
+            img_width, img_height = preview.output_tile_size(self.spec, first_image.size)
             first_image.close()
+            background = preview.load_background(self.spec)
 
-            # 创建空白图片
-            blank_image = Image.new('RGB', (img_width, img_height), (255, 255, 255))
+            # 未设置行列数时按帧数自动排版（必要时缩小单帧），否则按设定的行列数；
+            # 超过最大贴图尺寸时分页（白色底即空白格）
+            spec = self.spec
+            if self.rows is None:
+                plan = grid_layout.solve(len(image_files), (img_width, img_height))
+                self.message_queue.put(("info", plan.describe()))
+                layout = plan.layout
+                if plan.scale < 1:
+                    spec = dict(self.spec, tile=plan.tile_size)
+            else:
+                layout = sheet_builder.SheetLayout(self.rows, self.cols, (img_width, img_height))
+            self.message_queue.put(("info", f"拼接图尺寸：{layout.describe()}"))
+            total_needed = layout.slots
 
-            # 加载图片并处理数量
-            for i, filename in enumerate(image_files):
-                if i >= total_needed:
-                    break
-                try:
-                    img = Image.open(os.path.join(self.input_folder, filename))
-                    images.append(img)
-                    self.message_queue.put(("info", f"已加载图片：{filename}"))
-                except Exception as e:
-                    images.append(blank_image.copy())
-                    blank_count += 1
-                    self.message_queue.put(("error", f"加载失败：{filename} - 已用空白替代"))
-
-            # 补充空白图片
-            while len(images) < total_needed:
-                images.append(blank_image.copy())
-                blank_count += 1
+            # 与上次拼接的索引比较：排版和流程参数（含背景图内容）都没变时只重贴内容变了的格子
+            paths = [os.path.join(self.input_folder, f) for f in image_files[:total_needed]]
+            params = {"spec": spec}
+            if spec.get("background"):
+                params["background"] = sheet_builder.file_hash(spec["background"])
+            quantize = self.palette is not None and png_parallel.is_png(self.output_path)
+            if self.palette is not None and not quantize:
+                self.message_queue.put(("error", "调色板量化只支持PNG输出，本次仍保存为24位"))
+            if quantize:
+                params["palette"] = [self.palette["colors"], self.palette["dither"], palette_quant.METHOD]
+            changed, sources = layout.changed_frames(self.output_path, paths, params)
+            if changed is not None:
+                blank_count += self.patch_sheet(layout, paths, image_files, changed, sources, spec, background,
+                                                quantize)
+            else:
+                blank_count += self.build_sheet(layout, paths, image_files, sources, spec, background, quantize)
 
-            # 创建画布
-            canvas = Image.new('RGB', 
-                (self.cols * img_width, self.rows * img_height),
-                (255, 255, 255))
-
-            # 拼接图片
-            for row in range(self.rows):
-                for col in range(self.cols):
-                    index = row * self.cols + col
-                    if index >= len(images):
-                        continue
-                    position = (col * img_width, row * img_height)
-                    canvas.paste(images[index], position)
-                    self.message_queue.put(("info", 
-                        f"正在拼接：第{row+1}行 第{col+1}列"))
+            # 图片不足时剩余格子保持空白
+            blank_count += total_needed - len(paths)
+            index_file = layout.write_index(self.output_path, image_files[:len(paths)], sources, params)
 
             # 保存结果
-            canvas.save(self.output_path, quality=95)
             self.message_queue.put(("success", 
-                f"拼接完成！保存至：{self.output_path}\n"
+                f"{'增量更新' if changed is not None else '拼接'}完成！保存至：{self.output_path}"
+                f"{f'（共{layout.pages}页）' if layout.pages > 1 else ''}\n"
+                f"页/帧索引：{index_file}\n"
                 f"使用空白图片数量：{blank_count}"))
 
-            # 释放资源
-            for img in images:
-                img.close()
-            blank_image.close()
-
         except Exception as e:
             self.message_queue.put(("error", f"发生错误：{str(e)}"))
-            if 'canvas' in locals():
-                canvas.close()
 
 if __name__ == "__main__":
     app = StitchingApp()
@@ -0,0 +1,439 @@
+##### 超大原图分块读取/缩放 #####
+"""
+16K以上的原图整幅解码会触发PIL的解压炸弹保护，或直接占满内存，这里改为按条带处理：
+    - PNG：自己解析文件块，IDAT用zlib流式解压，每攒够一条带的扫描行，就和上一行（已还原的像素）
+      拼成一张小PNG交给PIL解码。PNG的行过滤只参照上一行，所以结果与整幅解码完全相同
+    - TIFF：按条带/瓦片偏移，只解码与所需区域相交的部分（由libtiff整幅解码的压缩方式除外）
+    - 缩放：与PIL一样先横向后纵向。横向逐行独立，直接对每条源带调用 resize；纵向按PIL的
+      公式在整幅坐标下算出整数系数，每条输出带只取对应的源行（含滤波器半径的重叠行）做加权，
+      输出与整幅缩放逐像素相同
+    - 写PNG：每条带连同上一行交给PIL编码，去掉多出的一行后接进同一个zlib流
+峰值内存由条带大小（TILE_PIXELS）决定，与原图尺寸无关。
+其它格式（JPEG/WebP、隔行PNG、16位彩色PNG等）无法局部解码，退回整幅读取。
+"""
+import io
+import math
+import zlib
+import struct
+from contextlib import contextmanager
+from PIL import Image, ImageFile, PngImagePlugin
+try:
+    import numpy as np  # 条带缩放的纵向滤波需要numpy
+except ImportError:
+    np = None
+
+# ========== 全局配置 ==========
+TILE_THRESHOLD = 64 * 1024 * 1024   # 原图像素数超过此值时走分块路径
+TILE_PIXELS = 8 * 1024 * 1024       # 每条带的像素数（决定峰值内存）
+PNG_COMPRESS_LEVEL = 6              # 分块写PNG的压缩等级
+READ_CHUNK = 1 << 20                # 每次从文件读取的压缩数据大小
+# =============================
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# PIL解码后再按原始布局取回时有损的组合（16位彩色会被降到8位），不能拼接上一行
+PNG_LOSSY_MODES = ((16, 2), (16, 4), (16, 6))
+# 各重采样滤波器的支撑半径（与PIL一致）
+FILTER_SUPPORT = {
+    Image.BOX: 0.5, Image.BILINEAR: 1.0, Image.HAMMING: 1.0, Image.BICUBIC: 2.0, Image.LANCZOS: 3.0,
+}
+# 每个通道8位的模式：纵向滤波逐字节进行即可
+UINT8_MODES = ("L", "La", "RGB", "RGBa", "RGBX", "CMYK", "YCbCr", "LAB", "HSV")
+PRECISION_BITS = 32 - 8 - 2     # PIL 8位重采样的定点精度
+
+
+@contextmanager
+def unbounded():
+    """分块路径自己控制内存，临时关闭PIL的解压炸弹检查（只影响打开，不会解码）"""
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def open_image(path):
+    """打开图片（只读文件头），超大图不会因解压炸弹检查而失败"""
+    with unbounded():
+        return Image.open(path)
+
+
+def should_tile(img):
+    """已打开（未解码）的图片是否需要走分块路径"""
+    return img.width * img.height > TILE_THRESHOLD
+
+
+# ------------------------- PNG -------------------------
+def _chunk(ctype, data):
+    return struct.pack(">I", len(data)) + ctype + data + struct.pack(">I", zlib.crc32(ctype + data))
+
+
+def _split_png(data):
+    """拆开内存中的PNG：返回 (IHDR数据, IDAT之前的其它块, 合并的IDAT数据)"""
+    pos, ihdr, extra, idat = 8, None, [], []
+    while pos < len(data):
+        length, ctype = struct.unpack_from(">I4s", data, pos)
+        body = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if ctype == b"IHDR":
+            ihdr = body
+        elif ctype == b"IDAT":
+            idat.append(body)
+        elif ctype != b"IEND" and not idat:
+            extra.append((ctype, body))
+    return ihdr, extra, b"".join(idat)
+
+
+def _row_bytes(ihdr):
+    width, _, depth, color = struct.unpack_from(">IIBB", ihdr)
+    return 1 + (width * depth * PNG_CHANNELS[color] + 7) // 8
+
+
+class PngRowReader:
+    """按条带解码PNG；IDAT流式解压，内存中只保留一条带"""
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        if self.file.read(8) != PNG_SIGNATURE:
+            self.file.close()
+            raise ValueError("不是有效的PNG文件")
+        self.extra = []         # PLTE/tRNS 等，拼小PNG时原样带上
+        self.ihdr = None
+        while True:
+            length, ctype = struct.unpack(">I4s", self.file.read(8))
+            if ctype == b"IDAT":
+                self.remaining = length
+                break
+            data = self.file.read(length)
+            self.file.read(4)
+            if ctype == b"IHDR":
+                self.ihdr = data
+            elif ctype in (b"PLTE", b"tRNS"):
+                self.extra.append((ctype, data))
+        self.width, self.height, self.depth, self.color, _, _, self.interlace = \
+            struct.unpack(">IIBBBBB", self.ihdr)
+        self.mode, self.rawmode = PngImagePlugin._MODES[(self.depth, self.color)]
+        self.row_bytes = _row_bytes(self.ihdr)
+        self.decompressor = zlib.decompressobj()
+        self.buffer = bytearray()
+        self.prev = bytes(self.row_bytes - 1)   # 第一行之前视为全0行
+        self.y = 0
+
+    @property
+    def supported(self):
+        return not self.interlace and (self.depth, self.color) not in PNG_LOSSY_MODES
+
+    def _next_idat(self):
+        """读取下一段IDAT压缩数据，IDAT结束时返回空"""
+        while not self.remaining:
+            self.file.read(4)   # 上一个块的CRC
+            header = self.file.read(8)
+            if len(header) < 8:
+                return b""
+            length, ctype = struct.unpack(">I4s", header)
+            if ctype != b"IDAT":
+                return b""
+            self.remaining = length
+        data = self.file.read(min(self.remaining, READ_CHUNK))
+        self.remaining -= len(data)
+        return data
+
+    def read_strip(self, rows, columns=None):
+        """解码接下来的 rows 行，返回条带图像（columns=(x0, x1) 时只保留这些列）"""
+        rows = min(rows, self.height - self.y)
+        need = rows * self.row_bytes
+        while len(self.buffer) < need:
+            data = self.decompressor.unconsumed_tail or self._next_idat()
+            if not data:
+                raise ValueError("PNG数据不完整")
+            self.buffer += self.decompressor.decompress(data, need - len(self.buffer))
+        raw = bytes(self.buffer[:need])
+        del self.buffer[:need]
+
+        # 上一行（已还原，过滤方式0）+ 本条带的原始过滤行，拼成一张小PNG交给PIL解码
+        ihdr = struct.pack(">II", self.width, rows + 1) + self.ihdr[8:]
+        mini = b"".join([PNG_SIGNATURE, _chunk(b"IHDR", ihdr)]
+                        + [_chunk(ctype, data) for ctype, data in self.extra]
+                        + [_chunk(b"IDAT", zlib.compress(b"\0" + self.prev + raw, 0)),
+                           _chunk(b"IEND", b"")])
+        with Image.open(io.BytesIO(mini)) as block:
+            block.load()
+            self.prev = block.crop((0, rows, self.width, rows + 1)).tobytes("raw", self.rawmode)
+            x0, x1 = columns or (0, self.width)
+            strip = block.crop((x0, 1, x1, rows + 1))
+        self.y += rows
+        return strip
+
+    def close(self):
+        self.file.close()
+
+
+class PngStripWriter:
+    """逐条带写PNG：每条带连同上一行交给PIL编码（各行过滤参照的上一行与整幅编码时相同），
+    去掉多出的一行后接进同一个zlib流；save_args（exif等）在第一条带编码时写入"""
+    def __init__(self, path, height, compress_level=PNG_COMPRESS_LEVEL, **save_args):
+        self.file = open(path, "wb")
+        self.height = height
+        self.save_args = save_args
+        self.compressor = zlib.compressobj(compress_level)
+        self.prev = None
+
+    def write(self, strip):
+        width, rows = strip.size
+        if self.prev is None:
+            block, skip, save_args = strip, 0, self.save_args
+        else:
+            block = Image.new(strip.mode, (width, rows + 1))
+            if strip.mode in ("P", "PA"):
+                block.putpalette(strip.getpalette())
+            block.info = dict(strip.info)
+            block.paste(self.prev, (0, 0))
+            block.paste(strip, (0, 1))
+            skip, save_args = 1, {}
+        buffer = io.BytesIO()
+        block.save(buffer, "PNG", compress_level=0, **save_args)
+        ihdr, extra, idat = _split_png(buffer.getvalue())
+        if self.prev is None:
+            ihdr = ihdr[:4] + struct.pack(">I", self.height) + ihdr[8:]
+            self.file.write(PNG_SIGNATURE + _chunk(b"IHDR", ihdr))
+            for ctype, data in extra:
+                self.file.write(_chunk(ctype, data))
+        raw = zlib.decompress(idat)
+        self._write_idat(self.compressor.compress(memoryview(raw)[skip * _row_bytes(ihdr):]))
+        self.prev = strip.crop((0, rows - 1, width, rows))
+
+    def _write_idat(self, data):
+        if data:
+            self.file.write(_chunk(b"IDAT", data))
+
+    def close(self):
+        self._write_idat(self.compressor.flush())
+        self.file.write(_chunk(b"IEND", b""))
+        self.file.close()
+
+
+# ------------------------- TIFF -------------------------
+def _make_tile(codec, extents, offset, args):
+    make = getattr(ImageFile, "_Tile", None)
+    return make(codec, extents, offset, args) if make else (codec, extents, offset, args)
+
+
+def _tiff_region(path, box):
+    """只解码与 box 相交的TIFF条带/瓦片"""
+    x0, y0, x1, y1 = box
+    with open_image(path) as img:
+        tiles = [t for t in img.tile
+                 if t[1][0] < x1 and t[1][2] > x0 and t[1][1] < y1 and t[1][3] > y0]
+        left = min(t[1][0] for t in tiles)
+        top = min(t[1][1] for t in tiles)
+        right = max(t[1][2] for t in tiles)
+        bottom = max(t[1][3] for t in tiles)
+        # 把选中的瓦片平移到一张只有相交范围大小的图像上解码
+        img._size = (right - left, bottom - top)
+        img.tile = [_make_tile(codec, (e[0] - left, e[1] - top, e[2] - left, e[3] - top), offset, args)
+                    for codec, e, offset, args in tiles]
+        img.load()
+        return img.crop((x0 - left, y0 - top, x1 - left, y1 - top))
+
+
+def _tiff_bands(img, y0, y1, rows):
+    """按瓦片行边界把 [y0, y1) 分成若干条带，每条至少 rows 行（不把同一行瓦片拆开解码）"""
+    edges = sorted({t[1][1] for t in img.tile} | {img.height})
+    bands, start = [], y0
+    for edge in edges:
+        if edge > start and (edge - start >= rows or edge >= y1):
+            bands.append((start, min(edge, y1)))
+            start = edge
+        if start >= y1:
+            break
+    return bands
+
+
+# ------------------------- 条带读取 -------------------------
+def tileable(path):
+    """是否能按条带局部解码"""
+    try:
+        with open(path, "rb") as f:
+            if f.read(8) == PNG_SIGNATURE:
+                reader = PngRowReader(path)
+                reader.close()
+                return reader.supported
+        with open_image(path) as img:
+            return img.format == "TIFF" and bool(img.tile) and all(t[0] != "libtiff" for t in img.tile)
+    except (OSError, ValueError, KeyError, struct.error):
+        return False
+
+
+def iter_strips(path, box=None, rows=None):
+    """按条带产出 box 区域（默认整幅）：(区域内的起始行, 条带图像)，条带宽度为区域宽度"""
+    with open_image(path) as img:
+        width, height = img.size
+        x0, y0, x1, y1 = box or (0, 0, width, height)
+        rows = rows or max(1, TILE_PIXELS // width)
+        if not tileable(path):
+            print(f"⚠️ {img.format}格式不支持分块解码，整幅读取: {path}")
+            img.load()
+            yield 0, img.crop((x0, y0, x1, y1))
+            return
+        if img.format == "TIFF":
+            for top, bottom in _tiff_bands(img, y0, y1, rows):
+                yield top - y0, _tiff_region(path, (x0, top, x1, bottom))
+            return
+
+    reader = PngRowReader(path)
+    try:
+        while reader.y < y1:
+            top = reader.y
+            strip = reader.read_strip(min(rows, y1 - top), (x0, x1))
+            if reader.y > y0:   # 区域之前的行也要解码（后面的行过滤依赖它们），但不产出
+                if top < y0:
+                    strip = strip.crop((0, y0 - top, x1 - x0, strip.height))
+                    top = y0
+                yield top - y0, strip
+    finally:
+        reader.close()
+
+
+def save_strips(strips, path, size, convert=None, **save_args):
+    """把 (起始行, 条带) 写成一张 size 大小的图片；PNG逐条带写出，其它格式拼成整幅后保存
+    convert 为逐像素的转换函数（如模式转换），在每条带上执行"""
+    if path.lower().endswith(".png"):
+        writer = PngStripWriter(path, size[1], **save_args)
+        try:
+            for _, strip in strips:
+                writer.write(convert(strip) if convert else strip)
+        finally:
+            writer.close()
+        return
+    assemble(strips, size, convert).save(path, **save_args)
+
+
+def assemble(strips, size, convert=None):
+    """把 (起始行, 条带) 拼成一张 size 大小的图像"""
+    canvas = None
+    for top, strip in strips:
+        strip = convert(strip) if convert else strip
+        if canvas is None:
+            canvas = Image.new(strip.mode, size)
+            if strip.mode in ("P", "PA"):
+                canvas.putpalette(strip.getpalette())
+            canvas.info = dict(strip.info)
+        canvas.paste(strip, (0, top))
+    return canvas
+
+
+
+
+# ------------------------- 条带缩放 -------------------------
+def _vertical_weights(height, in0, in1, out_size, resample):
+    """纵向每个输出行的 (起始源行, 整数权重数组)，由PIL自己算出，与整幅缩放用的系数完全相同。
+    做法：用一张 P 列、height 行的32位图，第 c 列在行号 % P == c 的行上放 2**PRECISION_BITS，
+    缩放后每个输出行在各列得到的就是该行对应源行的权重（32位路径的四舍五入与8位路径的系数取整一致）
+    """
+    scale = (in1 - in0) / out_size
+    support = FILTER_SUPPORT[resample] * max(scale, 1.0)
+    period = 2 * math.ceil(support) + 4    # 大于一个输出行用到的源行数（含估算误差）
+    probe = np.zeros((height, period), np.int32)
+    probe[np.arange(height), np.arange(height) % period] = 1 << PRECISION_BITS
+    weights = np.asarray(Image.fromarray(probe).resize((period, out_size), resample,
+                                                       box=(0, in0, period, in1)), np.int64)
+    result = []
+    for yy in range(out_size):
+        first = max(int(in0 + (yy + 0.5) * scale - support + 0.5) - 1, 0)
+        last = min(first + period, height)
+        result.append((first, weights[yy, np.arange(first, last) % period]))
+    return result
+
+
+def _nearest_rows(height, in0, in1, out_size):
+    """最近邻缩放时每个输出行取的源行：把行号写进一列图像，由PIL缩放得到"""
+    rows = Image.fromarray(np.arange(height, dtype=np.int32).reshape(height, 1))
+    return np.asarray(rows.resize((1, out_size), Image.NEAREST, box=(0, in0, 1, in1)))[:, 0]
+
+
+def resize_strips(path, size, resample=Image.LANCZOS, box=None, convert=None):
+    """把 box 区域（默认整幅）缩放到 size，按输出条带产出 (起始行, 条带)；
+    与 convert(整幅).resize(size, resample, box=box) 逐像素相同，convert 须为逐像素的转换"""
+    with open_image(path) as img:
+        width, height = img.size
+    box = tuple(box or (0, 0, width, height))
+    out_width, out_height = size
+    strips = iter_strips(path, rows=max(1, TILE_PIXELS // width))
+    _, first = next(strips)
+    first = convert(first) if convert else first
+    mode = first.mode
+    if mode in ("1", "P"):
+        resample = Image.NEAREST    # 与 Image.resize 相同
+    work_mode = {"LA": "La", "RGBA": "RGBa"}.get(mode, mode) if resample != Image.NEAREST else mode
+    if np is None or (resample != Image.NEAREST and work_mode not in UINT8_MODES) \
+            or (resample == Image.NEAREST and mode in ("I;16", "I;16L", "I;16B", "I;16N")):
+        print(f"⚠️ {mode}模式不支持分块缩放（或未安装numpy），整幅缩放: {path}")
+        full = assemble(_chain(first, strips, convert), (width, height))
+        yield 0, full.resize(size, resample, box=box)
+        return
+
+    # 纵向系数在整幅坐标下计算一次；PIL在纵向尺寸和范围都不变时跳过纵向滤波
+    if out_height == height and not box[1] and box[3] == out_height:
+        vertical = None
+    elif resample == Image.NEAREST:
+        vertical = [(y, [1]) for y in _nearest_rows(height, box[1], box[3], out_height).tolist()]
+    else:
+        vertical = _vertical_weights(height, box[1], box[3], out_height, resample)
+
+    def horizontal(strip):
+        """横向缩放一条源带，返回按行排列的字节数组"""
+        if strip.mode != work_mode:
+            strip = strip.convert(work_mode)
+        strip = strip.resize((out_width, strip.height), resample, box=(box[0], 0, box[2], strip.height))
+        return np.frombuffer(strip.tobytes(), np.uint8).reshape(strip.height, -1)
+
+    def span(j):
+        ymin, k = vertical[j] if vertical else (j, [1])
+        return ymin, ymin + len(k)
+
+    buffer, buffer_top = horizontal(first), 0     # 缓存的横向结果 [buffer_top, buffer_top + len(buffer))
+    # 每条输出带对应的源行（已横向缩放）也不超过一条带的像素预算
+    out_rows = max(1, int(TILE_PIXELS // out_width / max((box[3] - box[1]) / out_height, 1.0)))
+    for j0 in range(0, out_height, out_rows):
+        j1 = min(out_height, j0 + out_rows)
+        low, high = span(j0)[0], max(span(j)[1] for j in range(j0, j1))
+        parts, end = [buffer], buffer_top + len(buffer)
+        while end < high:
+            _, strip = next(strips)
+            if end + strip.height <= low:   # 整条都在需要的范围之上，不做横向缩放
+                parts, buffer_top = [], end + strip.height
+            else:
+                parts.append(horizontal(convert(strip) if convert else strip))
+            end += strip.height
+        buffer = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        if low > buffer_top:        # 丢掉用不到的上方行
+            buffer = buffer[low - buffer_top:]
+            buffer_top = low
+
+        if vertical is None:
+            out = buffer[j0 - buffer_top:j1 - buffer_top]
+        elif resample == Image.NEAREST:
+            out = buffer[[vertical[j][0] - buffer_top for j in range(j0, j1)]]
+        else:
+            out = np.empty((j1 - j0, buffer.shape[1]), np.uint8)
+            for j in range(j0, j1):
+                ymin, k = vertical[j]
+                window = buffer[ymin - buffer_top:ymin - buffer_top + len(k)].astype(np.int64)
+                acc = k @ window + (1 << (PRECISION_BITS - 1))
+                out[j - j0] = np.clip(acc >> PRECISION_BITS, 0, 255)
+        strip = Image.frombytes(work_mode, (out_width, j1 - j0), out.tobytes())
+        if mode in ("P", "PA"):
+            strip.putpalette(first.getpalette())
+        strip.info = dict(first.info)
+        yield j0, strip.convert(mode) if work_mode != mode else strip
+
+
+def _chain(first, strips, convert=None):
+    yield 0, first
+    for top, strip in strips:
+        yield top, convert(strip) if convert else strip
+
+
+def resize_tiled(path, size, resample=Image.LANCZOS, box=None, convert=None):
+    """条带缩放并拼成整幅结果（输出尺寸通常远小于原图）"""
+    return assemble(resize_strips(path, size, resample, box, convert), size)
@@ -0,0 +1,297 @@
+##### 监视文件夹自动重建 #####
+"""
+常驻运行，监视 ddsImages / ddsInput 与序列帧目录 ./out，文件变化后只重建受影响的产物：
+    ddsImages 中某张图变化 -> 只重新转换对应的一个DDS并刷新INI
+    ddsInput 变化（哈希对改变）-> 重建全部DDS
+    ./out 中某帧变化 -> 只把这一帧重新贴进拼接图的对应格子（按拼接时写出的页/帧索引定位页和格子，
+                        内容哈希与索引中记录的相同时跳过）
+帧数增减导致排版变化、或拼接图不存在时，才整张重跑 stitching.py。
+
+Linux 下用 inotify（通过ctypes调用，无需额外安装），其他系统自动退回定时轮询。
+一批连续的变化（例如一次拖入几十张图）会等安静 DEBOUNCE_SECONDS 秒后合并处理。
+变化的判断依据帧序索引中的 大小/修改时间，按位置比较前后两次快照得出。
+"""
+import os
+import sys
+import time
+import shutil
+import struct
+import select
+import subprocess
+import ctypes
+import ctypes.util
+from PIL import Image
+
+import frame_index
+import sheet_builder
+import palette_quant
+
+# ========== 全局配置 ==========
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DDS_DIR = os.path.join(BASE_DIR, "dds贴图批量图片替换并生成ini")
+FRAMES_DIR = os.path.join(BASE_DIR, "动态贴图生成", "out")
+STITCH_SCRIPT = os.path.join(BASE_DIR, "动态贴图生成", "stitching.py")
+SHEET_PATH = os.path.join(BASE_DIR, "动态贴图生成", "stitchingOutput.jpg")
+SHEET_EXTS = ('.png', '.jpg', '.jpeg')   # 与 stitching.py 读取的扩展名一致
+DEBOUNCE_SECONDS = 0.5     # 最后一次变化后等待多久再处理
+POLL_INTERVAL = 0.5        # 轮询模式的扫描间隔（秒）
+USE_INOTIFY = True         # Linux下优先使用inotify
+# =============================
+
+sys.path.append(DDS_DIR)
+import DDSTextureBatchImageReplacementAndGenerationOfIni as dds_tool
+
+# DDS脚本的路径配置是相对其所在目录的，这里统一换成绝对路径
+for _name in ("dds_input_dir", "image_input_dir", "output_dir"):
+    setattr(dds_tool, _name, os.path.join(DDS_DIR, getattr(dds_tool, _name)))
+if os.path.exists(os.path.join(DDS_DIR, dds_tool.texconv_path)):
+    dds_tool.texconv_path = os.path.join(DDS_DIR, dds_tool.texconv_path)
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE
+
+
+# ------------------------- 文件系统事件源 -------------------------
+class InotifyWatcher:
+    """通过ctypes使用Linux inotify，wait() 返回 [(目录, 文件名)]"""
+    def __init__(self, folders):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.folders = {}
+        for folder in folders:
+            wd = libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK)
+            if wd < 0:
+                os.close(self.fd)
+                raise OSError(ctypes.get_errno(), f"无法监视 {folder}")
+            self.folders[wd] = folder
+
+    def wait(self, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        # struct inotify_event { int wd; uint32 mask; uint32 cookie; uint32 len; char name[len]; }
+        while offset + 16 <= len(data):
+            wd, _, _, length = struct.unpack_from("iIII", data, offset)
+            name = data[offset + 16:offset + 16 + length].rstrip(b"\0")
+            offset += 16 + length
+            if wd in self.folders and name:
+                events.append((self.folders[wd], os.fsdecode(name)))
+        return events
+
+
+class PollingWatcher:
+    """定时扫描目录比较 大小/修改时间，作为inotify不可用时的后备"""
+    def __init__(self, folders):
+        self.snapshots = {folder: self._scan(folder) for folder in folders}
+
+    @staticmethod
+    def _scan(folder):
+        result = {}
+        with os.scandir(folder) as it:
+            for entry in it:
+                if entry.is_file():
+                    st = entry.stat()
+                    result[entry.name] = (st.st_size, st.st_mtime_ns)
+        return result
+
+    def wait(self, timeout):
+        time.sleep(max(timeout, POLL_INTERVAL))
+        events = []
+        for folder, old in self.snapshots.items():
+            new = self._scan(folder)
+            events.extend((folder, name) for name in set(old) | set(new)
+                          if old.get(name) != new.get(name))
+            self.snapshots[folder] = new
+        return events
+
+
+def make_watcher(folders):
+    """Linux下优先inotify，失败时退回轮询"""
+    if USE_INOTIFY and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(folders)
+        except (OSError, AttributeError) as e:
+            print(f"⚠️ inotify不可用，改用轮询：{str(e)}")
+    return PollingWatcher(folders)
+
+
+# ------------------------- 变化定位 -------------------------
+def _snapshot(folder, exts=frame_index.IMAGE_EXTS):
+    """按帧序返回 [(文件名, 大小, 修改时间)]"""
+    frame_index.update_index(folder)
+    return [(e["file"], e["size"], e["mtime_ns"])
+            for e in frame_index.load_index(folder)["frames"]
+            if e["file"].lower().endswith(exts)]
+
+
+def _changed_positions(old, new):
+    """逐位置比较两次快照，返回内容或文件发生变化的序号"""
+    return [i for i in range(len(new)) if i >= len(old) or old[i] != new[i]]
+
+
+# ------------------------- 重建目标 -------------------------
+class DdsTarget:
+    """ddsImages 第 i 张图 -> 第 i 个哈希对的DDS + INI"""
+    def __init__(self):
+        self.folders = [dds_tool.image_input_dir, dds_tool.dds_input_dir]
+        self.images = _snapshot(dds_tool.image_input_dir)
+        self.inputs = _snapshot(dds_tool.dds_input_dir)
+
+    def rebuild(self):
+        """重建受影响的DDS，返回是否做了重建"""
+        images = _snapshot(dds_tool.image_input_dir)
+        inputs = _snapshot(dds_tool.dds_input_dir)
+        if inputs != self.inputs:
+            positions = list(range(len(images)))   # 哈希对变化，全部重建
+        else:
+            positions = _changed_positions(self.images, images)
+        if not positions:
+            return False
+
+        hash_pairs = dds_tool.parse_input_hashes()
+        if len(images) != len(hash_pairs):
+            print(f"⚠️ 图片数量不匹配：ddsImages有{len(images)}个，ddsInput有{len(hash_pairs)}个，暂不重建")
+            return False
+        slotcheck_hash = dds_tool.read_slotcheck_hash()
+        if slotcheck_hash is None:
+            print("⚠️ 未找到已生成的INI，请先完整运行一次DDS脚本")
+            return False
+
+        temp_dir = os.path.join(dds_tool.output_dir, "_temp")
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_files = []
+        for i in positions:
+            hash1, hash2, info = hash_pairs[i]
+            temp_path = os.path.join(temp_dir, dds_tool.output_basename(hash1, hash2, info) + ".png")
+            try:
+                dds_tool.flip_image(os.path.join(dds_tool.image_input_dir, images[i][0]), temp_path,
+                                    dds_tool.target_size_of(info), dds_tool.mode_of(info))
+                temp_files.append((temp_path, info))
+            except Exception as e:
+                print(f"❌ 处理失败：{images[i][0]}（错误：{str(e)}）")
+
+        try:
+            if temp_files and dds_tool.convert_to_dds(temp_files):
+                dds_tool.generate_ini(dds_tool.output_dir, slotcheck_hash)
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        self.images, self.inputs = images, inputs
+        print(f"✅ 已重建 {len(temp_files)} 个DDS：{', '.join(images[i][0] for i in positions[:5])}"
+              f"{' …' if len(positions) > 5 else ''}")
+        return True
+
+
+class SheetTarget:
+    """./out 第 i 帧 -> 拼接图第 i 格"""
+    def __init__(self):
+        self.folders = [FRAMES_DIR]
+        self.frames = _snapshot(FRAMES_DIR, SHEET_EXTS)
+
+    def rebuild(self):
+        """修补或重跑拼接图，返回是否做了重建"""
+        frames = _snapshot(FRAMES_DIR, SHEET_EXTS)
+        positions = _changed_positions(self.frames, frames)
+        if not positions and len(frames) == len(self.frames):
+            return False
+        if len(frames) == len(self.frames) and self.patch(frames):
+            self.frames = frames
+            return True
+        # 帧数变化或无法局部修补，整张重跑拼接脚本
+        result = subprocess.run([sys.executable, STITCH_SCRIPT], cwd=os.path.dirname(STITCH_SCRIPT))
+        if result.returncode != 0:
+            print("❌ 拼接脚本运行失败，等待下一次变化后重试")
+            return False
+        self.frames = frames
+        return True
+
+    def patch(self, frames):
+        """按拼接图的页/帧索引把内容变了的帧贴回所在页，索引缺失或尺寸对不上时返回False"""
+        index = sheet_builder.read_index(SHEET_PATH)
+        if index is None:
+            return False
+        layout = sheet_builder.SheetLayout.from_index(index)
+        paths = [os.path.join(FRAMES_DIR, name) for name, _, _ in frames]
+        # 快照只按大小/修改时间判断，这里再按内容哈希确定真正要重贴的格子（只被触碰过的帧跳过）
+        changed, sources = layout.changed_frames(SHEET_PATH, paths, index.get("params"))
+        if changed is None:
+            return False
+        for i in changed:
+            with Image.open(paths[i]) as frame:
+                if frame.size != layout.tile_size:
+                    return False
+        # 拼接时量化成了8位索引PNG的，贴好后按同样的设置整体重新量化
+        palette = (index.get("params") or {}).get("palette")
+        save_args = {"compress_level": 1} if palette and changed else {}
+        for i, error in layout.patch_pages(SHEET_PATH, changed, lambda i: Image.open(paths[i]), quality=95,
+                                           **save_args):
+            if error is not None:
+                sources[i]["hash"] = None
+                print(f"❌ 加载失败：{frames[i][0]}（错误：{str(error)}）")
+        if palette and changed:
+            colors, dither, method = palette
+            page_paths = [layout.page_path(SHEET_PATH, page) for page in range(layout.pages)]
+            raw_bytes = palette_quant.quantize_pages(page_paths, colors, dither, method)
+            print(palette_quant.describe(raw_bytes, sum(os.path.getsize(path) for path in page_paths), colors, dither))
+        layout.write_index(SHEET_PATH, [name for name, _, _ in frames], sources, index.get("params"))
+        if not changed:
+            print("拼接图各帧内容未变化，无需更新")
+            return True
+        print(f"✅ 已更新拼接图 {len(changed)} 格：{', '.join(frames[i][0] for i in changed[:5])}"
+              f"{' …' if len(changed) > 5 else ''}")
+        return True
+
+
+# ------------------------- 主循环 -------------------------
+def run(watcher, handlers):
+    """收集事件，安静 DEBOUNCE_SECONDS 秒后按目录合并处理"""
+    pending = set()
+    last_event = 0.0
+    while True:
+        for folder, name in watcher.wait(DEBOUNCE_SECONDS / 4 if pending else 1.0):
+            # 跳过索引/日志/临时文件等隐藏文件和非图片
+            if name.startswith('.') or not name.lower().endswith(frame_index.IMAGE_EXTS):
+                continue
+            pending.add(folder)
+            last_event = time.monotonic()
+        if pending and time.monotonic() - last_event >= DEBOUNCE_SECONDS:
+            targets = {handlers[folder] for folder in pending}
+            pending.clear()
+            for target in targets:
+                start = time.perf_counter()
+                try:
+                    if target.rebuild():
+                        print(f"   （耗时 {time.perf_counter() - start:.2f} 秒）")
+                except Exception as e:
+                    print(f"❌ 重建失败：{str(e)}")
+
+
+def main():
+    for folder in (dds_tool.image_input_dir, dds_tool.dds_input_dir, FRAMES_DIR):
+        os.makedirs(folder, exist_ok=True)
+    targets = [DdsTarget(), SheetTarget()]
+    handlers = {folder: target for target in targets for folder in target.folders}
+    watcher = make_watcher(list(handlers))
+    print(f"正在监视（{'inotify' if isinstance(watcher, InotifyWatcher) else '轮询'}）：")
+    for folder in handlers:
+        print(f"  {folder}")
+    print("按 Ctrl+C 停止")
+    try:
+        run(watcher, handlers)
+    except KeyboardInterrupt:
+        print("已停止监视")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+##### 常驻工作服务 #####
+"""
+每个工具都是独立脚本，每次运行都要启动解释器、导入PIL等模块、新建进程池，
+连续跑几个工具就付几次启动开销，进程池和已解码的背景图也从不复用。这里提供一个常驻的本地服务：
+    - 直接运行本文件启动（Ctrl+C停止；参数 status 查看状态，stop 停止）。Windows下监听命名管道，
+      其他系统监听临时目录下的Unix套接字（multiprocessing.connection）；连接需要服务启动时随机生成、
+      只有当前用户可读的密钥
+    - 启动时建好进程池，每个工作进程预先导入PIL和公共模块、加载全部编解码插件
+    - 作业是各工具脚本中的逐帧函数（如 separatelyMerge.composite_frame）：工作进程按路径加载脚本一次
+      （脚本修改后自动重新加载），脚本模块中缓存的状态（例如已解码的 background.png）跨次运行保留
+    - 脚本用 connect() 连接，服务没在运行时立即返回None，脚本照常在本进程处理；
+      client.map() 把各帧交给进程池，结果（编码好的字节）按提交顺序流式返回，
+      写盘和进度日志仍由脚本完成，断点续做的保证不变；服务处理请求出错时回复错误并断开，
+      client.map() 抛出 ServiceError，脚本把其余各帧改在本进程处理
+"""
+import os
+import sys
+import time
+import secrets
+import tempfile
+import threading
+import importlib.util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+
+# ========== 全局配置 ==========
+ENABLED = True          # False 时脚本不尝试连接服务，总在本进程处理
+WORKERS = None          # 进程池大小，None 为CPU核心数
+IN_FLIGHT = 2           # 每个工作进程排队的帧数（限制服务中等待发回的结果占用的内存）
+# =============================
+
+if sys.platform == "win32":
+    FAMILY = "AF_PIPE"
+    ADDRESS = r"\\.\pipe\ZZZmodWorkflow-worker"
+    KEY_PATH = os.path.join(tempfile.gettempdir(), "ZZZmodWorkflow-worker.key")
+else:
+    FAMILY = "AF_UNIX"
+    ADDRESS = os.path.join(tempfile.gettempdir(), f"ZZZmodWorkflow-worker-{os.getuid()}.sock")
+    KEY_PATH = ADDRESS + ".key"
+
+_scripts = {}           # 工作进程内已加载的脚本：路径 -> (修改时间, 模块)
+
+
+class ServiceError(RuntimeError):
+    """服务端处理请求出错（进程池无法重建、结果无法发送等）"""
+
+
+# ------------------------- 工作进程 -------------------------
+def _warm():
+    """工作进程启动时预先导入常用模块、加载全部编解码插件"""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from PIL import Image
+    Image.init()
+    import pixel_pipeline, frame_stack, tiled_io, dds_encode     # noqa: F401
+
+
+def _script(path):
+    """按路径加载工具脚本（不执行 __main__ 部分），文件修改后重新加载"""
+    mtime = os.stat(path).st_mtime_ns
+    cached = _scripts.get(path)
+    if cached is None or cached[0] != mtime:
+        name = "_job_" + os.path.splitext(os.path.basename(path))[0].replace(".", "_")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _scripts[path] = cached = (mtime, module)
+    return cached[1]
+
+
+def _run_job(script, function, args, cwd):
+    """工作进程：在调用方的工作目录下执行 script 中的 function(*args)"""
+    if os.getcwd() != cwd:
+        os.chdir(cwd)       # 脚本的配置多为相对路径
+    return getattr(_script(script), function)(*args)
+
+
+def _noop():
+    return os.getpid()
+
+
+# ------------------------- 服务端 -------------------------
+class WarmPool:
+    """常驻进程池；有工作进程崩溃导致池不可用时重建"""
+    def __init__(self, workers=None):
+        self.workers = workers or WORKERS or os.cpu_count() or 4
+        self.lock = threading.Lock()
+        self.executor = None
+        self._start()
+
+    def _start(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_warm)
+        # 提前拉起全部工作进程，第一帧不再等进程启动
+        for future in [self.executor.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, *args):
+        with self.lock:
+            try:
+                return self.executor.submit(*args)
+            except BrokenProcessPool:
+                print("⚠️ 工作进程异常退出，重建进程池")
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self._start()
+                return self.executor.submit(*args)
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class WorkerService:
+    """监听本地连接，每个连接一个线程，所有连接共用同一个进程池"""
+    def __init__(self, workers=None):
+        self.pool = WarmPool(workers)
+        self.started = time.time()
+        self.served = 0
+        self.stopping = False
+        self.key = secrets.token_bytes(32)
+
+    def serve_forever(self):
+        if FAMILY == "AF_UNIX" and os.path.exists(ADDRESS):
+            if connect() is not None:
+                raise RuntimeError("常驻服务已在运行")
+            os.remove(ADDRESS)      # 上次异常退出留下的套接字文件
+        listener = Listener(ADDRESS, FAMILY, authkey=self.key)
+        if FAMILY == "AF_UNIX":
+            os.chmod(ADDRESS, 0o600)
+        fd = os.open(KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.key)
+        print(f"✅ 常驻服务已启动：{ADDRESS}（{self.pool.workers}个工作进程）")
+        try:
+            while not self.stopping:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError):
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+            for path in (KEY_PATH, ADDRESS if FAMILY == "AF_UNIX" else None):
+                if path and os.path.exists(path):
+                    os.remove(path)
+            self.pool.close()
+
+    def _serve(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                kind = request[0]
+                try:
+                    if kind == "map":
+                        self._map(conn, *request[1:])
+                    elif kind == "status":
+                        conn.send(("ok", {"pid": os.getpid(), "workers": self.pool.workers,
+                                          "uptime": time.time() - self.started, "served": self.served}))
+                    elif kind == "stop":
+                        conn.send(("ok", None))
+                        self.stop()
+                        return
+                    else:
+                        conn.send(("error", f"未知的请求：{kind}"))
+                except (EOFError, OSError):
+                    return      # 调用方已断开
+                except Exception as e:
+                    # 其它错误也要回复，否则调用方会一直等在 recv 上；回复后断开，连接状态不再可信
+                    message = f"常驻服务处理 {kind} 请求出错：{str(e) or type(e).__name__}"
+                    print(f"❌ {message}")
+                    try:
+                        conn.send(("error", message))
+                    except Exception:
+                        pass
+                    return
+
+    def _map(self, conn, script, function, items, cwd):
+        """逐项提交到进程池（在途数量有上限），结果按提交顺序发回"""
+        start = time.perf_counter()
+        pending = deque()
+        queue = iter(enumerate(items))
+        in_flight = self.pool.workers * IN_FLIGHT
+        try:
+            while True:
+                for index, args in queue:
+                    pending.append((index, self.pool.submit(_run_job, script, function, tuple(args), cwd)))
+                    if len(pending) >= in_flight:
+                        break
+                if not pending:
+                    break
+                index, future = pending.popleft()
+                try:
+                    result, error = future.result(), None
+                except Exception as e:
+                    result, error = None, str(e) or type(e).__name__
+                conn.send(("item", index, result, error))
+                self.served += 1
+        finally:
+            for _, future in pending:
+                future.cancel()
+        print(f"▶ {os.path.basename(script)} {function} ×{len(items)}，用时 {time.perf_counter() - start:.2f}s")
+
+    def stop(self):
+        """从服务线程中停止：置标志后连一次自己，让 accept 返回"""
+        self.stopping = True
+        try:
+            Client(ADDRESS, FAMILY, authkey=self.key).close()
+        except (OSError, AuthenticationError):
+            pass
+
+
+# ------------------------- 客户端 -------------------------
+class ServiceClient:
+    """与常驻服务的连接
+    用法：
+        service = worker_service.connect()      # 服务没在运行时为None
+        if service is not None:
+            for index, data, error in service.map(__file__, "composite_frame", [(路径, 文件名), ...]):
+                ...
+            service.close()
+    """
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _request(self, *request):
+        self.conn.send(request)
+        kind, payload = self.conn.recv()
+        if kind != "ok":
+            raise ServiceError(payload)
+        return payload
+
+    def status(self):
+        return self._request("status")
+
+    def stop(self):
+        return self._request("stop")
+
+    def map(self, script, function, items):
+        """在服务的进程池中对每项调用 script 中的 function(*项)，按顺序产出 (序号, 结果, 错误信息或None)
+        连接中断时其余各项以错误返回（由脚本按失败处理，重新运行时按进度日志续做）；
+        服务回复错误时抛出 ServiceError（已产出的各项有效，其余由脚本自行处理）
+        """
+        items = [tuple(args) for args in items]
+        received = 0
+        try:
+            self.conn.send(("map", os.path.abspath(script), function, items, os.getcwd()))
+            while received < len(items):
+                kind, *payload = self.conn.recv()
+                if kind != "item":
+                    raise ServiceError(payload[0])
+                received += 1
+                yield tuple(payload)
+        except (EOFError, OSError) as e:
+            for index in range(received, len(items)):
+                yield index, None, f"与常驻服务的连接中断（{e or type(e).__name__}）"
+        finally:
+            if received < len(items):
+                self.close()    # 调用方提前结束时断开，服务端随之取消剩余的帧
+
+    def close(self):
+        self.conn.close()
+
+
+def connect():
+    """连接常驻服务；没有在运行时立即返回None"""
+    if not ENABLED:
+        return None
+    try:
+        with open(KEY_PATH, "rb") as f:
+            key = f.read()
+        return ServiceClient(Client(ADDRESS, FAMILY, authkey=key))
+    except (OSError, EOFError, AuthenticationError):
+        return None
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "serve"
+    if command in ("status", "stop"):
+        service = connect()
+        if service is None:
+            print("常驻服务没有在运行")
+            return
+        if command == "status":
+            status = service.status()
+            print(f"常驻服务运行中：进程 {status['pid']}，{status['workers']}个工作进程，"
+                  f"已运行 {status['uptime'] / 60:.1f} 分钟，处理 {status['served']} 帧")
+        else:
+            service.stop()
+            print("常驻服务已停止")
+        service.close()
+        return
+    service = WorkerService()
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        print("\n常驻服务已停止")
+    except RuntimeError as e:
+        print(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    main()
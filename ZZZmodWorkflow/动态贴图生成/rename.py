@@ -1,53 +1,33 @@
 import os
-import re
+import sys
 import tkinter as tk
 from tkinter import filedialog, simpledialog
 
-def natural_sort_key(s):
-    """自然排序键函数（处理数字序号排序）"""
-    return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', s)]
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_index
 
 def rename_images(folder_path, prefix, suffix):
-    """批量重命名图片文件（按自然顺序）
+    """批量重命名图片文件（按帧序索引顺序）
+    各脚本已直接按帧序索引读取文件，本操作仅在导出需要规范文件名时使用。
+    采用“日志 + 两阶段重命名”，目标名与现有文件名交叉时也不会冲突。
     参数：
         folder_path - 图片目录路径
         prefix - 新文件名前缀
         suffix - 新文件名后缀
     """
-    # 获取文件夹中的所有文件
-    files = os.listdir(folder_path)
+    try:
+        renamed = frame_index.export_rename(
+            folder_path, prefix, suffix,
+            exts=('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.dds')
+        )
+    except Exception as e:
+        print(f"重命名失败：{str(e)}")
+        return
     
-    # 过滤图片文件并自然排序
-    image_files = [
-        f for f in files 
-        if f.lower().endswith(('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.dds'))
-    ]
-    image_files = sorted(image_files, key=natural_sort_key)
-    
-    # 初始化序号（从0开始的三位数字）
-    sequence_number = 0
-    
-    for image_file in image_files:
-        # 分解文件名和扩展名
-        file_name, file_extension = os.path.splitext(image_file)
-        
-        # 构造新文件名（带三位序号）
-        new_name = f"{prefix}{sequence_number:03d}{suffix}{file_extension}"
-        
-        # 构造完整路径
-        old_path = os.path.join(folder_path, image_file)
-        new_path = os.path.join(folder_path, new_name)
-        
-        try:
-            # 执行重命名
-            os.rename(old_path, new_path)
-            print(f"成功重命名：{old_path} → {new_path}")
-            sequence_number += 1  # 递增序号
-            
-        except Exception as e:
-            print(f"重命名失败：{old_path} → 错误：{str(e)}")
-            continue
+    for old_name, new_name in renamed:
+        print(f"成功重命名：{old_name} → {new_name}")
+    print(f"共重命名 {len(renamed)} 个文件")
 
 def get_user_input():
     """通过弹窗获取用户输入"""
@@ -2,8 +2,16 @@
 
 from PIL import Image, ImageOps
 import os
-import tempfile
-import re
+import io
+import sys
+
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_index
+import job_journal
+import tiled_io
+import frame_io
+import worker_service
 
 # ========== 用户配置区域 ==========
 input_folder = "./out"       # 需要处理的图片目录
@@ -12,10 +20,22 @@ target_height = 1237               # 目标高度（像素）
 keep_aspect_ratio = False          # 是否保持宽高比
 background_color = (255, 255, 255) # 填充背景色（RGB）
 resample_method = Image.LANCZOS    # 重采样方法
-file_exts = ('.jpg', '.png', '.jpeg', '.webp')  # 支持的文件格式
+file_exts = ('.jpg', '.png', '.jpeg', '.webp', '.tif', '.tiff')  # 支持的文件格式
 # =================================
 
-def resize_image(img):
+def drop_alpha(img):
+    """处理透明通道"""
+    if img.mode in ('RGBA', 'LA'):
+        return img.convert("RGB")
+    return img
+
+def scale_to(img, size, path=None):
+    """缩放到 size；给出原图路径且原图超大时按条带缩放（结果与整幅缩放相同）"""
+    if path and tiled_io.should_tile(img):
+        return tiled_io.resize_tiled(path, size, resample_method, convert=drop_alpha)
+    return drop_alpha(img).resize(size, resample_method)
+
+def resize_image(img, path=None):
     """核心缩放逻辑"""
     original_width, original_height = img.size
     
@@ -31,7 +51,7 @@ def resize_image(img):
         )
         
         # 创建缩放后的图像
-        resized = img.resize(new_size, resample_method)
+        resized = scale_to(img, new_size, path)
         
         # 创建带背景的画布
         final_img = Image.new("RGB", (target_width, target_height), background_color)
@@ -47,75 +67,121 @@ def resize_image(img):
         return final_img
     else:
         # 直接拉伸到目标尺寸
-        return img.resize((target_width, target_height), resample_method)
+        return scale_to(img, (target_width, target_height), path)
 
-def natural_sort_key(s):
-    """自然排序键函数"""
-    return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', s)]
+def resize_file(source, input_path):
+    """缩放一张图片并编码到内存（本进程逐张处理，或由常驻服务的工作进程调用），返回编码后的字节
+    source 为路径或预读的 BytesIO；超大原图不预读，按 input_path 分条带解码
+    """
+    # 只读文件头；超大原图在 resize_image 中按条带解码
+    with tiled_io.open_image(source) as img:
+        # 获取文件扩展名
+        file_ext = os.path.splitext(input_path)[1]
+
+        # 执行缩放（透明通道在缩放前去掉）
+        final_img = resize_image(img, input_path)
+        
+        # 保留EXIF信息（没有时传空字节，编码到内存时不接受None）
+        exif = img.info.get('exif') or b''
+        
+        # 根据扩展名设置保存格式
+        save_format = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.tif': 'TIFF'}.get(file_ext.lower(), file_ext[1:].upper())
+        
+        # 编码到内存
+        buffer = io.BytesIO()
+        final_img.save(
+            buffer,
+            format=save_format,
+            exif=exif,
+            quality=95,
+            subsampling=0 if save_format == 'JPEG' else -1
+        )
+    return buffer.getvalue()
 
 def batch_resize_images():
     processed = 0
+    skipped = 0
+    failed = 0
     
-    # 获取自然排序的文件列表
-    files = sorted([f for f in os.listdir(input_folder)
-                   if f.lower().endswith(file_exts)],
-                   key=natural_sort_key)
+    # 按帧序索引获取文件列表
+    files = frame_index.ordered_files(input_folder, file_exts)
     
+    # 进度日志：中断后重新运行时跳过已缩放的文件，避免重复处理
+    journal = job_journal.JobJournal(
+        input_folder, "resize",
+        [target_width, target_height, keep_aspect_ratio, background_color, int(resample_method)]
+    )
+    todo = []
     for filename in files:
         if not filename.lower().endswith(file_exts):
             continue
-            
-        input_path = os.path.join(input_folder, filename)
-        temp_path = None
+        if journal.done(filename, os.path.join(input_folder, filename)):
+            skipped += 1
+        else:
+            todo.append(filename)
+    
+    def saved(filename):
+        nonlocal processed
+        processed += 1
+        print(f"✅ 已覆盖：{filename}")
+    
+    def submit(filename, data):
+        """后台写临时文件，先记录进度再覆盖原始文件（替换不改变修改时间，续做时可据此判断）"""
+        writer.submit(
+            os.path.join(input_folder, filename), data,
+            record=lambda temp_path, name=filename: journal.record(name, temp_path),
+            done=lambda name=filename: saved(name)
+        )
+    
+    # 常驻服务在运行时交给它的进程池缩放，结果按顺序取回后在这里写盘
+    service = worker_service.connect()
+    if service is not None:
+        print("⚡ 已连接常驻服务，缩放在服务的进程池中进行")
+    
+    # 后台预读后面的文件、后台写盘，主线程只做解码/缩放/编码（交给服务时由工作进程读取）
+    prefetcher = frame_io.Prefetcher([] if service else [os.path.join(input_folder, f) for f in todo])
+    writer = frame_io.WriteBehind()
+    try:
+        if service is not None:
+            paths = [os.path.join(input_folder, f) for f in todo]
+            returned = set()
+            try:
+                for index, data, error in service.map(__file__, "resize_file", [(path, path) for path in paths]):
+                    returned.add(index)
+                    if error is not None:
+                        failed += 1
+                        print(f"❌ 处理 {todo[index]} 失败: {error}")
+                    else:
+                        submit(todo[index], data)
+            except worker_service.ServiceError as e:
+                print(f"⚠️ {e}，其余图片改在本进程处理")
+            service.close()
+            todo = [f for index, f in enumerate(todo) if index not in returned]
         
-        try:
-            with Image.open(input_path) as img:
-                # 获取文件扩展名
-                file_ext = os.path.splitext(filename)[1]
-                
-                # 创建带扩展名的临时文件
-                with tempfile.NamedTemporaryFile(
-                    delete=False,
-                    suffix=file_ext,
-                    dir=os.path.dirname(input_path)
-                ) as tmp_file:
-                    temp_path = tmp_file.name
-
-                # 处理透明通道
-                if img.mode in ('RGBA', 'LA'):
-                    img = img.convert("RGB")
-
-                # 执行缩放
-                final_img = resize_image(img)
-                
-                # 保留EXIF信息
-                exif = img.info.get('exif')
-                
-                # 根据扩展名设置保存格式
-                save_format = 'JPEG' if file_ext.lower() in ('.jpg', '.jpeg') else file_ext[1:].upper()
-                
-                # 保存到临时文件
-                final_img.save(
-                    temp_path,
-                    format=save_format,
-                    exif=exif,
-                    quality=95,
-                    subsampling=0 if save_format == 'JPEG' else -1
-                )
-                
-                # 覆盖原始文件
-                os.replace(temp_path, input_path)
-                processed += 1
-                print(f"✅ 已覆盖：{filename}")
+        for filename in todo:
+            input_path = os.path.join(input_folder, filename)
+            
+            try:
+                submit(filename, resize_file(prefetcher.take(input_path), input_path))
 
-        except Exception as e:
-            print(f"❌ 处理 {filename} 失败: {str(e)}")
-            if temp_path and os.path.exists(temp_path):
-                os.remove(temp_path)
+            except Exception as e:
+                failed += 1
+                print(f"❌ 处理 {filename} 失败: {str(e)}")
+    except BaseException:
+        # 被中断时写完已编码的文件（未完成的临时文件由写盘线程清理），保留进度日志
+        prefetcher.close()
+        writer.close()
+        journal.close()
+        raise
+    prefetcher.close()
+    failed += writer.close()
+    journal.finish(complete=failed == 0)
 
+    if skipped:
+        print(f"\n跳过上次已完成的 {skipped} 张图片")
     print(f"\n处理完成！成功覆盖 {processed} 张图片")
     print(f"输出尺寸：{target_width}x{target_height} 像素")
+    frame_io.report()
 
 if __name__ == "__main__":
     print("警告：此操作将直接覆盖原始文件！")
@@ -1,16 +1,13 @@
 ##### 旋转图片 #####
 import os
-import re
+import sys
 from PIL import Image
 import tempfile
 
-def natural_sort_key(s):
-    """自然排序键函数（处理数字序号排序）
-    参数：s - 文件名
-    返回：混合类型的排序键列表
-    """
-    return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', s)]
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import jpeg_lossless
+import frame_index
 
 def rotate_images_180(folder_path):
     """批量旋转图片180度（按自然顺序）
@@ -20,10 +17,8 @@ def rotate_images_180(folder_path):
     # 支持的图片格式（可扩展）
     image_exts = ('.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp')
     
-    # 获取自然排序的文件列表
-    files = sorted([f for f in os.listdir(folder_path)
-                   if f.lower().endswith(image_exts)],
-                   key=natural_sort_key)
+    # 按帧序索引获取文件列表
+    files = frame_index.ordered_files(folder_path, image_exts)
     
     print(f"找到 {len(files)} 张待处理图片")
     
@@ -41,6 +36,14 @@ def rotate_images_180(folder_path):
             ) as tmp_file:
                 temp_path = tmp_file.name
             
+            # JPEG且尺寸对齐MCU时直接在DCT系数域无损旋转
+            if (filename.lower().endswith(('.jpg', '.jpeg')) and
+                    jpeg_lossless.transform_jpeg_file(file_path, temp_path, Image.Transpose.ROTATE_180)):
+                os.replace(temp_path, file_path)
+                processed += 1
+                print(f"✅ 已无损旋转：{filename}")
+                continue
+            
             # 打开并旋转图片
             with Image.open(file_path) as img:
                 # 旋转180度（expand=True保持原图尺寸）
@@ -1,8 +1,17 @@
 ##### 图片与背景合成 #####
 from PIL import Image
 import os
-import tempfile
-import re
+import io
+import sys
+
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_index
+import job_journal
+import pixel_pipeline
+import frame_io
+import frame_stack
+import worker_service
 
 # ============== 用户配置区域 ==============
 BACKGROUND_PATH = "./background.png"    # 背景图片路径
@@ -11,14 +20,6 @@ EXPECTED_BG_SIZE = (904, 1260)         # 预期背景尺寸（宽×高）
 EXPECTED_FG_SIZE = (876, 1237)         # 预期前景尺寸（宽×高）
 # ========================================
 
-def natural_sort_key(s):
-    """自然排序键函数（处理数字序号排序）
-    参数：s - 文件名
-    返回：混合类型的排序键列表
-    """
-    return [int(text) if text.isdigit() else text.lower() 
-            for text in re.split(r'(\d+)', s)]
-
 def validate_image(img, expected_size, img_type):
     """验证图片尺寸是否符合预期
     参数：
@@ -32,81 +33,175 @@ def validate_image(img, expected_size, img_type):
             f"{img_type}尺寸不符！应为{expected_size}，实际为{actual_size}"
         )
 
+_compositor = None      # (背景文件指纹, Compositor)：常驻服务的工作进程中跨次运行复用已解码的背景
+
+def load_compositor():
+    """加载并验证背景图；背景文件没有变化时直接复用上次解码的结果"""
+    global _compositor
+    stat = os.stat(BACKGROUND_PATH)
+    key = (os.path.abspath(BACKGROUND_PATH), stat.st_size, stat.st_mtime_ns)
+    if _compositor is None or _compositor[0] != key:
+        bg = Image.open(BACKGROUND_PATH)
+        validate_image(bg, EXPECTED_BG_SIZE, "背景图片")
+        # 背景只在需要时按输出模式转换一次；背景无透明时直接按RGB合成
+        _compositor = (key, pixel_pipeline.Compositor(bg))
+    return _compositor[1]
+
+def paste_position():
+    """前景在背景上的居中位置"""
+    return ((EXPECTED_BG_SIZE[0] - EXPECTED_FG_SIZE[0]) // 2,
+            (EXPECTED_BG_SIZE[1] - EXPECTED_FG_SIZE[1]) // 2)
+
+def encode(filename, composite):
+    """编码到内存（格式按原扩展名）"""
+    save_params = {
+        'format': Image.registered_extensions()[os.path.splitext(filename)[1].lower()],
+        'quality': 95,
+        'subsampling': 0 if filename.lower().endswith(('.jpg', '.jpeg')) else -1
+    }
+    buffer = io.BytesIO()
+    composite.save(buffer, **save_params)
+    return buffer
+
+def composite_frame(source, filename):
+    """合成一张前景并编码（本进程逐张处理，或由常驻服务的工作进程调用），返回编码后的字节
+    source 为前景路径或预读的 BytesIO
+    """
+    with Image.open(source) as fg:
+        # 验证前景尺寸
+        validate_image(fg, EXPECTED_FG_SIZE, f"前景图[{filename}]")
+        # 创建合成图像（前景有透明时才作为蒙版；JPEG输出按RGB合成，PNG保留背景透明）
+        return encode(filename, load_compositor().composite(fg, paste_position(), filename)).getvalue()
+
 def batch_composite():
     """批量合成图片到背景（按自然顺序）"""
     try:
-        # 加载并验证背景图
-        bg = Image.open(BACKGROUND_PATH).convert("RGBA")
-        validate_image(bg, EXPECTED_BG_SIZE, "背景图片")
-        print(f"✅ 背景验证通过 | 尺寸：{bg.size[0]}x{bg.size[1]}")
-
-        # 计算居中位置
-        paste_x = (EXPECTED_BG_SIZE[0] - EXPECTED_FG_SIZE[0]) // 2
-        paste_y = (EXPECTED_BG_SIZE[1] - EXPECTED_FG_SIZE[1]) // 2
-        paste_position = (paste_x, paste_y)
-
-        # 获取自然排序的前景文件列表
-        files = sorted(
-            [f for f in os.listdir(FOREGROUND_FOLDER) 
-             if f.lower().endswith(('.png', '.jpg', '.jpeg'))],
-            key=natural_sort_key
-        )
+        # 常驻服务在运行时交给它处理（背景在服务中已解码），否则在本进程加载并验证背景图
+        service = worker_service.connect()
+        if service is None:
+            compositor = load_compositor()
+            print(f"✅ 背景验证通过 | 尺寸：{EXPECTED_BG_SIZE[0]}x{EXPECTED_BG_SIZE[1]}")
+        else:
+            print("⚡ 已连接常驻服务，合成在服务的进程池中进行")
+
+        # 按帧序索引获取前景文件列表
+        files = frame_index.ordered_files(FOREGROUND_FOLDER, ('.png', '.jpg', '.jpeg'))
         print(f"找到 {len(files)} 张待处理前景图")
 
+        # 进度日志：中断后重新运行时跳过已合成的文件，避免重复叠加背景
+        journal = job_journal.JobJournal(
+            FOREGROUND_FOLDER, "composite",
+            [os.path.abspath(BACKGROUND_PATH), EXPECTED_BG_SIZE, EXPECTED_FG_SIZE]
+        )
+
         processed = 0
+        skipped = 0
+        failed = 0
+        todo = []
         for filename in files:
-            fg_path = os.path.join(FOREGROUND_FOLDER, filename)
-            temp_path = None
-            
-            try:
-                with Image.open(fg_path) as fg:
-                    # 验证前景尺寸
-                    validate_image(fg, EXPECTED_FG_SIZE, f"前景图[{filename}]")
-                    
-                    # 创建临时文件（保留原始扩展名）
-                    with tempfile.NamedTemporaryFile(
-                        delete=False,
-                        suffix=os.path.splitext(filename)[1],
-                        dir=FOREGROUND_FOLDER
-                    ) as tmp_file:
-                        temp_path = tmp_file.name
-
-                    # 转换前景为RGBA模式（保留透明度）
-                    if fg.mode != 'RGBA':
-                        fg = fg.convert('RGBA')
-
-                    # 创建合成图像
-                    composite = bg.copy()
-                    composite.paste(fg, paste_position, mask=fg)
-                    
-                    # 转换为RGB模式保存（兼容所有格式）
-                    if composite.mode == 'RGBA':
-                        composite = composite.convert('RGB')
-                    
-                    # 保存到临时文件
-                    save_params = {
-                        'quality': 95,
-                        'subsampling': 0 if filename.lower().endswith(('.jpg', '.jpeg')) else -1
-                    }
-                    composite.save(temp_path, **save_params)
-                    
-                    # 原子替换原文件
-                    os.replace(temp_path, fg_path)
-                    processed += 1
-                    print(f"✅ 已合成：{filename}")
-
-            except Exception as e:
-                print(f"❌ 处理失败 {filename}: {str(e)}")
-                if temp_path and os.path.exists(temp_path):
-                    os.remove(temp_path)
-                continue
+            if journal.done(filename, os.path.join(FOREGROUND_FOLDER, filename)):
+                skipped += 1
+            else:
+                todo.append(filename)
+
+        def saved(filename):
+            nonlocal processed
+            processed += 1
+            pixel_pipeline.frame_done()
+            print(f"✅ 已合成：{filename}")
+
+        def submit(filename, data):
+            """后台写临时文件，先记录进度再原子替换原文件"""
+            writer.submit(
+                os.path.join(FOREGROUND_FOLDER, filename), data,
+                record=lambda temp_path, name=filename: journal.record(name, temp_path),
+                done=lambda name=filename: saved(name)
+            )
+
+        # 尺寸、模式都相同的前景按内存预算分批读成一个数组，整批合成到背景上；其余逐张合成
+        shape = None
+        if service is None and frame_stack.available(len(todo)):
+            shape = frame_stack.uniform([os.path.join(FOREGROUND_FOLDER, f) for f in todo])
+        batched = shape is not None and shape[0] == EXPECTED_FG_SIZE
+        single = [] if batched or service is not None else todo
+
+        # 后台预读后面的前景图、后台写盘，主线程只做解码/合成/编码（交给服务时由工作进程读取）
+        prefetcher = frame_io.Prefetcher([] if service else [os.path.join(FOREGROUND_FOLDER, f) for f in todo])
+        writer = frame_io.WriteBehind()
+        try:
+            if service is not None:
+                results = service.map(__file__, "composite_frame",
+                                      [(os.path.join(FOREGROUND_FOLDER, f), f) for f in todo])
+                returned = set()
+                try:
+                    for index, data, error in results:
+                        returned.add(index)
+                        if error is not None:
+                            failed += 1
+                            print(f"❌ 处理失败 {todo[index]}: {error}")
+                        else:
+                            submit(todo[index], data)
+                except worker_service.ServiceError as e:
+                    print(f"⚠️ {e}，其余图片改在本进程处理")
+                    single = [f for index, f in enumerate(todo) if index not in returned]
+                service.close()
+
+            if batched:
+                size, mode = shape
+                background = compositor.background(compositor.mode)
+                for batch in frame_stack.batches(todo, size, mode):
+                    try:
+                        stack = frame_stack.load(
+                            [prefetcher.take(os.path.join(FOREGROUND_FOLDER, f)) for f in batch], size, mode)
+                        stack, stack_mode = frame_stack.composite(stack, mode, background, paste_position())
+                        pixel_pipeline.count("copy", len(batch))
+                    except Exception:
+                        single.extend(batch)    # 改为逐张处理，以便定位出错的文件
+                        continue
+
+                    def encode_frame(index):
+                        # JPEG输出按RGB，PNG保留背景透明
+                        out_mode = pixel_pipeline.mode_for_file(batch[index], stack_mode)
+                        return encode(batch[index], frame_stack.frame(
+                            frame_stack.convert(stack[index:index + 1], stack_mode, out_mode), 0, out_mode)).getbuffer()
+
+                    # 各帧并行编码，按顺序交给后台写盘
+                    for index, buffer, error in frame_stack.map_frames(encode_frame, range(len(batch))):
+                        if error is not None:
+                            failed += 1
+                            print(f"❌ 处理失败 {batch[index]}: {str(error)}")
+                        else:
+                            submit(batch[index], buffer)
+                    del stack
+
+            for filename in single:
+                fg_path = os.path.join(FOREGROUND_FOLDER, filename)
+                
+                try:
+                    submit(filename, composite_frame(prefetcher.take(fg_path), filename))
+
+                except Exception as e:
+                    failed += 1
+                    print(f"❌ 处理失败 {filename}: {str(e)}")
+                    continue
+        except BaseException:
+            # 被中断时写完已编码的文件（未完成的临时文件由写盘线程清理），保留进度日志
+            prefetcher.close()
+            writer.close()
+            journal.close()
+            raise
+        prefetcher.close()
+        failed += writer.close()
+        journal.finish(complete=failed == 0)
 
+        if skipped:
+            print(f"\n跳过上次已完成的 {skipped} 张图片")
         print(f"\n处理完成！成功合成 {processed}/{len(files)} 张图片")
+        pixel_pipeline.report()
+        frame_io.report()
 
     except Exception as e:
         print(f"❌ 全局错误：{str(e)}")
-        if 'bg' in locals():
-            bg.close()
 
 if __name__ == "__main__":
     print("=== 图片合成程序 ===")
@@ -2,13 +2,27 @@
 
 from PIL import Image
 import os
+import sys
+
+# 共享模块位于上级目录（ZZZmodWorkflow）
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import frame_index
+import sheet_builder
+import frame_io
+import grid_layout
+import frame_resample
+import palette_quant
+import png_parallel
 
 # ========== 用户配置区 ==========
 input_folder = "./out"     # 输入文件夹
 output_path = "./stitchingOutput.jpg"  # 输出路径
-columns = 4                  # 每行column张（必须定义）
-rows = 6                     # 每列rows张（必须定义）
-imageNumber = 25                   # 需要imageNumber张图片
+columns = None               # 每行column张，None 为按帧数自动排版（见 grid_layout）
+rows = None                  # 每列rows张，与 columns 一起设置或一起为 None
+imageNumber = None                 # 需要imageNumber张图片，None 为有几张用几张
+resampleMode = "stride"      # 帧数不是 imageNumber 时的重采样方式：stride 等间隔抽帧 / nearest 最近时间戳 / blend 相邻帧混合，None 为报错
+paletteColors = None         # 量化成8位索引PNG的颜色数（2~256，所有帧共用一个调色板），None 为保持24位；只对PNG输出有效
+paletteDither = False        # 量化时使用Floyd-Steinberg抖动
 # ================================
 
 # 自动创建文件夹
@@ -18,36 +32,120 @@ if not os.path.exists(input_folder):
 
 print(f"当前工作目录：{os.getcwd()}")
 
-# 读取图片
+# 按帧序列出图片
 try:
-    images = [Image.open(os.path.join(input_folder, f)) 
-            for f in sorted(os.listdir(input_folder))
-            if f.endswith(('.png', '.jpg', '.jpeg'))]
+    paths = frame_index.ordered_paths(input_folder, ('.png', '.jpg', '.jpeg'))
 except FileNotFoundError:
     print(f"错误：文件夹 {os.path.abspath(input_folder)} 不存在")
     exit()
 
-# 校验图片数量
-assert len(images) == imageNumber, f"需要192张图片，当前找到{len(images)}张"
+# 帧数不是 imageNumber 时重采样成正好 imageNumber 帧，不必手动删帧
+samples = [frame_resample.Sample(path) for path in paths]
+if imageNumber is not None and len(paths) != imageNumber:
+    assert resampleMode, f"需要{imageNumber}张图片，当前找到{len(paths)}张"
+    samples = frame_resample.plan(paths, imageNumber, resampleMode)
+    print(frame_resample.describe(samples, len(paths)))
+
+# 获取基准尺寸（只读文件头）
+with Image.open(samples[0].path) as first_image:
+    img_width, img_height = first_image.size
+
+# 未设置行列数时按帧数自动排版（必要时缩小单帧）；超过 sheet_builder.MAX_SHEET_SIZE 时自动拆成多页
+if rows is None or columns is None:
+    plan = grid_layout.solve(len(samples), (img_width, img_height))
+    print(plan.describe())
+    layout = plan.layout
+else:
+    layout = sheet_builder.SheetLayout(rows, columns, (img_width, img_height))
+print(f"拼接图尺寸：{layout.describe()}")
+
+
+def open_frame(resampler, index):
+    """取出第 index 帧（混合帧即时生成），自动排版缩小了单帧时缩放到格子尺寸"""
+    img = resampler.load(index)
+    if layout.tile_size != (img_width, img_height) and img.size != layout.tile_size:
+        with img:
+            return img.resize(layout.tile_size, Image.LANCZOS)
+    return img
+
+
+# 调色板量化：所有页共用一个调色板，存为8位索引PNG
+quantize = bool(paletteColors) and png_parallel.is_png(output_path)
+if paletteColors and not quantize:
+    print("⚠️ 调色板量化只支持PNG输出，本次仍保存为24位")
+params = {"palette": [paletteColors, paletteDither, palette_quant.METHOD]} if quantize else None
+page_paths = [layout.page_path(output_path, page) for page in range(layout.pages)]
+save_args = {"quality": 95}
+requantize = False      # 各页写好后是否还要整体量化
 
-# 获取基准尺寸
-img_width, img_height = images[0].size
+# 与上次拼接的索引比较：排版没变时只重贴内容变了的格子，否则整张重新拼接
+changed, sources = layout.changed_frames(
+    output_path, [sample.path for sample in samples], params,
+    blends=[(sample.next_path, sample.weight) if sample.blended else None for sample in samples])
+if changed is None:
+    # 拼接图片：后台按顺序预读后面的帧，每帧贴完即释放；每页拼完交给后台编码，同时拼下一页
+    prefetcher = frame_io.Prefetcher(frame_resample.source_paths(samples))
+    resampler = frame_resample.Resampler(samples, lambda path: Image.open(prefetcher.take(path)))
+    encoder = sheet_builder.PageEncoder()
+    # 要量化且各页放得进内存时，拼完所有页后直接在内存中量化再编码
+    quantizer = palette_quant.PageQuantizer(encoder, paletteColors, paletteDither) \
+        if quantize and palette_quant.fits_in_memory(layout) else None
+    if quantize and quantizer is None:
+        requantize = True
+        save_args["compress_level"] = 1     # 之后还要读回量化，先快速压缩
+    try:
+        for page in range(layout.pages):
+            canvas = encoder.new_page(layout, (0, 0, 0))
+            for index in layout.page_frames(page):
+                if index >= len(samples):
+                    break       # 自动排版时最后几格留空
+                with open_frame(resampler, index) as img:
+                    canvas.paste(img, layout.position(index))
+            (quantizer or encoder).submit(canvas, page_paths[page], **save_args)
+        if quantizer is not None:
+            raw_bytes = quantizer.close()
+    finally:
+        if quantizer is not None:
+            quantizer.abort()
+        prefetcher.close()
+        encoder.close()
+    if quantizer is not None:
+        print(palette_quant.describe(raw_bytes, sum(os.path.getsize(path) for path in page_paths),
+                                     paletteColors, paletteDither))
+elif changed:
+    # 有损格式的页按源帧整页重建，同页其它格子也要读取
+    cells = layout.patch_cells(output_path, changed)
+    prefetcher = frame_io.Prefetcher(frame_resample.source_paths([samples[i] for i in cells if i < len(samples)]))
+    resampler = frame_resample.Resampler(samples, lambda path: Image.open(prefetcher.take(path)))
 
-# 创建画布（修正变量使用）
-canvas = Image.new('RGB', 
-                  (columns * img_width, rows * img_height))
+    def load(index):
+        # 本次没有对应帧的格子留空
+        return open_frame(resampler, index) if index < len(samples) else None
 
-# 拼接图片
-for row in range(rows):
-    for col in range(columns):
-        index = row * columns + col
-        position = (col * img_width, row * img_height)
-        canvas.paste(images[index], position)
+    if quantize:
+        requantize = True
+        save_args["compress_level"] = 1     # 之后整张重新量化，先快速压缩
+    try:
+        for index, error in layout.patch_pages(output_path, changed, load, (0, 0, 0), **save_args):
+            if error is not None:
+                sources[index]["hash"] = None      # 下次运行时重试
+                print(f"❌ 加载失败：{samples[index].describe()}（{str(error)}），该格暂为空白")
+    finally:
+        prefetcher.close()
+    print(f"增量更新 {len(changed)} 格：{', '.join(samples[i].describe() for i in changed[:5] if i < len(samples))}"
+          f"{' …' if len(changed) > 5 else ''}")
+else:
+    print("所有帧与上次拼接相同，无需更新")
 
-# 保存结果
-canvas.save(output_path, quality=95)
-print(f"拼接完成！保存至：{os.path.abspath(output_path)}")
+# 页数太多放不进内存、或增量更新过：各页写好后再整体量化（重新构建全局调色板）
+if requantize:
+    raw_bytes = palette_quant.quantize_pages(page_paths, paletteColors, paletteDither)
+    print(palette_quant.describe(raw_bytes, sum(os.path.getsize(path) for path in page_paths),
+                                 paletteColors, paletteDither))
 
-# 释放内存
-for img in images:
-    img.close()
\ No newline at end of file
+# 保存页/帧索引，供INI按帧寻址
+index_file = layout.write_index(output_path, [sample.name for sample in samples], sources, params)
+print(f"拼接完成！保存至：{os.path.abspath(output_path)}"
+      f"{f'（共{layout.pages}页）' if layout.pages > 1 else ''}")
+print(f"页/帧索引：{os.path.abspath(index_file)}")
+frame_io.report()